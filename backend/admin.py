@@ -8,8 +8,13 @@ Currently includes moderator management and user blocking/restoration.
 Only accessible to User ID 1 (administrator) and moderators.
 """
 
-from flask import Blueprint, render_template, redirect, url_for, flash, request, session, abort
+import sqlite3
+from flask import Blueprint, render_template, redirect, url_for, flash, request, session, abort, jsonify
+from typing import List
+from backend import moderation_jobs, permissions
+from backend.config import Config
 from backend.database import get_db
+from backend.taxonomy import MODERATION_GROUP, get_taxonomy
 from functools import wraps
 
 admin_blueprint = Blueprint("admin", __name__)
@@ -35,23 +40,34 @@ def moderator_required(f):
         if user_id == 1:
             return f(*args, **kwargs)
             
-        # Check if user is a moderator
-        with get_db() as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT EXISTS (
-                    SELECT 1 FROM moderators
-                    WHERE user_id = ?
-                )
-            """, (user_id,))
-            is_moderator = bool(cursor.fetchone()[0])
-            
-        if not is_moderator:
+        if not permissions.is_moderator(fresh=True):
             abort(403)
             
         return f(*args, **kwargs)
     return decorated_function
 
+def find_users(cursor, prefix: str = '', after: str = '', limit: int = Config.ADMIN_USERS_PER_PAGE) -> List[sqlite3.Row]:
+    """
+    Regular users (not the administrator or moderators) whose username
+    starts with prefix, in username order after the cursor `after`. A range
+    seek on the username index, so the cost depends on limit, not on the
+    number of users.
+    """
+    cursor.execute("""
+        SELECT u.id, u.username, u.filter_group_count as active_groups
+        FROM users u
+        WHERE u.username >= ? AND u.username < ? AND u.username > ?
+          AND u.id != 1
+          AND NOT EXISTS (SELECT 1 FROM moderators WHERE user_id = u.id)
+        ORDER BY u.username
+        LIMIT ?
+    """, (prefix, prefix + chr(0x10FFFF), after, limit))
+    return cursor.fetchall()
+
+def _directory_query() -> str:
+    """Username prefix typed into a directory search."""
+    return request.args.get('q', '').strip().lower()
+
 @admin_blueprint.route("/moderators")
 @admin_required
 def manage_moderators():
@@ -68,23 +84,26 @@ def manage_moderators():
         """)
         moderators = cursor.fetchall()
         
-        # Get other users (non-moderators)
-        cursor.execute("""
-            SELECT u.id, u.username
-            FROM users u
-            WHERE u.id NOT IN (
-                SELECT user_id FROM moderators
-            )
-            ORDER BY u.username
-        """)
-        users = cursor.fetchall()
-        
+    # Candidates are looked up as the administrator types (api_users)
     return render_template(
         "admin/moderators.html", 
-        moderators=moderators,
-        users=users
+        moderators=moderators
     )
 
+@admin_blueprint.route("/api/users")
+@moderator_required
+def api_users():
+    """Typeahead: regular users whose username starts with q."""
+    prefix = _directory_query()
+    if not prefix:
+        return jsonify([])
+    with get_db() as conn:
+        users = find_users(conn.cursor(), prefix, limit=Config.USER_TYPEAHEAD_LIMIT)
+    return jsonify([{
+        'id': user['id'],
+        'username': user['username']
+    } for user in users])
+
 @admin_blueprint.route("/moderators/add", methods=["POST"])
 @admin_required
 def add_moderator():
@@ -176,22 +195,8 @@ def update_user_groups():
     filtered_groups = request.form.getlist('group_id', type=int)
     
     with get_db() as conn:
-        cursor = conn.cursor()
-        
-        # Get all groups
-        cursor.execute("SELECT id FROM groups")
-        all_groups = [row['id'] for row in cursor.fetchall()]
-        
-        # Update each group's filter status
-        for group_id in all_groups:
-            # Determine if this group should be filtered on
-            filter_on = 1 if group_id in filtered_groups else 0
-            
-            # Update or insert the user_group record
-            cursor.execute("""
-                INSERT OR REPLACE INTO user_groups (user_id, group_id, filter_on, updated_at)
-                VALUES (?, ?, ?, CURRENT_TIMESTAMP)
-            """, (user_id, group_id, filter_on))
+        # Only groups whose filter status changes are written
+        permissions.set_group_filters(conn.cursor(), user_id, filtered_groups)
     
     flash("Group preferences updated successfully")
     return redirect(url_for('admin.user_groups'))
@@ -200,22 +205,18 @@ def update_user_groups():
 @moderator_required
 def block_users():
     """View and block/restore users."""
+    query = _directory_query()
+    after = request.args.get('after', '')
+    
     with get_db() as conn:
         cursor = conn.cursor()
         
-        # Get all non-admin/non-moderator users
-        cursor.execute("""
-            SELECT u.id, u.username,
-                   (SELECT COUNT(*) FROM user_groups 
-                    WHERE user_id = u.id AND filter_on = 1) as active_groups,
-                   (SELECT COUNT(*) FROM user_groups 
-                    WHERE user_id = u.id) as total_groups
-            FROM users u
-            WHERE u.id != 1 
-            AND u.id NOT IN (SELECT user_id FROM moderators)
-            ORDER BY u.username
-        """)
-        users = cursor.fetchall()
+        # One page of non-admin/non-moderator users, plus one to detect more
+        users = find_users(cursor, query, after, Config.ADMIN_USERS_PER_PAGE + 1)
+        next_after = None
+        if len(users) > Config.ADMIN_USERS_PER_PAGE:
+            users = users[:Config.ADMIN_USERS_PER_PAGE]
+            next_after = users[-1]['username']
         
         # Get moderators for display (to show they can't be blocked)
         cursor.execute("""
@@ -231,12 +232,57 @@ def block_users():
         """)
         protected_users = cursor.fetchall()
         
+        jobs = moderation_jobs.recent_jobs(cursor)
+    
+    # Resume jobs left behind by a worker that went away
+    if any(job['status'] in ('queued', 'running') for job in jobs):
+        moderation_jobs.ensure_runner()
+        
     return render_template(
         "admin/block_users.html", 
         users=users,
-        protected_users=protected_users
+        protected_users=protected_users,
+        query=query,
+        after=after,
+        next_after=next_after,
+        jobs=jobs
     )
 
+@admin_blueprint.route("/users/bulk", methods=["POST"])
+@moderator_required
+def bulk_users():
+    """Block or restore the selected users as a background job."""
+    action = request.form.get('action')
+    user_ids = request.form.getlist('user_id', type=int)
+    back = url_for('admin.block_users', q=request.form.get('q') or None,
+                   after=request.form.get('after') or None)
+    
+    if action not in ('block', 'restore'):
+        abort(400)
+    if not user_ids:
+        flash("No users selected")
+        return redirect(back)
+    
+    params = {}
+    if action == 'block':
+        moderation_group = get_taxonomy().group_named(MODERATION_GROUP)
+        if not moderation_group:
+            flash("Moderation group not found")
+            return redirect(back)
+        params['group_id'] = moderation_group.id
+    
+    job_id = moderation_jobs.submit_job(action, user_ids, session['user_id'], params)
+    flash(f"Queued job #{job_id}: {action} {len(user_ids)} users")
+    return redirect(back)
+
+@admin_blueprint.route("/api/jobs")
+@moderator_required
+def api_jobs():
+    """Progress of the latest moderation jobs."""
+    with get_db() as conn:
+        jobs = moderation_jobs.recent_jobs(conn.cursor())
+    return jsonify(jobs)
+
 @admin_blueprint.route("/users/block/<int:user_id>", methods=["POST"])
 @moderator_required
 def block_user(user_id):
@@ -263,20 +309,13 @@ def block_user(user_id):
             return redirect(url_for('admin.block_users'))
             
         # Find Moderation group ID
-        cursor.execute("SELECT id FROM groups WHERE grouptext = 'Moderation'")
-        moderation_group = cursor.fetchone()
+        moderation_group = get_taxonomy().group_named(MODERATION_GROUP)
         if not moderation_group:
             flash("Moderation group not found")
             return redirect(url_for('admin.block_users'))
             
-        # Remove all user_groups entries for this user
-        cursor.execute("DELETE FROM user_groups WHERE user_id = ?", (user_id,))
-        
-        # Add only the Moderation group with filter_on = 1
-        cursor.execute("""
-            INSERT INTO user_groups (user_id, group_id, filter_on)
-            VALUES (?, ?, 1)
-        """, (user_id, moderation_group['id']))
+        # Filter on the Moderation group only
+        permissions.set_group_filters(cursor, user_id, [moderation_group.id])
         
         flash(f"User {user['username']} has been restricted to Moderation group only")
     
@@ -296,18 +335,8 @@ def restore_user(user_id):
             flash("User not found")
             return redirect(url_for('admin.block_users'))
             
-        # Remove all user_groups entries for this user
-        cursor.execute("DELETE FROM user_groups WHERE user_id = ?", (user_id,))
-        
-        # Add all groups with filter_on = 1
-        cursor.execute("SELECT id FROM groups")
-        groups = cursor.fetchall()
-        
-        for group in groups:
-            cursor.execute("""
-                INSERT INTO user_groups (user_id, group_id, filter_on)
-                VALUES (?, ?, 1)
-            """, (user_id, group['id']))
+        # Filter on every group again
+        permissions.set_group_filters(cursor, user_id, None)
         
         flash(f"User {user['username']} has been restored access to all groups")
     
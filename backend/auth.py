@@ -14,87 +14,128 @@ Features:
 """
 
 from flask import Blueprint, render_template, request, redirect, url_for, session, flash
-from typing import Tuple, List, Dict
+from typing import Callable, Tuple, List, Dict, Optional, Union
 import secrets
 import hashlib
-import time
+import sqlite3
+import threading
+from collections import OrderedDict
 from functools import wraps
 from backend.database import get_db
 from backend.config import Config
+from backend.rate_limits import get_limiter
+from backend.usernames import SYLLABLES, UsernamesExhausted, allocate_username
 
 auth_blueprint = Blueprint("auth", __name__)
 
 def generate_six_char_string() -> str:
     """Generate a random 6-character username or token using syllables."""
-    consonants = "bfgkhlnrstvwy"
-    vowels = "aeiou"
-    syllables = [c + v for c in consonants for v in vowels]
-    return "".join(secrets.choice(syllables) for _ in range(3))
+    return "".join(secrets.choice(SYLLABLES) for _ in range(3))
 
 def hash_value(value: str) -> str:
     """Hash a value using configured algorithm (SHA-512)."""
     return hashlib.new(Config.HASH_ALGORITHM, value.encode()).hexdigest()
 
+# Bytes of the token hash kept in user_tokens
+TOKEN_DIGEST_SIZE = 16
+# One-time tokens a user_tokens row can hold: one bit each in the 64-bit used
+MAX_ONE_TIME_TOKENS = 63
+
+def token_digest(token_hash: str) -> bytes:
+    """Truncated binary form of a hash_value() hex digest."""
+    return bytes.fromhex(token_hash)[:TOKEN_DIGEST_SIZE]
+
+def pack_digests(token_hashes: List[str]) -> bytes:
+    """Concatenate truncated digests into one user_tokens column."""
+    return b"".join(token_digest(token_hash) for token_hash in token_hashes)
+
+def find_digest(packed: bytes, digest: bytes) -> Optional[int]:
+    """Slot of digest in a packed column, or None."""
+    start = packed.find(digest)
+    while start != -1:
+        if start % TOKEN_DIGEST_SIZE == 0:
+            return start // TOKEN_DIGEST_SIZE
+        start = packed.find(digest, start + 1)
+    return None
+
 def generate_tokens() -> Dict[str, List[Tuple[str, str]]]:
-    """Generate permanent and one-time tokens with their hashes."""
-    permanent = [(t := generate_six_char_string(), hash_value(t)) 
-                for _ in range(Config.PERMANENT_TOKEN_COUNT)]
-    one_time = [(t := generate_six_char_string(), hash_value(t)) 
-                for _ in range(Config.ONE_TIME_TOKEN_COUNT)]
-    return {"permanent": permanent, "one_time": one_time}
-
-def generate_unique_username():
-    """Generate a unique 6-character username from syllables."""
-    while True:
-        username = generate_six_char_string()
-        with get_db() as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT 1 FROM users WHERE username = ?", (username,))
-            if not cursor.fetchone():
-                return username
+    """
+    Generate permanent and one-time tokens with their hashes.
+    A new user has no tokens yet, so drawing distinct values is enough
+    to make them unique for that user.
+    """
+    count = Config.PERMANENT_TOKEN_COUNT + Config.ONE_TIME_TOKEN_COUNT
+    drawn = set()
+    while len(drawn) < count:
+        drawn.add(generate_six_char_string())
+    tokens = [(token, hash_value(token)) for token in drawn]
+    return {
+        "permanent": tokens[:Config.PERMANENT_TOKEN_COUNT],
+        "one_time": tokens[Config.PERMANENT_TOKEN_COUNT:]
+    }
 
-def generate_unique_token(user_id):
-    """Generate a token that doesn't exist for this user."""
+def create_user(cursor, language: str) -> Tuple[int, str]:
+    """
+    Insert a user under a random unused username; returns (id, username).
+    Names come from the username pool; without a pool (database not yet
+    migrated) random names are drawn until the UNIQUE constraint accepts one.
+    Raises UsernamesExhausted when the namespace is used up.
+    """
     while True:
-        token = generate_six_char_string()
-        token_hash = hash_value(token)
-        with get_db() as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                "SELECT 1 FROM tokens WHERE user_id = ? AND token_hash = ?", 
-                (user_id, token_hash)
-            )
-            if not cursor.fetchone():
-                return token, token_hash
-
-def generate_tokens(user_id):
-    """Generate 3 permanent and 50 one-time unique tokens."""
-    permanent = [generate_unique_token(user_id) for _ in range(Config.PERMANENT_TOKEN_COUNT)]
-    one_time = [generate_unique_token(user_id) for _ in range(Config.ONE_TIME_TOKEN_COUNT)]
-    return {"permanent": permanent, "one_time": one_time}
-
-# Rate limiting implementation
-_rate_limits = {}
+        try:
+            username = allocate_username(cursor)
+        except sqlite3.OperationalError as e:
+            if 'no such table' not in str(e):
+                raise
+            username = generate_six_char_string()
+        cursor.execute("""
+            INSERT INTO users (username, language) VALUES (?, ?)
+            ON CONFLICT (username) DO NOTHING
+        """, (username, language))
+        if cursor.rowcount:
+            return cursor.lastrowid, username
+
+def register_user(language: str) -> Tuple[str, Dict[str, List[Tuple[str, str]]]]:
+    """
+    Create a user with their tokens and default group filters in one short
+    transaction; returns the username and the generated tokens.
+    """
+    tokens = generate_tokens()
+    with get_db() as conn:
+        cursor = conn.cursor()
+        user_id, username = create_user(cursor, language)
+        
+        # All tokens in one row; the used bitmap starts empty
+        cursor.execute("""
+            INSERT INTO user_tokens (user_id, permanent, one_time)
+            VALUES (?, ?, ?)
+        """, (user_id,
+              pack_digests([hash for token, hash in tokens["permanent"]]),
+              pack_digests([hash for token, hash in tokens["one_time"]])))
+        
+        # Filter on every group by default
+        cursor.execute("""
+            INSERT INTO user_groups (user_id, group_id, filter_on)
+            SELECT ?, id, 1 FROM groups
+        """, (user_id,))
+    return username, tokens
 
 def rate_limit(max_requests: int = Config.MAX_REQUESTS_PER_WINDOW, 
-               window: int = Config.RATE_LIMIT_WINDOW):
-    """Rate limiting decorator."""
+               window: int = Config.RATE_LIMIT_WINDOW,
+               cost: Union[float, Callable[[], float]] = 1):
+    """
+    Rate limiting decorator.
+
+    Each client address gets max_requests tokens per window, shared by all
+    limited routes and all workers. cost is what one request spends, or a
+    callable computing it from the request (e.g. inline_image_cost()).
+    """
     def decorator(f):
         @wraps(f)
         def wrapped(*args, **kwargs):
-            now = time.time()
-            ip = request.remote_addr
-            
-            # Initialize or clean old requests
-            if ip not in _rate_limits:
-                _rate_limits[ip] = []
-            _rate_limits[ip] = [t for t in _rate_limits[ip] if now - t < window]
-            
-            # Check limit
-            if len(_rate_limits[ip]) >= max_requests:
+            spend = cost() if callable(cost) else cost
+            if not get_limiter().consume(request.remote_addr, spend, max_requests, window):
                 return "Rate limit exceeded", 429
-            
-            _rate_limits[ip].append(now)
             return f(*args, **kwargs)
         return wrapped
     return decorator
@@ -112,33 +153,11 @@ def register():
         if language not in Config.SUPPORTED_LANGUAGES:
             flash("Unsupported language")
             return redirect(url_for("auth.register"))
-        username = generate_unique_username()
-        
-        with get_db() as conn:
-            cursor = conn.cursor()
-            cursor.execute("INSERT INTO users (username, language) VALUES (?, ?)", 
-                         (username, language))
-            user_id = cursor.lastrowid
-            
-            # Generate and store tokens
-            tokens = generate_tokens(user_id)
-
-            for token, hash in tokens["permanent"]:
-                cursor.execute("INSERT INTO tokens (user_id, token_hash, one_time) VALUES (?, ?, ?)", 
-                             (user_id, hash, False))
-            for token, hash in tokens["one_time"]:
-                cursor.execute("INSERT INTO tokens (user_id, token_hash, one_time) VALUES (?, ?, ?)", 
-                             (user_id, hash, True))
-                             
-            # Get all groups and populate user_groups
-            cursor.execute("SELECT id FROM groups")
-            groups = cursor.fetchall()
-            
-            for group in groups:
-                cursor.execute("""
-                    INSERT INTO user_groups (user_id, group_id, filter_on)
-                    VALUES (?, ?, 1)
-                """, (user_id, group['id']))
+        try:
+            username, tokens = register_user(language)
+        except UsernamesExhausted:
+            flash("Registration is closed: no usernames are left")
+            return redirect(url_for("auth.register"))
 
         return render_template("auth/confirm_tokens.html", 
                                 username=username, 
@@ -152,6 +171,97 @@ def confirm_registration():
     """Handle confirmation after tokens are displayed."""
     return redirect(url_for('home'))
 
+# username -> user id, most recently used last. Usernames are never reused,
+# so entries only need evicting for size.
+_user_ids: 'OrderedDict[str, int]' = OrderedDict()
+_user_ids_lock = threading.Lock()
+
+def lookup_user_id(cursor, username: str) -> Optional[int]:
+    """User id for a username, memoized per worker."""
+    with _user_ids_lock:
+        user_id = _user_ids.get(username)
+        if user_id is not None:
+            _user_ids.move_to_end(username)
+            return user_id
+
+    cursor.execute("SELECT id FROM users WHERE username = ?", (username,))
+    row = cursor.fetchone()
+    if row is None:
+        return None  # Unknown names are not memoized, so guessing cannot flood it
+
+    with _user_ids_lock:
+        _user_ids[username] = row[0]
+        if len(_user_ids) > Config.LOGIN_MEMO_SIZE:
+            _user_ids.popitem(last=False)
+    return row[0]
+
+def authenticate(cursor, username: str, token_hash: str) -> Optional[sqlite3.Row]:
+    """
+    Check a username and token, spending the token if it is one-time.
+    Returns the user's id, username and language, or None.
+    """
+    user_id = lookup_user_id(cursor, username)
+    if user_id is None:
+        return None
+
+    # One primary key probe decides most attempts
+    try:
+        cursor.execute("SELECT permanent, one_time FROM user_tokens WHERE user_id = ?", (user_id,))
+        tokens = cursor.fetchone()
+    except sqlite3.OperationalError as e:
+        # Database not yet migrated: every user is still in tokens
+        if 'no such table' not in str(e):
+            raise
+        tokens = None
+    if tokens is None:
+        valid = _check_legacy_token(cursor, user_id, token_hash)
+    else:
+        valid = check_token(cursor, user_id, tokens, token_hash)
+    if not valid:
+        return None
+
+    cursor.execute("""
+        UPDATE users SET last_seen_at = CURRENT_TIMESTAMP
+        WHERE id = ?
+        RETURNING id, username, language
+    """, (user_id,))
+    return cursor.fetchone()
+
+def check_token(cursor, user_id: int, tokens: sqlite3.Row, token_hash: str) -> bool:
+    """Check a token against the user's user_tokens row; spend it if one-time."""
+    digest = token_digest(token_hash)
+    if find_digest(tokens['permanent'], digest) is not None:
+        return True
+
+    slot = find_digest(tokens['one_time'], digest)
+    if slot is None:
+        return False
+    # Flip the slot's used bit; no row changes if it was already spent
+    cursor.execute("""
+        UPDATE user_tokens SET used = used | ?
+        WHERE user_id = ? AND used & ? = 0
+    """, (1 << slot, user_id, 1 << slot))
+    return cursor.rowcount == 1
+
+def _check_legacy_token(cursor, user_id: int, token_hash: str) -> bool:
+    """Token check for users not yet moved by migrate-tokens."""
+    # Answered from idx_tokens_user_hash without touching the table
+    cursor.execute("""
+        SELECT id, one_time FROM tokens
+        WHERE user_id = ? AND token_hash = ?
+    """, (user_id, token_hash))
+    token = cursor.fetchone()
+    if not token:
+        return False
+    if token['one_time']:
+        cursor.execute("DELETE FROM tokens WHERE id = ?", (token['id'],))
+    else:
+        cursor.execute(
+            "UPDATE tokens SET last_used_at = CURRENT_TIMESTAMP WHERE id = ?",
+            (token['id'],)
+        )
+    return True
+
 @auth_blueprint.route("/login", methods=["GET", "POST"])
 @rate_limit()
 def login():
@@ -162,39 +272,15 @@ def login():
         token_hash = hash_value(token)
 
         with get_db() as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT users.id, users.username, users.language,
-                       tokens.id as token_id, tokens.one_time
-                FROM users 
-                JOIN tokens ON users.id = tokens.user_id 
-                WHERE users.username = ? AND tokens.token_hash = ?
-            """, (username, token_hash))
-            result = cursor.fetchone()
-
-            if not result:
+            user = authenticate(conn.cursor(), username, token_hash)
+
+            if not user:
                 flash("Invalid username or token")
                 return redirect(url_for("auth.login"))
 
-            user_id, username, language, token_id, one_time = result
-            
-            # Update user and token last_seen
-            cursor.execute(
-                "UPDATE users SET last_seen_at = CURRENT_TIMESTAMP WHERE id = ?",
-                (user_id,)
-            )
-            cursor.execute(
-                "UPDATE tokens SET last_used_at = CURRENT_TIMESTAMP WHERE id = ?",
-                (token_id,)
-            )
-            
-            # Delete one-time token if used
-            if one_time:
-                cursor.execute("DELETE FROM tokens WHERE id = ?", (token_id,))
-
-            session["user_id"] = user_id
-            session["user"] = username
-            session["language"] = language
+            session["user_id"] = user['id']
+            session["user"] = user['username']
+            session["language"] = user['language']
             
             return redirect(url_for("home"))
 
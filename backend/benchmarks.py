@@ -0,0 +1,314 @@
+"""
+Benchmarks
+==========
+
+Micro-benchmarks for the hot paths of the forum.
+Each benchmark prints a small table and touches no real data.
+
+Usage (from the repository root):
+    python -m backend.benchmarks images
+    python -m backend.benchmarks render
+    python -m backend.benchmarks sanitize
+    python -m backend.benchmarks register
+    python -m backend.benchmarks login [--users N] [--legacy]
+"""
+
+import argparse
+import multiprocessing
+import os
+import random
+import resource
+import tempfile
+import time
+from contextlib import contextmanager
+from io import BytesIO
+import bleach
+import markdown
+from PIL import Image
+from backend import auth
+from backend.config import Config
+from backend.content import ContentProcessor
+from backend.database import get_db
+from backend.usernames import username_at
+from backend.rendering import MARKDOWN_EXTENSIONS, SANITIZERS, get_renderer, get_sanitizer
+
+def _report(rows, headers):
+    """Print rows as a fixed-width table."""
+    widths = [max(len(str(v)) for v in col) for col in zip(headers, *rows)]
+    for row in [headers, *rows]:
+        print("  ".join(str(v).ljust(w) for v, w in zip(row, widths)))
+
+# --- Image decoding ---
+
+IMAGE_CASES = [
+    # (label, format, width, height)
+    ("12MP JPEG", "JPEG", 4000, 3000),
+    ("48MP JPEG", "JPEG", 8000, 6000),
+    ("12MP PNG", "PNG", 4000, 3000),
+    ("screenshot PNG", "PNG", 1920, 1080),
+]
+
+def _make_image(format: str, width: int, height: int) -> bytes:
+    """Build a synthetic test image with some detail in it."""
+    img = Image.linear_gradient('L').resize((width, height)).convert('RGB')
+    output = BytesIO()
+    img.save(output, format=format, quality=90)
+    return output.getvalue()
+
+def _legacy_resize(image_data: bytes) -> bytes:
+    """Previous resize_image: full decode at native resolution."""
+    img = Image.open(BytesIO(image_data))
+    img.load()
+    width, height = img.size
+    if width > Config.MAX_IMAGE_DIMENSION or height > Config.MAX_IMAGE_DIMENSION:
+        ratio = min(Config.MAX_IMAGE_DIMENSION / width,
+                    Config.MAX_IMAGE_DIMENSION / height)
+        img = img.resize((int(width * ratio), int(height * ratio)),
+                         Image.Resampling.LANCZOS)
+    output = BytesIO()
+    img.save(output, format=img.format or 'JPEG', quality=85, optimize=True)
+    return output.getvalue()
+
+def _measure_resize(args):
+    """Run in a fresh child process so ru_maxrss reflects one upload."""
+    variant, image_data = args
+    resize = _legacy_resize if variant == "legacy" else ContentProcessor(None).resize_image
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    resize(image_data)
+    elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return elapsed, (peak - baseline) / 1024  # ru_maxrss is KiB on Linux
+
+def bench_images(args):
+    """Peak RSS and latency per upload, legacy vs current resize_image."""
+    rows = []
+    for label, format, width, height in IMAGE_CASES:
+        data = _make_image(format, width, height)
+        for variant in ("legacy", "current"):
+            with multiprocessing.Pool(1, maxtasksperchild=1) as pool:
+                elapsed, peak_mb = pool.apply(_measure_resize, ((variant, data),))
+            rows.append((label, variant, f"{len(data) / 1024:.0f} KiB",
+                         f"{elapsed * 1000:.0f} ms", f"{peak_mb:.0f} MiB"))
+    _report(rows, ("image", "variant", "input", "latency", "peak RSS +"))
+
+# --- Markdown rendering ---
+
+SAMPLE_POSTS = [
+    "Short reply, agreed.",
+    "I think the **key point** is that _sapience_ is not binary.\n"
+    "See [the paper](https://example.org/paper) for details.\n\n"
+    "- first\n- second\n- third",
+    "## Summary\n\n"
+    "| Criterion | Weight |\n|---|---|\n| Self-model | 3 |\n| Language | 2 |\n\n"
+    "```python\ndef score(x):\n    return sum(x)\n```\n\n"
+    "![Pasted image](/forum/api/image/12)",
+    "> Quoted text from above\n> spanning lines\n\n"
+    "Reply with <b>inline html</b> and <script>alert(1)</script> attempts.\n" * 3,
+    ("Long post paragraph with *emphasis* and `code` and a link "
+     "https://example.org/x. " * 20 + "\n\n") * 4,
+]
+
+def _legacy_render(contents):
+    """Previous path: new Markdown per request, new sanitizer per post."""
+    md = markdown.Markdown(extensions=MARKDOWN_EXTENSIONS)
+    tags = list(bleach.ALLOWED_TAGS) + [
+        'img', 'p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
+        'table', 'thead', 'tbody', 'tr', 'th', 'td',
+        'hr', 'br', 'pre', 'code'
+    ]
+    attrs = {
+        **bleach.ALLOWED_ATTRIBUTES,
+        'img': ['src', 'alt', 'title'],
+        'a': ['href', 'title'],
+        'code': ['class']
+    }
+    for content in contents:
+        md.reset()
+        bleach.clean(md.convert(content), tags=tags, attributes=attrs, strip=False)
+
+def _current_render(contents):
+    """Current path: a ContentProcessor per request, pooled engines."""
+    processor = ContentProcessor(None)
+    for content in contents:
+        processor.render_markdown(content)
+
+def _time_per_post(render, posts_per_request: int, requests: int) -> float:
+    """Mean seconds per rendered post."""
+    contents = (SAMPLE_POSTS * posts_per_request)[:posts_per_request]
+    render(contents)  # warm up
+    start = time.perf_counter()
+    for _ in range(requests):
+        render(contents)
+    return (time.perf_counter() - start) / (requests * posts_per_request)
+
+def bench_render(args):
+    """Per-post render cost, legacy vs pooled Markdown and sanitizer."""
+    rows = []
+    for posts_per_request, requests in ((1, 500), (20, 50)):
+        legacy = _time_per_post(_legacy_render, posts_per_request, requests)
+        current = _time_per_post(_current_render, posts_per_request, requests)
+        rows.append((posts_per_request, f"{legacy * 1e6:.0f} us",
+                     f"{current * 1e6:.0f} us", f"{legacy / current:.1f}x"))
+    _report(rows, ("posts/request", "legacy", "pooled", "speedup"))
+
+def bench_sanitize(args):
+    """Per-post sanitizer cost for each backend, Markdown step excluded."""
+    renderer = get_renderer()
+    documents = [renderer.render(content) for content in SAMPLE_POSTS]
+    rows = []
+    baseline = None
+    for name in SANITIZERS:
+        try:
+            sanitizer = get_sanitizer(name)
+        except ImportError as e:
+            rows.append((name, "-", str(e)))
+            continue
+        requests = 500
+        start = time.perf_counter()
+        for _ in range(requests):
+            for html in documents:
+                sanitizer.clean(html)
+        per_post = (time.perf_counter() - start) / (requests * len(documents))
+        baseline = baseline or per_post
+        rows.append((name, f"{per_post * 1e6:.0f} us", f"{baseline / per_post:.1f}x"))
+    _report(rows, ("sanitizer", "per post", "speedup"))
+
+# --- Registration ---
+
+@contextmanager
+def _scratch_database():
+    """Point Config at a freshly initialised database in a temp directory."""
+    from backend.init_db import reset_database
+    from backend.init_group_categories import reset_gc
+    original = Config.SQLITE_DB_PATH
+    with tempfile.TemporaryDirectory() as directory:
+        Config.SQLITE_DB_PATH = os.path.join(directory, "bench.db")
+        try:
+            reset_database()
+            reset_gc()
+            yield
+        finally:
+            Config.SQLITE_DB_PATH = original
+
+def _legacy_register(language: str):
+    """Previous register: a connection per lookup and a statement per row."""
+    while True:
+        username = auth.generate_six_char_string()
+        with get_db() as conn:
+            if not conn.execute("SELECT 1 FROM users WHERE username = ?", (username,)).fetchone():
+                break
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("INSERT INTO users (username, language) VALUES (?, ?)", (username, language))
+        user_id = cursor.lastrowid
+        for one_time, count in ((False, Config.PERMANENT_TOKEN_COUNT),
+                                (True, Config.ONE_TIME_TOKEN_COUNT)):
+            for _ in range(count):
+                while True:
+                    token_hash = auth.hash_value(auth.generate_six_char_string())
+                    with get_db() as lookup:
+                        if not lookup.execute(
+                            "SELECT 1 FROM tokens WHERE user_id = ? AND token_hash = ?",
+                            (user_id, token_hash)
+                        ).fetchone():
+                            break
+                cursor.execute("INSERT INTO tokens (user_id, token_hash, one_time) VALUES (?, ?, ?)",
+                               (user_id, token_hash, one_time))
+        for group in cursor.execute("SELECT id FROM groups").fetchall():
+            cursor.execute("INSERT INTO user_groups (user_id, group_id, filter_on) VALUES (?, ?, 1)",
+                           (user_id, group['id']))
+
+def bench_register(args):
+    """Registration latency, legacy vs single-transaction, on a scratch database."""
+    rows = []
+    for variant, register in (("legacy", _legacy_register), ("current", auth.register_user)):
+        with _scratch_database():
+            registrations = 200
+            start = time.perf_counter()
+            for _ in range(registrations):
+                register('en')
+            per_user = (time.perf_counter() - start) / registrations
+        rows.append((variant, f"{per_user * 1000:.2f} ms"))
+    _report(rows, ("register", "per user"))
+
+# --- Login ---
+
+LOGIN_TOKEN = "bababa"
+
+def _populate_users(count: int, legacy: bool):
+    """Bulk-create users whose first permanent token is LOGIN_TOKEN."""
+    token_count = Config.PERMANENT_TOKEN_COUNT + Config.ONE_TIME_TOKEN_COUNT
+    known = auth.hash_value(LOGIN_TOKEN)
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.executemany(
+            "INSERT INTO users (id, username, language) VALUES (?, ?, 'en')",
+            ((user_id, username_at(user_id)) for user_id in range(1, count + 1))
+        )
+        if legacy:
+            cursor.executemany(
+                "INSERT INTO tokens (user_id, token_hash, one_time) VALUES (?, ?, ?)",
+                ((user_id, known if i == 0 else os.urandom(64).hex(), i >= Config.PERMANENT_TOKEN_COUNT)
+                 for user_id in range(1, count + 1) for i in range(token_count))
+            )
+        else:
+            size = auth.TOKEN_DIGEST_SIZE
+            cursor.executemany(
+                "INSERT INTO user_tokens (user_id, permanent, one_time) VALUES (?, ?, ?)",
+                ((user_id,
+                  auth.token_digest(known) + os.urandom(size * (Config.PERMANENT_TOKEN_COUNT - 1)),
+                  os.urandom(size * Config.ONE_TIME_TOKEN_COUNT))
+                 for user_id in range(1, count + 1))
+            )
+
+def _login_rate(usernames: list, token_hash: str, seconds: float = 2) -> float:
+    """Attempts per second through auth.authenticate, one connection each."""
+    attempts = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        with get_db() as conn:
+            auth.authenticate(conn.cursor(), random.choice(usernames), token_hash)
+        attempts += 1
+    return attempts / (time.perf_counter() - start)
+
+def bench_login(args):
+    """Login throughput at --users users, packed tokens vs legacy token rows."""
+    variants = [("user_tokens", False, None)]
+    if args.legacy:
+        variants += [("tokens, no index", True, "DROP INDEX idx_tokens_user_hash"),
+                     ("tokens, covering index", True, None)]
+    rows = []
+    for label, legacy, setup in variants:
+        with _scratch_database():
+            _populate_users(args.users, legacy)
+            if setup:
+                with get_db() as conn:
+                    conn.execute(setup)
+            auth._user_ids.clear()
+            usernames = [username_at(random.randint(1, args.users)) for _ in range(1000)]
+            valid = _login_rate(usernames, auth.hash_value(LOGIN_TOKEN))
+            invalid = _login_rate(usernames, auth.hash_value("zzzzzz"))
+        rows.append((label, f"{args.users}", f"{valid:.0f}/s", f"{invalid:.0f}/s"))
+    _report(rows, ("layout", "users", "valid logins", "failed attempts"))
+
+COMMANDS = {
+    "images": bench_images,
+    "render": bench_render,
+    "sanitize": bench_sanitize,
+    "register": bench_register,
+    "login": bench_login,
+}
+
+def main():
+    parser = argparse.ArgumentParser(description="Website V3 benchmarks")
+    parser.add_argument("benchmark", choices=sorted(COMMANDS))
+    parser.add_argument("--users", type=int, default=100_000,
+                        help="Users in the scratch database (login)")
+    parser.add_argument("--legacy", action="store_true",
+                        help="Also measure the legacy tokens table (login; slow to build)")
+    args = parser.parse_args()
+    COMMANDS[args.benchmark](args)
+
+if __name__ == "__main__":
+    main()
@@ -25,17 +25,60 @@ class Config:
     TOKEN_LENGTH = 6
     HASH_ALGORITHM = 'sha512'
     PERMANENT_TOKEN_COUNT = 3
-    ONE_TIME_TOKEN_COUNT = 50
+    ONE_TIME_TOKEN_COUNT = 50     # At most 63: one bit each in user_tokens.used
+    LOGIN_MEMO_SIZE = 100_000     # username -> id entries memoized per worker
+    PERMISSION_CLAIMS_TTL = 30    # Seconds session permission claims are trusted unchecked
+    USERNAME_POOL_RESERVE = 0.2   # Free fraction of the namespace below which username-pool warns
     
     # Forum settings
     THREADS_PER_PAGE = 20
     POSTS_PER_PAGE = 50
     MAX_TITLE_LENGTH = 132
     MAX_IMAGE_DIMENSION = 1200
-    
+    TAXONOMY_MAX_AGE = 86400      # Seconds browsers cache versioned category lists
+
+    # Admin pages
+    ADMIN_USERS_PER_PAGE = 50     # Users per page of the admin user directory
+    USER_TYPEAHEAD_LIMIT = 10     # Suggestions returned per typeahead request
+    MODERATION_JOB_CHUNK = 100    # Users or posts processed per transaction by bulk jobs
+    MODERATION_JOB_PAUSE = 0.05   # Seconds between chunks, leaving the write lock to requests
+    MODERATION_JOB_LEASE = 60     # Seconds without progress before another worker resumes a job
+    MODERATION_JOB_POLL = 5       # Seconds between checks for queued jobs
+
+    # Image uploads
+    MAX_UPLOAD_BYTES = 10 * 1024 * 1024  # Largest accepted multipart upload
+    MAX_IMAGE_PIXELS = 64_000_000        # Pixel budget (width * height) per image
+    MAX_DECODE_PIXELS = 16_000_000       # Budget for formats decoded at full size (all but JPEG)
+    IMAGE_UPLOAD_GRACE_PERIOD = 86400    # Seconds an unattached upload is kept
+    IMAGE_GC_BATCH_SIZE = 50             # Images deleted per transaction
+    IMAGE_GC_VACUUM_PAGES = 1000         # Pages released per incremental vacuum step
+
+    # Content rendering
+    MARKDOWN_BACKEND = os.getenv('MARKDOWN_BACKEND', 'python-markdown')  # or 'markdown-it'
+    SANITIZER_BACKEND = os.getenv('SANITIZER_BACKEND', 'bleach')         # or 'nh3'
+
+    # Page cache for anonymous readers
+    PAGE_CACHE_BYTES = 64 * 1024 * 1024         # In-memory budget per worker, 0 disables
+    PAGE_CACHE_PATH = os.getenv('PAGE_CACHE_PATH')  # Optional SQLite file for a persistent copy
+    PAGE_CACHE_DISK_BYTES = 512 * 1024 * 1024   # Budget of the persistent copy
+    PAGE_CACHE_WAIT = 10                        # Seconds to wait for a concurrent render
+
+    # Live thread updates (Server-Sent Events)
+    SSE_MAX_CONNECTIONS = 200     # Open event streams per worker
+    SSE_HEARTBEAT = 25            # Seconds between keep-alive comments
+    SSE_MAX_AGE = 900             # Seconds before a stream is closed and reopened
+    SSE_RETRY = 5                 # Seconds a browser waits before reconnecting
+    EVENT_POLL_INTERVAL = 1       # Seconds between post_events polls per worker
+    EVENT_RETENTION = 600         # Seconds post_events rows are kept for replay
+    EVENT_PRUNE_INTERVAL = 60     # Seconds between prunes of post_events by a publishing worker
+    EVENT_BATCH_SIZE = 500        # post_events rows read per poll
+
     # Rate limiting
     MAX_REQUESTS_PER_WINDOW = 100  # Maximum requests per window
     RATE_LIMIT_WINDOW = 3600       # Window size in seconds (1 hour)
+    RATE_LIMIT_PATH = os.getenv('RATE_LIMIT_PATH', SQLITE_DB_PATH + '.ratelimit')  # Buckets shared by workers
+    RATE_LIMIT_MAX_KEYS = 100_000  # Buckets kept before the least recently used are evicted
+    RATE_LIMIT_IMAGE_COST = 5      # Extra requests charged per uploaded or inlined image
     
     # Other existing settings...
     # Language settings
@@ -8,68 +8,113 @@ Includes image processing and markdown rendering.
 Features:
 - Markdown processing
 - Image handling and resizing
+- Image uploads ahead of posting
 - Content sanitization
 - HTML cleaning
 """
 
-import markdown
-import bleach
+import hashlib
 import magic
 import re
+import secrets
+import urllib.parse
 from flask import url_for
-from typing import List, Tuple, Optional
+from typing import Dict, List, Tuple, Optional, BinaryIO, Union
 import base64
-from PIL import Image
+from PIL import Image, ImageOps, ExifTags
 from io import BytesIO
 from backend.config import Config
+from backend.rendering import (
+    ALLOWED_TAGS, ALLOWED_ATTRS, get_renderer, get_sanitizer, render_version
+)
+
+# Matches image references produced by forum.get_image
+IMAGE_URL_PATTERN = re.compile(r'/forum/api/image/(\d+)')
+
+# [[Page Title]] links in wiki content
+WIKI_LINK_PATTERN = re.compile(r'\[\[(.*?)\]\]')
+
+# source_type values in content_renders whose Markdown has [[wiki links]]
+WIKI_SOURCE_TYPES = frozenset({'wiki_page', 'wiki_revision'})
+
+# Formats stored as uploaded; anything else is re-encoded as JPEG
+KEEP_FORMATS = ('JPEG', 'PNG', 'GIF', 'WEBP')
+
+def process_wiki_links(content: str) -> str:
+    """
+    Process [[Wiki Link]] style links in content.
+    Converts them to proper Markdown links to the wiki page.
+    """
+    def replace_link(match):
+        page_title = match.group(1).strip()
+        escaped_title = urllib.parse.quote(page_title.replace(' ', '_'))
+        return f'[{page_title}](/wiki/page/{escaped_title})'
+    
+    # Replace [[Page Title]] with [Page Title](/wiki/page/Page_Title)
+    return WIKI_LINK_PATTERN.sub(replace_link, content)
+
+def content_hash(content: str) -> str:
+    """Hash identifying the Markdown a stored render was made from."""
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+def render_source(source_type: str, content: str) -> str:
+    """Render stored content of the given source type to sanitized HTML."""
+    if source_type in WIKI_SOURCE_TYPES:
+        content = process_wiki_links(content)
+    return get_sanitizer().clean(get_renderer().render(content))
 
 class ContentProcessor:
     def __init__(self, db_connection):
         """Initialize content processor with database connection."""
         self.conn = db_connection
-        
-        # Configure markdown
-        self.md = markdown.Markdown(
-            extensions=['extra', 'nl2br', 'fenced_code', 'tables']
-        )
-        
-        # Configure HTML cleaning
-        self.allowed_tags = list(bleach.ALLOWED_TAGS) + [
-            'img', 'p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
-            'table', 'thead', 'tbody', 'tr', 'th', 'td',
-            'hr', 'br', 'pre', 'code'
-        ]
-        self.allowed_attrs = {
-            **bleach.ALLOWED_ATTRIBUTES,
-            'img': ['src', 'alt', 'title'],
-            'a': ['href', 'title'],
-            'code': ['class']
-        }
-
-    def resize_image(self, image_data: bytes) -> bytes:
+        self.allowed_tags = ALLOWED_TAGS
+        self.allowed_attrs = ALLOWED_ATTRS
+
+    def resize_image(self, image_data: Union[bytes, BinaryIO]) -> bytes:
         """
         Resize image if it exceeds maximum dimensions.
         Maintains aspect ratio and optimizes file size.
+
+        The pixel budget is checked from the header before decoding.
+        Only JPEGs can be decoded at a reduced scale (draft mode); other
+        formats are decoded in full before they are shrunk, so they get
+        the stricter Config.MAX_DECODE_PIXELS budget.
+        Raises ValueError for images over either budget.
         """
-        img = Image.open(BytesIO(image_data))
+        if isinstance(image_data, bytes):
+            image_data = BytesIO(image_data)
+        img = Image.open(image_data)
+        format = img.format if img.format in KEEP_FORMATS else 'JPEG'
         
-        # Convert RGBA to RGB if needed
-        if img.mode == 'RGBA':
+        # Reject decompression bombs before any pixel data is decoded
+        width, height = img.size
+        if width * height > Config.MAX_IMAGE_PIXELS:
+            raise ValueError('Image has too many pixels')
+        if img.format != 'JPEG' and width * height > Config.MAX_DECODE_PIXELS:
+            raise ValueError('Image has too many pixels')
+        
+        # Decode JPEGs at 1/2, 1/4 or 1/8 scale when that is still large enough
+        target = (Config.MAX_IMAGE_DIMENSION, Config.MAX_IMAGE_DIMENSION)
+        if img.format == 'JPEG':
+            img.draft('RGB', target)
+        
+        # Shrink in place; reducing_gap does a cheap reduce() before resampling
+        img.thumbnail(target, Image.Resampling.LANCZOS, reducing_gap=2.0)
+        
+        # Apply EXIF orientation once, on the already shrunk image
+        orientation = img.getexif().get(ExifTags.Base.Orientation, 1)
+        if orientation != 1:
+            img = ImageOps.exif_transpose(img)
+        
+        # JPEG has no alpha channel
+        if format == 'JPEG' and img.mode in ('RGBA', 'LA', 'P'):
+            img = img.convert('RGBA')
             bg = Image.new('RGB', img.size, 'WHITE')
             bg.paste(img, mask=img.split()[3])
             img = bg
         
-        # Check if resize needed
-        width, height = img.size
-        if width > Config.MAX_IMAGE_DIMENSION or height > Config.MAX_IMAGE_DIMENSION:
-            ratio = min(Config.MAX_IMAGE_DIMENSION / width, 
-                       Config.MAX_IMAGE_DIMENSION / height)
-            new_size = (int(width * ratio), int(height * ratio))
-            img = img.resize(new_size, Image.Resampling.LANCZOS)
-        
         # Save optimized
         output = BytesIO()
-        format = img.format or 'JPEG'
         img.save(output, 
                  format=format,
                  quality=85, 
@@ -97,11 +142,64 @@ class ContentProcessor:
         
         return cursor.lastrowid
 
-    def process_new_post(self, content: str, post_id: int) -> Tuple[str, List[int]]:
+    def store_upload(self, stream: BinaryIO, user_id: int) -> int:
+        """
+        Store an uploaded image that is not yet attached to a post.
+        The stream is checked for type and pixel count before any
+        pixel data is decoded. Raises ValueError for rejected images.
+        """
+        mime = magic.from_buffer(stream.read(2048), mime=True)
+        if not mime.startswith('image/'):
+            raise ValueError(f'Invalid image type: {mime}')
+
+        # Decoded straight from the spooled file; the pixel budget is
+        # enforced from the header before any decoding
+        stream.seek(0)
+        try:
+            img_data = self.resize_image(stream)
+        except ValueError:
+            raise
+        except Exception as exc:
+            # Pillow raises many types for corrupt files; keep the cause
+            raise ValueError('Unreadable image') from exc
+        mime = magic.from_buffer(img_data[:2048], mime=True)
+
+        cursor = self.conn.cursor()
+        filename = f'upload_{user_id}_{secrets.token_hex(4)}.{mime.split("/")[1]}'
+        cursor.execute("""
+            INSERT INTO images (post_id, created_by, filename, content_type, data)
+            VALUES (NULL, ?, ?, ?, ?)
+        """, (user_id, filename, mime, img_data))
+
+        return cursor.lastrowid
+
+    def attach_uploads(self, content: str, post_id: int, user_id: int) -> List[int]:
+        """
+        Attach the user's pending uploads referenced in content to a post.
+        Returns the IDs of the images that were attached.
+        """
+        image_ids = sorted({int(i) for i in IMAGE_URL_PATTERN.findall(content)})
+        if not image_ids:
+            return []
+
+        cursor = self.conn.cursor()
+        placeholders = ','.join('?' for _ in image_ids)
+        cursor.execute(f"""
+            UPDATE images
+            SET post_id = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE post_id IS NULL AND created_by = ? AND id IN ({placeholders})
+            RETURNING id
+        """, (post_id, user_id, *image_ids))
+
+        return [row[0] for row in cursor.fetchall()]
+
+    def process_new_post(self, content: str, post_id: int,
+                         user_id: Optional[int] = None) -> Tuple[str, List[int]]:
         """
         Process new post content:
         - Extract and store images
         - Convert base64 images to URLs
+        - Attach images uploaded ahead of posting (when user_id is given)
         Returns processed markdown content and list of image IDs.
         """
         img_pattern = r'!\[([^\]]*)\]\(data:image/([^;]+);base64,([^\)]+)\)'
@@ -118,8 +216,9 @@ class ContentProcessor:
                 if not mime.startswith('image/'):
                     return f'[Invalid image type: {mime}]'
                 
-                # Resize if needed
+                # Resize if needed (may re-encode to another format)
                 img_data = self.resize_image(img_data)
+                mime = magic.from_buffer(img_data[:2048], mime=True)
                 
                 # Store and get ID
                 image_id = self.store_image(
@@ -133,28 +232,76 @@ class ContentProcessor:
             except Exception as e:
                 return f'[Image processing error: {str(e)}]'
         
-        # Replace base64 images with URLs
-        processed_content = re.sub(img_pattern, replace_image, content)
-        
+        # Replace base64 images with URLs (only older clients still inline them)
+        processed_content = content
+        if 'data:image/' in content:
+            processed_content = re.sub(img_pattern, replace_image, content)
+
+        # Claim images uploaded through the upload endpoint
+        if user_id:
+            images.extend(self.attach_uploads(processed_content, post_id, user_id))
+
         # Return the processed markdown (not HTML) and list of image IDs
         return processed_content, images
 
     def render_markdown(self, content: str) -> str:
         """
-        Render markdown to HTML for display.
+        Render markdown to HTML for display, using the configured backend.
         """
-        # Reset the markdown processor
-        self.md.reset()
-        
-        # Convert markdown to HTML
-        html = self.md.convert(content)
+        html = get_renderer().render(content)
         
         # Clean the HTML while preserving our allowed tags and attributes
-        clean_html = bleach.clean(
-            html,
-            tags=self.allowed_tags,
-            attributes=self.allowed_attrs,
-            strip=False
-        )
-        
-        return clean_html
+        return get_sanitizer().clean(html)
+
+    def render_stored(self, source_type: str, items: List[Tuple[int, str]]) -> Dict[int, str]:
+        """
+        Render stored content, reusing HTML from content_renders.
+        items are (source_id, markdown); returns source_id -> HTML.
+        Missing or outdated renders are rendered without being written
+        back, so page views never take the write lock; save_renders stores
+        them when content is written and `maintenance rerender` after a
+        render version change.
+        """
+        if not items:
+            return {}
+
+        version = render_version()
+        cursor = self.conn.cursor()
+        placeholders = ",".join("?" for _ in items)
+        cursor.execute(f"""
+            SELECT source_id, content_hash, render_version, html
+            FROM content_renders
+            WHERE source_type = ? AND source_id IN ({placeholders})
+        """, (source_type, *[source_id for source_id, _ in items]))
+        stored = {row['source_id']: row for row in cursor.fetchall()}
+
+        rendered = {}
+        for source_id, content in items:
+            row = stored.get(source_id)
+            if row and row['content_hash'] == content_hash(content) and row['render_version'] == version:
+                rendered[source_id] = row['html']
+            else:
+                rendered[source_id] = render_source(source_type, content)
+
+        return rendered
+
+    def save_renders(self, source_type: str, items: List[Tuple[int, str]]) -> Dict[int, str]:
+        """
+        Render content being written and store it in content_renders, in
+        the caller's transaction. items are (source_id, markdown); returns
+        source_id -> HTML.
+        """
+        version = render_version()
+        rendered = {source_id: render_source(source_type, content) for source_id, content in items}
+        self.conn.cursor().executemany("""
+            INSERT INTO content_renders
+                (source_type, source_id, content_hash, render_version, html)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (source_type, source_id) DO UPDATE SET
+                content_hash = excluded.content_hash,
+                render_version = excluded.render_version,
+                html = excluded.html,
+                updated_at = CURRENT_TIMESTAMP
+        """, [(source_type, source_id, content_hash(content), version, rendered[source_id])
+              for source_id, content in items])
+        return rendered
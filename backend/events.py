@@ -0,0 +1,180 @@
+"""
+Events Module
+=============
+
+Publish/subscribe for thread updates, streamed to browsers over
+Server-Sent Events by forum.thread_events.
+
+Publishing writes a row to the post_events change table. Every worker runs
+one poller thread that reads new rows by id and hands them to the local
+subscribers of the thread, so events fan out across workers without any
+extra service. A publish also wakes the local poller, so readers served by
+the same worker get the event immediately.
+
+Events are hints: a client that misses one still catches up on the next,
+because it fetches posts after the last post it has. So a poller that had
+no subscribers starts again from the newest event, and one that falls
+more than Config.EVENT_BATCH_SIZE events behind reads on in batches.
+Publishing prunes rows older than Config.EVENT_RETENTION, keeping the
+table bounded whether or not anyone is listening.
+
+Usage:
+    publish(thread_id, post_id, 'new_post')
+
+    subscription = subscribe(thread_id)
+    event = subscription.get(timeout=Config.SSE_HEARTBEAT)
+"""
+
+import queue
+import threading
+import time
+from typing import Dict, List, Optional, Set
+from backend.config import Config
+from backend.database import get_db
+
+EVENT_KINDS = ('new_post', 'edit_post')
+
+class Subscription:
+    """One open event stream for a thread."""
+
+    def __init__(self, thread_id: int):
+        self.thread_id = thread_id
+        self.queue: 'queue.Queue[dict]' = queue.Queue(maxsize=100)
+
+    def deliver(self, event: dict):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            pass  # A stalled client catches up on the next event it reads
+
+    def get(self, timeout: float) -> Optional[dict]:
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+class EventBus:
+    """Subscribers of this worker, fed by a poller on post_events."""
+
+    def __init__(self):
+        self.subscribers: Dict[int, Set[Subscription]] = {}
+        self.count = 0
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.poller: Optional[threading.Thread] = None
+
+    def subscribe(self, thread_id: int) -> Optional[Subscription]:
+        """Open a subscription, or return None at the connection limit."""
+        with self.lock:
+            if self.count >= Config.SSE_MAX_CONNECTIONS:
+                return None
+            subscription = Subscription(thread_id)
+            self.subscribers.setdefault(thread_id, set()).add(subscription)
+            self.count += 1
+            if self.poller is None:
+                self.poller = threading.Thread(target=self._poll, name="event-poller", daemon=True)
+                self.poller.start()
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self.lock:
+            subscribers = self.subscribers.get(subscription.thread_id, set())
+            if subscription in subscribers:
+                subscribers.discard(subscription)
+                self.count -= 1
+            if not subscribers:
+                self.subscribers.pop(subscription.thread_id, None)
+
+    def dispatch(self, events: List[dict]):
+        with self.lock:
+            targets = [
+                (event, list(self.subscribers.get(event['thread_id'], ())))
+                for event in events
+            ]
+        for event, subscriptions in targets:
+            for subscription in subscriptions:
+                subscription.deliver(event)
+
+    def _poll(self):
+        """Read new post_events rows and dispatch them, forever."""
+        last_id = None
+        while True:
+            self.wake.wait(Config.EVENT_POLL_INTERVAL)
+            self.wake.clear()
+            if not self.count:
+                # Nobody to deliver the backlog to: skip it
+                last_id = None
+                continue
+            try:
+                if last_id is None:
+                    last_id = latest_event_id()
+                events = fetch_events(after=last_id, limit=Config.EVENT_BATCH_SIZE)
+                if events:
+                    last_id = events[-1]['id']
+                    self.dispatch(events)
+                if len(events) == Config.EVENT_BATCH_SIZE:
+                    self.wake.set()  # More are waiting: read on without sleeping
+            except Exception:
+                # Keep the poller alive through transient database errors
+                time.sleep(Config.EVENT_POLL_INTERVAL)
+
+_bus = EventBus()
+
+def latest_event_id() -> int:
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT COALESCE(MAX(id), 0) FROM post_events")
+        return cursor.fetchone()[0]
+
+def fetch_events(after: int, thread_id: Optional[int] = None, limit: int = 100) -> List[dict]:
+    """The first limit events with id > after, optionally for one thread only."""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        if thread_id is None:
+            cursor.execute("""
+                SELECT id, thread_id, post_id, kind FROM post_events
+                WHERE id > ?
+                ORDER BY id
+                LIMIT ?
+            """, (after, limit))
+        else:
+            cursor.execute("""
+                SELECT id, thread_id, post_id, kind FROM post_events
+                WHERE thread_id = ? AND id > ?
+                ORDER BY id
+                LIMIT ?
+            """, (thread_id, after, limit))
+        return [dict(row) for row in cursor.fetchall()]
+
+def prune_events(cursor) -> int:
+    """Drop events older than the retention window; returns how many."""
+    cursor.execute("""
+        DELETE FROM post_events
+        WHERE created_at < datetime('now', ?)
+    """, (f"-{Config.EVENT_RETENTION} seconds",))
+    return cursor.rowcount
+
+# When this worker last pruned post_events (monotonic seconds)
+_last_prune = 0.0
+
+def publish(thread_id: int, post_id: int, kind: str):
+    """Record an event for all workers; call after the change is committed."""
+    global _last_prune
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            INSERT INTO post_events (thread_id, post_id, kind)
+            VALUES (?, ?, ?)
+        """, (thread_id, post_id, kind))
+        # Writers prune, so rows never outpace pruning
+        if time.monotonic() - _last_prune > Config.EVENT_PRUNE_INTERVAL:
+            _last_prune = time.monotonic()
+            prune_events(cursor)
+    _bus.wake.set()
+
+def subscribe(thread_id: int) -> Optional[Subscription]:
+    """Subscribe to a thread's events; None when the worker is at its limit."""
+    return _bus.subscribe(thread_id)
+
+def unsubscribe(subscription: Subscription):
+    _bus.unsubscribe(subscription)
@@ -14,14 +14,19 @@ Features:
 """
 
 import sqlite3
+import time
 from flask import (
-    Blueprint, render_template, session, redirect, request,
+    Blueprint, Response, render_template, session, redirect, request,
     url_for, flash, jsonify, make_response, abort
 )
+from backend import events, moderation_jobs, permissions
 from backend.database import get_db
 from backend.content import ContentProcessor
 from backend.auth import rate_limit
+from backend.rate_limits import inline_image_cost
 from backend.config import Config
+from backend.page_cache import TAXONOMY_TAG, THREADS_TAG, cached_page, conditional_get, thread_tag
+from backend.taxonomy import MODERATION_GROUP, REPORT_CATEGORY, get_taxonomy
 from typing import List, Optional
 
 forum_blueprint = Blueprint("forum", __name__)
@@ -29,90 +34,78 @@ forum_blueprint = Blueprint("forum", __name__)
 def check_thread_access(thread_id: int, user_id: Optional[int]) -> bool:
     """Check if user has access to thread."""
     with get_db() as conn:
-        cursor = conn.cursor()
-        
-        # Check if user is a moderator
-        if user_id:
-            cursor.execute("""
-                SELECT EXISTS (
-                    SELECT 1 FROM moderators
-                    WHERE user_id = ?
-                )
-            """, (user_id,))
-            is_moderator = bool(cursor.fetchone()[0])
-            
-            if is_moderator:
-                return True
-        
-        # Check if thread exists and is public or user has access
-        cursor.execute("""
-            SELECT EXISTS (
-                SELECT 1 FROM threads t
-                LEFT JOIN thread_users tu ON t.id = tu.thread_id
-                WHERE t.id = ? AND (
-                    tu.thread_id IS NULL
-                    OR tu.user_id = ?
-                    OR t.created_by = ?
-                )
-            )
-        """, (thread_id, user_id, user_id))
-        
-        return bool(cursor.fetchone()[0])
+        service = permissions.PermissionService(conn.cursor(), user_id)
+        return thread_id in service.visible_threads([thread_id])
 
 def check_post_access(post_id: int, user_id: Optional[int]) -> bool:
     """Check if user has access to post."""
     with get_db() as conn:
-        cursor = conn.cursor()
-        
-        # Check if user is a moderator
-        if user_id:
-            cursor.execute("""
-                SELECT EXISTS (
-                    SELECT 1 FROM moderators
-                    WHERE user_id = ?
-                )
-            """, (user_id,))
-            is_moderator = bool(cursor.fetchone()[0])
-            
-            if is_moderator:
-                return True
-        
-        # Check if post exists and either:
-        # 1. Has no restrictions (post_users entries)
-        # 2. User is in post_users
-        # 3. User is the post creator
-        cursor.execute("""
-            SELECT p.thread_id, p.created_by,
-                  (SELECT COUNT(*) FROM post_users WHERE post_id = ?) as has_restrictions
-            FROM posts p
-            WHERE p.id = ?
-        """, (post_id, post_id))
-        post = cursor.fetchone()
-        
-        if not post:
-            return False
-            
-        # First check thread access
-        if not check_thread_access(post['thread_id'], user_id):
-            return False
-            
-        # If post has no restrictions or user is post creator, allow access
-        if post['has_restrictions'] == 0 or post['created_by'] == user_id:
-            return True
-            
-        # Check if user is in post_users
-        if user_id:
-            cursor.execute("""
-                SELECT EXISTS (
-                    SELECT 1 FROM post_users
-                    WHERE post_id = ? AND user_id = ?
-                )
-            """, (post_id, user_id))
-            return bool(cursor.fetchone()[0])
-            
-        return False
+        service = permissions.PermissionService(conn.cursor(), user_id)
+        return post_id in service.visible_posts([post_id])
+
+def fetch_thread_posts(cursor, processor: ContentProcessor, thread_id: int,
+                       user_id: Optional[int], is_moderator: bool,
+                       after: int = 0, show_restricted_users: bool = False,
+                       post_id: Optional[int] = None) -> List[dict]:
+    """
+    Posts of a thread with id > after (or only post_id) that the user may
+    see, rendered.
+    Visibility follows PermissionService.post_condition; the caller checks
+    thread access. One query on posts(thread_id, id), plus one for
+    restriction lists when show_restricted_users is set and restricted
+    posts are present.
+    """
+    visible, params = permissions.PermissionService(cursor, user_id, is_moderator).post_condition('p')
+    if post_id is not None:
+        visible, params = f"p.id = ? AND {visible}", [post_id, *params]
+    cursor.execute(f"""
+        SELECT
+            p.*, u.username,
+            (SELECT COUNT(*) FROM post_edits WHERE post_id = p.id) as edit_count,
+            (SELECT COUNT(*) FROM post_users WHERE post_id = p.id)
+                + (SELECT COUNT(*) FROM post_roles WHERE post_id = p.id) as is_restricted
+        FROM posts p
+        JOIN users u ON p.created_by = u.id
+        WHERE p.thread_id = ? AND p.id > ? AND {visible}
+        ORDER BY p.id
+    """, (thread_id, after, *params))
+    posts = [dict(row) for row in cursor.fetchall()]
+
+    for post in posts:
+        post['restricted_users'] = []
+        post['restricted_roles'] = []
+    restricted = {post['id']: post for post in posts if post['is_restricted']}
+    if show_restricted_users and restricted:
+        placeholders = ",".join("?" for _ in restricted)
+        cursor.execute(f"""
+            SELECT pu.post_id, u.id, u.username
+            FROM post_users pu
+            JOIN users u ON pu.user_id = u.id
+            WHERE pu.post_id IN ({placeholders})
+            ORDER BY u.username
+        """, list(restricted))
+        for row in cursor.fetchall():
+            restricted[row['post_id']]['restricted_users'].append(row)
+        cursor.execute(f"""
+            SELECT post_id, role FROM post_roles
+            WHERE post_id IN ({placeholders})
+            ORDER BY role
+        """, list(restricted))
+        for row in cursor.fetchall():
+            restricted[row['post_id']]['restricted_roles'].append(row['role'])
+
+    # Render markdown to HTML for display, reusing stored renders
+    rendered = processor.render_stored(
+        'post', [(post['id'], post['content']) for post in posts]
+    )
+    for post in posts:
+        post['rendered_content'] = rendered[post['id']]
+    return posts
 
 @forum_blueprint.route("/thread/<int:thread_id>")
+@conditional_get(lambda thread_id: [thread_tag(thread_id)],
+                 authorize=lambda thread_id: check_thread_access(thread_id, session.get('user_id')))
+@cached_page(lambda thread_id: [thread_tag(thread_id)])
 def view_thread(thread_id: int):
     """Show posts in a thread."""
     user_id = session.get('user_id')
@@ -124,16 +117,7 @@ def view_thread(thread_id: int):
         cursor = conn.cursor()
         processor = ContentProcessor(conn)
         
-        # Check if user is a moderator
-        is_moderator = False
-        if user_id:
-            cursor.execute("""
-                SELECT EXISTS (
-                    SELECT 1 FROM moderators
-                    WHERE user_id = ?
-                )
-            """, (user_id,))
-            is_moderator = bool(cursor.fetchone()[0])
+        is_moderator = permissions.is_moderator()
         
         # Get thread info with group and category
         cursor.execute("""
@@ -161,55 +145,16 @@ def view_thread(thread_id: int):
         """, (thread_id,))
         thread_users = cursor.fetchall()
         
-        # Get posts
         cursor.execute("""
-            SELECT 
-                p.*, u.username,
-                (SELECT COUNT(*) FROM post_edits WHERE post_id = p.id) as edit_count
-            FROM posts p
-            JOIN users u ON p.created_by = u.id
-            WHERE p.thread_id = ?
-            ORDER BY p.created_at ASC
+            SELECT role FROM thread_roles WHERE thread_id = ? ORDER BY role
         """, (thread_id,))
-        original_posts = cursor.fetchall()
+        thread_roles = [row['role'] for row in cursor.fetchall()]
         
-        # Process post content (creating a new list since Row objects are immutable)
-        processed_posts = []
-        for post in original_posts:
-            # Convert Row to dict so we can modify it
-            post_dict = dict(post)
-            
-            # Check if post has restrictions
-            cursor.execute("""
-                SELECT COUNT(*) as is_restricted 
-                FROM post_users 
-                WHERE post_id = ?
-            """, (post_dict['id'],))
-            
-            restriction_info = cursor.fetchone()
-            post_dict['is_restricted'] = restriction_info['is_restricted'] if restriction_info else 0
-            
-            # Check post access
-            has_access = True
-            if post_dict['is_restricted'] > 0:
-                has_access = check_post_access(post_dict['id'], user_id)
-            
-            if has_access:
-                # Get post users if the post is restricted
-                post_dict['restricted_users'] = []
-                if post_dict['is_restricted'] > 0:
-                    cursor.execute("""
-                        SELECT u.id, u.username
-                        FROM post_users pu
-                        JOIN users u ON pu.user_id = u.id
-                        WHERE pu.post_id = ?
-                        ORDER BY u.username
-                    """, (post_dict['id'],))
-                    post_dict['restricted_users'] = cursor.fetchall()
-                
-                # Render markdown to HTML for display
-                post_dict['rendered_content'] = processor.render_markdown(post_dict['content'])
-                processed_posts.append(post_dict)
+        # Get visible posts, rendered
+        processed_posts = fetch_thread_posts(
+            cursor, processor, thread_id, user_id, is_moderator,
+            show_restricted_users=is_moderator or thread['created_by'] == user_id
+        )
         
         # Check if this thread is a report thread (in Moderation group, Reported Post category)
         is_report_thread = False
@@ -239,13 +184,118 @@ def view_thread(thread_id: int):
         posts=processed_posts, 
         Config=Config,
         thread_users=thread_users,
+        thread_roles=thread_roles,
         is_moderator=is_moderator,
         is_report_thread=is_report_thread,
         reported_post_id=reported_post_id
     )
 
+@forum_blueprint.route("/thread/<int:thread_id>/posts")
+def thread_posts(thread_id: int):
+    """
+    Posts after ?after=<post id>, or the single post ?id=<post id>, as
+    HTML fragments (default) or ?format=json, for appending to or
+    refreshing an open thread page. 204 if none.
+    """
+    user_id = session.get('user_id')
+    after = request.args.get('after', 0, type=int)
+    post_id = request.args.get('id', type=int)
+    
+    if not check_thread_access(thread_id, user_id):
+        abort(403)
+    
+    with get_db() as conn:
+        cursor = conn.cursor()
+        processor = ContentProcessor(conn)
+        
+        cursor.execute("SELECT id, created_by FROM threads WHERE id = ?", (thread_id,))
+        thread = cursor.fetchone()
+        if not thread:
+            abort(404)
+        
+        is_moderator = permissions.is_moderator()
+        posts = fetch_thread_posts(
+            cursor, processor, thread_id, user_id, is_moderator, after=after,
+            show_restricted_users=is_moderator or thread['created_by'] == user_id,
+            post_id=post_id
+        )
+    
+    if not posts:
+        return '', 204
+    
+    if request.args.get('format') == 'json':
+        return jsonify({
+            'posts': [{
+                'id': post['id'],
+                'created_by': post['created_by'],
+                'username': post['username'],
+                'created_at': post['created_at'],
+                'is_restricted': bool(post['is_restricted']),
+                'rendered_content': post['rendered_content']
+            } for post in posts],
+            'last_id': posts[-1]['id']
+        })
+    
+    response = make_response(render_template(
+        "forum/_posts.html",
+        posts=posts,
+        thread=thread,
+        is_moderator=is_moderator
+    ))
+    response.headers['X-Last-Post-Id'] = str(posts[-1]['id'])
+    return response
+
+def _sse_frame(event: dict) -> str:
+    """One Server-Sent Events message; data is the affected post ID."""
+    return f"id: {event['id']}\nevent: {event['kind']}\ndata: {event['post_id']}\n\n"
+
+@forum_blueprint.route("/thread/<int:thread_id>/events")
+def thread_events(thread_id: int):
+    """
+    Server-Sent Events stream of new_post / edit_post notifications.
+    Access is checked once here; the stream then only carries post IDs,
+    and clients fetch content through thread_posts. Streams end after
+    SSE_MAX_AGE and the browser reconnects with Last-Event-ID.
+    """
+    if not check_thread_access(thread_id, session.get('user_id')):
+        abort(403)
+    
+    last_event_id = request.headers.get('Last-Event-ID', 0, type=int)
+    subscription = events.subscribe(thread_id)
+    if subscription is None:
+        return "Too many open event streams", 503
+    
+    def stream():
+        yield f"retry: {Config.SSE_RETRY * 1000}\n\n"
+        
+        last_sent = last_event_id
+        
+        # Events missed while reconnecting
+        if last_event_id:
+            for event in events.fetch_events(last_event_id, thread_id):
+                yield _sse_frame(event)
+                last_sent = event['id']
+        
+        deadline = time.monotonic() + Config.SSE_MAX_AGE
+        while time.monotonic() < deadline:
+            event = subscription.get(timeout=Config.SSE_HEARTBEAT)
+            if event is None:
+                # Comment line keeps proxies from closing an idle stream
+                yield ": ping\n\n"
+            elif event['id'] > last_sent:
+                yield _sse_frame(event)
+                last_sent = event['id']
+    
+    response = Response(stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    # Runs when the server closes the response, even if the stream never started
+    response.call_on_close(lambda: events.unsubscribe(subscription))
+    return response
+
 @forum_blueprint.route("/thread/<int:thread_id>/post", methods=["POST"])
-@rate_limit()
+@rate_limit(cost=inline_image_cost())
 def new_post(thread_id: int):
     """Create a new post in a thread."""
     if not session.get('user_id'):
@@ -272,7 +322,7 @@ def new_post(thread_id: int):
         post_id = cursor.lastrowid
         
         # Process content (convert base64 images to URLs) but keep as markdown
-        processed_content, _ = processor.process_new_post(content, post_id)
+        processed_content, _ = processor.process_new_post(content, post_id, session['user_id'])
         
         # Update post with processed markdown (not HTML)
         cursor.execute("""
@@ -280,6 +330,7 @@ def new_post(thread_id: int):
             SET content = ?
             WHERE id = ?
         """, (processed_content, post_id))
+        processor.save_renders('post', [(post_id, processed_content)])
         
         # Update thread timestamp
         cursor.execute("""
@@ -287,11 +338,14 @@ def new_post(thread_id: int):
             SET updated_at = CURRENT_TIMESTAMP
             WHERE id = ?
         """, (thread_id,))
+    
+    # Notify readers once the post is committed
+    events.publish(thread_id, post_id, 'new_post')
         
     return redirect(url_for('forum.view_thread', thread_id=thread_id))
 
 @forum_blueprint.route("/post/<int:post_id>/edit", methods=["GET", "POST"])
-@rate_limit()
+@rate_limit(cost=inline_image_cost())
 def edit_post(post_id: int):
     """Edit post if user is creator."""
     if not session.get('user_id'):
@@ -312,34 +366,41 @@ def edit_post(post_id: int):
         if not post or post['created_by'] != session['user_id']:
             abort(403)
 
-        if request.method == "POST":
-            new_content = request.form.get('content', '').strip()
-            
-            # Store edit history with original markdown
-            cursor.execute("""
-                INSERT INTO post_edits (
-                    post_id, edited_by, old_content, new_content
-                )
-                VALUES (?, ?, ?, ?)
-            """, (post_id, session['user_id'], post['content'], new_content))
-            
-            # Process content but keep as markdown
-            processor = ContentProcessor(conn)
-            processed_content, _ = processor.process_new_post(new_content, post_id)
-            
-            # Update post with processed markdown (not HTML)
-            cursor.execute("""
-                UPDATE posts 
-                SET content = ?, updated_at = CURRENT_TIMESTAMP
-                WHERE id = ?
-            """, (processed_content, post_id))
-            
-            return redirect(url_for(
-                'forum.view_thread',
-                thread_id=post['thread_id']
-            ))
-            
-        return render_template('forum/edit_post.html', post=post)
+        if request.method != "POST":
+            return render_template('forum/edit_post.html', post=post, Config=Config)
+
+        new_content = request.form.get('content', '').strip()
+        
+        # Store edit history with original markdown
+        cursor.execute("""
+            INSERT INTO post_edits (
+                post_id, edited_by, old_content, new_content
+            )
+            VALUES (?, ?, ?, ?)
+        """, (post_id, session['user_id'], post['content'], new_content))
+        edit_id = cursor.lastrowid
+        
+        # Process content but keep as markdown
+        processor = ContentProcessor(conn)
+        processed_content, _ = processor.process_new_post(new_content, post_id, session['user_id'])
+        
+        # Update post with processed markdown (not HTML); the update drops
+        # the post's outdated render
+        cursor.execute("""
+            UPDATE posts 
+            SET content = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        """, (processed_content, post_id))
+        processor.save_renders('post', [(post_id, processed_content)])
+        processor.save_renders('post_edit', [(edit_id, new_content)])
+
+    # Notify readers once the edit is committed
+    events.publish(post['thread_id'], post_id, 'edit_post')
+    
+    return redirect(url_for(
+        'forum.view_thread',
+        thread_id=post['thread_id']
+    ))
 
 @forum_blueprint.route("/post/<int:post_id>/history")
 def post_history(post_id: int):
@@ -357,10 +418,7 @@ def post_history(post_id: int):
         """, (post_id,))
         post = cursor.fetchone()
         
-        if not post or not check_thread_access(
-            post['thread_id'],
-            session.get('user_id')
-        ):
+        if not post or not permissions.PermissionService(cursor).visible_posts([post_id]):
             abort(403)
         
         # Get edit history
@@ -374,12 +432,15 @@ def post_history(post_id: int):
         edits = cursor.fetchall()
         
         # Process edit history content for display
+        rendered = processor.render_stored(
+            'post_edit', [(edit['id'], edit['new_content']) for edit in edits]
+        )
         processed_edits = []
         for edit in edits:
             edit_dict = dict(edit)
             # Render markdown to HTML for display
             edit_dict['rendered_old_content'] = processor.render_markdown(edit_dict['old_content'])
-            edit_dict['rendered_new_content'] = processor.render_markdown(edit_dict['new_content'])
+            edit_dict['rendered_new_content'] = rendered[edit_dict['id']]
             processed_edits.append(edit_dict)
         
     return render_template('forum/post_history.html', post=post, edits=processed_edits, Config=Config)
@@ -394,15 +455,20 @@ def get_image(image_id: int):
         cursor.execute("""
             SELECT i.*, p.thread_id
             FROM images i
-            JOIN posts p ON i.post_id = p.id
+            LEFT JOIN posts p ON i.post_id = p.id
             WHERE i.id = ?
         """, (image_id,))
         image = cursor.fetchone()
         
-        if not image or not check_thread_access(
-            image['thread_id'],
-            session.get('user_id')
-        ):
+        if not image:
+            abort(404)
+        
+        # Uploads not yet attached to a post are only visible to the uploader;
+        # attached images follow their post, including post restrictions
+        if image['post_id'] is None:
+            if image['created_by'] != session.get('user_id'):
+                abort(404)
+        elif not permissions.PermissionService(cursor).visible_posts([image['post_id']]):
             abort(404)
         
         response = make_response(image['data'])
@@ -413,6 +479,40 @@ def get_image(image_id: int):
         )
         return response
 
+@forum_blueprint.route("/api/upload_image", methods=["POST"])
+@rate_limit(cost=1 + Config.RATE_LIMIT_IMAGE_COST)
+def upload_image():
+    """
+    Accept a multipart image upload ahead of posting.
+    Werkzeug spools the file part to a temporary file, so the body is
+    never held in memory as a string. Returns the image ID and URL to embed.
+    """
+    user_id = session.get('user_id')
+    if not user_id:
+        abort(401)
+    
+    # Reject oversized bodies before parsing anything
+    if request.content_length is None:
+        abort(411)
+    if request.content_length > Config.MAX_UPLOAD_BYTES:
+        abort(413)
+    
+    upload = request.files.get('image')
+    if not upload:
+        return jsonify({'error': 'No image provided'}), 400
+    
+    with get_db() as conn:
+        processor = ContentProcessor(conn)
+        try:
+            image_id = processor.store_upload(upload.stream, user_id)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+    
+    return jsonify({
+        'id': image_id,
+        'url': url_for('forum.get_image', image_id=image_id)
+    })
+
 @forum_blueprint.route("/api/search_users")
 def search_users():
     """Search users by username."""
@@ -464,39 +564,27 @@ def report_post(post_id: int):
             flash("Post not found")
             return redirect(url_for('forum.view_threads'))
         
-        # Get all moderators
-        cursor.execute("""
-            SELECT u.id 
-            FROM users u
-            JOIN moderators m ON u.id = m.user_id
-        """)
-        moderators = [row['id'] for row in cursor.fetchall()]
-        
         # Find or create "Moderation" group
-        cursor.execute("SELECT id FROM groups WHERE grouptext = 'Moderation'")
-        group = cursor.fetchone()
+        taxonomy = get_taxonomy()
+        group = taxonomy.group_named(MODERATION_GROUP)
         
         if not group:
-            cursor.execute("INSERT INTO groups (grouptext) VALUES ('Moderation')")
+            cursor.execute("INSERT INTO groups (grouptext) VALUES (?)", (MODERATION_GROUP,))
             group_id = cursor.lastrowid
         else:
-            group_id = group['id']
+            group_id = group.id
         
         # Find or create "Reported Post" category under "Moderation" group
-        cursor.execute("""
-            SELECT id FROM group_categories 
-            WHERE group_id = ? AND category = 'Reported Post'
-        """, (group_id,))
-        category = cursor.fetchone()
+        category = taxonomy.category_named(group_id, REPORT_CATEGORY)
         
         if not category:
             cursor.execute("""
                 INSERT INTO group_categories (group_id, category) 
-                VALUES (?, 'Reported Post')
-            """, (group_id,))
+                VALUES (?, ?)
+            """, (group_id, REPORT_CATEGORY))
             category_id = cursor.lastrowid
         else:
-            category_id = category['id']
+            category_id = category.id
         
         # Create report thread
         post_url = f"{request.host_url}forum/thread/{post_info['thread_id']}#post-{post_id}"
@@ -508,12 +596,11 @@ def report_post(post_id: int):
         """, (report_title, session['user_id'], group_id, category_id))
         report_thread_id = cursor.lastrowid
         
-        # Add moderators to thread_users
-        for mod_id in moderators:
-            cursor.execute("""
-                INSERT INTO thread_users (thread_id, user_id)
-                VALUES (?, ?)
-            """, (report_thread_id, mod_id))
+        # Open the thread to the moderators role, whoever holds it now or later
+        cursor.execute("""
+            INSERT INTO thread_roles (thread_id, role)
+            VALUES (?, ?)
+        """, (report_thread_id, permissions.MODERATORS_ROLE))
         
         # Create first post with report info
         report_content = f"""
@@ -535,6 +622,7 @@ User **{post_info['reporting_user']}** reported a post for your attention:
             INSERT INTO posts (thread_id, created_by, content)
             VALUES (?, ?, ?)
         """, (report_thread_id, session['user_id'], report_content))
+        ContentProcessor(conn).save_renders('post', [(cursor.lastrowid, report_content)])
         
         flash("Post reported to moderators")
         
@@ -545,18 +633,7 @@ def restrict_post(post_id: int):
     """Restrict a post to specific users (typically moderators)."""
     user_id = session.get('user_id')
     
-    # Check if user is a moderator
-    with get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT EXISTS (
-                SELECT 1 FROM moderators
-                WHERE user_id = ?
-            )
-        """, (user_id,))
-        is_moderator = bool(cursor.fetchone()[0])
-    
-    if not user_id or not is_moderator:
+    if not user_id or not permissions.is_moderator(fresh=True):
         abort(403)
     
     # Get the report thread ID from the form
@@ -576,53 +653,63 @@ def restrict_post(post_id: int):
             flash("Post not found")
             return redirect(url_for('forum.view_threads'))
         
-        # Get users who can see the report thread
-        cursor.execute("""
-            SELECT user_id 
-            FROM thread_users 
-            WHERE thread_id = ?
-        """, (report_thread_id,))
-        thread_users = [row['user_id'] for row in cursor.fetchall()]
-        
-        # Get all moderators
-        cursor.execute("SELECT user_id FROM moderators")
-        moderators = [row['user_id'] for row in cursor.fetchall()]
-        
-        # Combine users from both sources
-        allowed_users = set(thread_users + moderators)
-        
-        # Clear any existing restrictions
+        # Restrict to the users of the report thread and the moderators role
         cursor.execute("DELETE FROM post_users WHERE post_id = ?", (post_id,))
-        
-        # Add restrictions for each user
-        for user_id in allowed_users:
-            cursor.execute("""
-                INSERT INTO post_users (post_id, user_id)
-                VALUES (?, ?)
-            """, (post_id, user_id))
+        cursor.execute("""
+            INSERT INTO post_users (post_id, user_id)
+            SELECT ?, user_id FROM thread_users WHERE thread_id = ?
+        """, (post_id, report_thread_id))
+        cursor.execute("""
+            INSERT INTO post_roles (post_id, role)
+            VALUES (?, ?)
+            ON CONFLICT (post_id, role) DO NOTHING
+        """, (post_id, permissions.MODERATORS_ROLE))
         
         flash("Post visibility restricted to moderators and report participants")
     
     # Redirect back to the report thread
     return redirect(url_for('forum.view_thread', thread_id=report_thread_id))
 
-@forum_blueprint.route("/post/<int:post_id>/unrestrict", methods=["POST"])
-def unrestrict_post(post_id: int):
-    """Remove post restrictions, making it visible to anyone with thread access."""
+@forum_blueprint.route("/post/<int:post_id>/restrict_all", methods=["POST"])
+def restrict_author_posts(post_id: int):
+    """Restrict every post of this post's author in its thread, as a background job."""
     user_id = session.get('user_id')
     
-    # Check if user is a moderator
+    if not user_id or not permissions.is_moderator(fresh=True):
+        abort(403)
+    
+    report_thread_id = request.form.get('report_thread_id', type=int)
+    if not report_thread_id:
+        flash("Missing report thread ID")
+        return redirect(url_for('forum.view_threads'))
+    
     with get_db() as conn:
         cursor = conn.cursor()
         cursor.execute("""
-            SELECT EXISTS (
-                SELECT 1 FROM moderators
-                WHERE user_id = ?
-            )
-        """, (user_id,))
-        is_moderator = bool(cursor.fetchone()[0])
+            SELECT p2.id
+            FROM posts p
+            JOIN posts p2 ON p2.thread_id = p.thread_id AND p2.created_by = p.created_by
+            WHERE p.id = ?
+            ORDER BY p2.id
+        """, (post_id,))
+        post_ids = [row['id'] for row in cursor.fetchall()]
+    
+    if not post_ids:
+        flash("Post not found")
+        return redirect(url_for('forum.view_threads'))
+    
+    job_id = moderation_jobs.submit_job(
+        'restrict_posts', post_ids, user_id, {'report_thread_id': report_thread_id}
+    )
+    flash(f"Restricting {len(post_ids)} posts (job #{job_id}); progress is shown under Manage User Access")
+    return redirect(url_for('forum.view_thread', thread_id=report_thread_id))
+
+@forum_blueprint.route("/post/<int:post_id>/unrestrict", methods=["POST"])
+def unrestrict_post(post_id: int):
+    """Remove post restrictions, making it visible to anyone with thread access."""
+    user_id = session.get('user_id')
     
-    if not user_id or not is_moderator:
+    if not user_id or not permissions.is_moderator(fresh=True):
         abort(403)
     
     # Get the report thread ID from the form
@@ -644,6 +731,7 @@ def unrestrict_post(post_id: int):
         
         # Remove all restrictions
         cursor.execute("DELETE FROM post_users WHERE post_id = ?", (post_id,))
+        cursor.execute("DELETE FROM post_roles WHERE post_id = ?", (post_id,))
         
         flash("Post visibility restored to normal")
     
@@ -668,14 +756,7 @@ def add_thread_user(thread_id: int):
             flash("Thread not found")
             return redirect(url_for('forum.view_threads'))
         
-        # Check if user is a moderator
-        cursor.execute("""
-            SELECT EXISTS (
-                SELECT 1 FROM moderators
-                WHERE user_id = ?
-            )
-        """, (user_id,))
-        is_moderator = bool(cursor.fetchone()[0])
+        is_moderator = permissions.is_moderator(fresh=True)
         
         # Only thread creator or moderators can add users
         if user_id != thread['created_by'] and not is_moderator:
@@ -724,14 +805,7 @@ def remove_thread_user(thread_id: int, remove_user_id: int):
             flash("Thread not found")
             return redirect(url_for('forum.view_threads'))
         
-        # Check if user is a moderator
-        cursor.execute("""
-            SELECT EXISTS (
-                SELECT 1 FROM moderators
-                WHERE user_id = ?
-            )
-        """, (user_id,))
-        is_moderator = bool(cursor.fetchone()[0])
+        is_moderator = permissions.is_moderator(fresh=True)
         
         # Only thread creator or moderators can remove users
         if user_id != thread['created_by'] and not is_moderator:
@@ -761,13 +835,7 @@ def add_reporter_to_thread(thread_id: int):
         cursor = conn.cursor()
         
         # Check if user is a moderator or has access to the thread
-        cursor.execute("""
-            SELECT EXISTS (
-                SELECT 1 FROM moderators
-                WHERE user_id = ?
-            )
-        """, (user_id,))
-        is_moderator = bool(cursor.fetchone()[0])
+        is_moderator = permissions.is_moderator()
         
         if not is_moderator and not check_thread_access(thread_id, user_id):
             abort(403)
@@ -813,13 +881,7 @@ def add_author_to_thread(thread_id: int):
         cursor = conn.cursor()
         
         # Check if user is a moderator or has access to the thread
-        cursor.execute("""
-            SELECT EXISTS (
-                SELECT 1 FROM moderators
-                WHERE user_id = ?
-            )
-        """, (user_id,))
-        is_moderator = bool(cursor.fetchone()[0])
+        is_moderator = permissions.is_moderator()
         
         if not is_moderator and not check_thread_access(thread_id, user_id):
             abort(403)
@@ -851,7 +913,18 @@ def add_author_to_thread(thread_id: int):
 
 # This file contains updates to the forum.py view_threads route for improved filtering
 
+def _thread_list_filters() -> tuple:
+    """Session filters view_threads falls back to."""
+    return session.get('filter_group'), session.get('filter_category')
+
+def _keeps_thread_list_filters() -> bool:
+    """Requests choosing a filter update the session and must reach the view."""
+    return 'group_id' not in request.args and 'category_id' not in request.args
+
 @forum_blueprint.route("/")
+@conditional_get(lambda: [THREADS_TAG, TAXONOMY_TAG], vary=_thread_list_filters,
+                 cacheable=_keeps_thread_list_filters)
+@cached_page(lambda: [THREADS_TAG, TAXONOMY_TAG], vary=_thread_list_filters)
 def view_threads():
     """Show threads accessible to current user with filtering."""
     user_id = session.get('user_id')
@@ -890,33 +963,20 @@ def view_threads():
         # If not in request, use session value if available
         filter_category = session.get('filter_category')
     
+    # Groups for the filter dropdown and categories of the selected group
+    taxonomy = get_taxonomy()
+    categories = taxonomy.categories_of(filter_group)
+    
     with get_db() as conn:
         cursor = conn.cursor()
         
-        # Get all available groups for filter dropdown
-        cursor.execute("""
-            SELECT id, grouptext FROM groups ORDER BY grouptext
-        """)
-        all_groups = cursor.fetchall()
-        
-        # Get categories for the selected group
-        categories = []
-        if filter_group:
-            cursor.execute("""
-                SELECT id, category 
-                FROM group_categories 
-                WHERE group_id = ?
-                ORDER BY category
-            """, (filter_group,))
-            categories = cursor.fetchall()
-        
         # Different queries for logged in vs anonymous users
         query_parts = []
         query_params = []
         
         # Base query
         base_query = """
-            SELECT DISTINCT 
+            SELECT
                 t.*, u.username,
                 g.grouptext as group_name,
                 gc.category as category_name,
@@ -926,7 +986,6 @@ def view_threads():
             JOIN users u ON t.created_by = u.id
             LEFT JOIN groups g ON t.group_id = g.id
             LEFT JOIN group_categories gc ON t.category_id = gc.id
-            LEFT JOIN thread_users tu ON t.id = tu.thread_id
             LEFT JOIN posts p ON t.id = p.thread_id
             WHERE t.is_wiki = ?
         """
@@ -942,32 +1001,21 @@ def view_threads():
             query_parts.append("t.category_id = ?")
             query_params.append(filter_category)
         
-        # Add user access restrictions
+        # Add the user's group filters
         if user_id:
-            # Get the filtered groups for the user
-            cursor.execute("""
-                SELECT group_id 
-                FROM user_groups 
-                WHERE user_id = ? AND filter_on = 1
-            """, (user_id,))
-            filtered_groups = [row['group_id'] for row in cursor.fetchall()]
+            filtered_groups = permissions.filtered_groups()
             
             # If no groups are filtered, show threads from all groups
             if filtered_groups:
                 filtered_groups_str = ','.join('?' for _ in filtered_groups)
                 query_parts.append(f"(t.group_id IS NULL OR t.group_id IN ({filtered_groups_str}))")
                 query_params.extend(filtered_groups)
-            
-            # Add thread access control
-            query_parts.append("""(
-                tu.thread_id IS NULL 
-                OR tu.user_id = ?
-                OR t.created_by = ?
-            )""")
-            query_params.extend([user_id, user_id])
-        else:
-            # Anonymous users see all public threads
-            query_parts.append("tu.thread_id IS NULL")
+        
+        # Add thread access control: public threads plus the user's private
+        # ones (anonymous users see public threads only)
+        visible, visible_params = permissions.PermissionService(cursor, user_id).visible_thread_ids()
+        query_parts.append(f"t.id IN ({visible})")
+        query_params.extend(visible_params)
         
         # Combine all query parts
         where_clause = " AND ".join(query_parts) if query_parts else ""
@@ -987,8 +1035,9 @@ def view_threads():
     return render_template("forum/thread_list.html", 
                           threads=threads, 
                           page=page,
-                          groups=all_groups,
+                          groups=taxonomy.groups,
                           categories=categories,
+                          taxonomy_version=taxonomy.version,
                           selected_group=filter_group,
                           selected_category=filter_category,
                           is_wiki=is_wiki,
@@ -998,24 +1047,26 @@ def view_threads():
 
 @forum_blueprint.route("/api/categories/<int:group_id>")
 def get_categories(group_id: int):
-    """API endpoint to get categories for a specific group."""
-    with get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT id, category 
-            FROM group_categories 
-            WHERE group_id = ?
-            ORDER BY category
-        """, (group_id,))
-        categories = cursor.fetchall()
-        
-    return jsonify([{
-        'id': category['id'],
-        'category': category['category']
-    } for category in categories])
+    """
+    API endpoint to get categories for a specific group. Pages request it
+    with ?v=<taxonomy version>; such responses never change and may be
+    cached for TAXONOMY_MAX_AGE, others are revalidated by ETag.
+    """
+    taxonomy = get_taxonomy()
+    response = jsonify([{
+        'id': category.id,
+        'category': category.category
+    } for category in taxonomy.categories_of(group_id)])
+    
+    response.set_etag(f"taxonomy-{taxonomy.version}", weak=True)
+    if request.args.get('v', type=int) == taxonomy.version:
+        response.headers['Cache-Control'] = f"public, max-age={Config.TAXONOMY_MAX_AGE}, immutable"
+    else:
+        response.headers['Cache-Control'] = "public, no-cache"
+    return response.make_conditional(request)
 
 @forum_blueprint.route("/new_thread", methods=["GET", "POST"])
-@rate_limit()
+@rate_limit(cost=inline_image_cost())
 def new_thread():
     """Create new thread or wiki page with initial content."""
     if not session.get('user_id'):
@@ -1045,13 +1096,7 @@ def new_thread():
         # Verify the user has access to this group
         with get_db() as conn:
             cursor = conn.cursor()
-            cursor.execute("""
-                SELECT filter_on FROM user_groups 
-                WHERE user_id = ? AND group_id = ?
-            """, (session['user_id'], group_id))
-            
-            group_access = cursor.fetchone()
-            if not group_access or not group_access['filter_on']:
+            if request.form.get('group_id', type=int) not in permissions.filtered_groups(fresh=True):
                 flash("You don't have access to post in this group")
                 return redirect(url_for('forum.new_thread', is_wiki=1 if is_wiki else 0))
             
@@ -1084,7 +1129,7 @@ def new_thread():
             post_id = cursor.lastrowid
             
             # Process content (convert base64 images to URLs) but keep as markdown
-            processed_content, _ = processor.process_new_post(content, post_id)
+            processed_content, _ = processor.process_new_post(content, post_id, session['user_id'])
             
             # Update post with processed markdown (not HTML)
             cursor.execute("""
@@ -1092,6 +1137,7 @@ def new_thread():
                 SET content = ?
                 WHERE id = ?
             """, (processed_content, post_id))
+            processor.save_renders('post', [(post_id, processed_content)])
             
             # If this is a wiki page, also create an entry in wiki_revisions
             if is_wiki:
@@ -1101,19 +1147,13 @@ def new_thread():
             
         return redirect(url_for('forum.view_thread', thread_id=thread_id))
     
-    # GET request - Fetch filtered groups for the form
-    with get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT g.id, g.grouptext 
-            FROM groups g
-            JOIN user_groups ug ON g.id = ug.group_id
-            WHERE ug.user_id = ? AND ug.filter_on = 1
-            ORDER BY g.grouptext
-        """, (session.get('user_id'),))
-        groups = cursor.fetchall()
+    # GET request - Offer the groups the user filters on
+    taxonomy = get_taxonomy()
+    filtered = set(permissions.filtered_groups())
+    groups = [group for group in taxonomy.groups if group.id in filtered]
         
     return render_template('forum/new_thread.html', 
                           groups=groups, 
                           Config=Config, 
-                          is_wiki=is_wiki)
+                          is_wiki=is_wiki,
+                          taxonomy_version=taxonomy.version)
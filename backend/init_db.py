@@ -11,6 +11,257 @@ Usage:
 
 import sqlite3
 from backend.config import Config
+from backend.usernames import create_username_pool
+from backend.moderation_jobs import create_jobs_table
+
+# Page cache invalidation: (trigger name, table, event, tag expressions).
+# Each trigger bumps the version of the tags of every page showing the
+# changed rows, see backend/page_cache.py
+CACHE_TAG_TRIGGERS = [
+    ("posts_insert", "posts", "INSERT", ["'thread:' || NEW.thread_id", "'threads'"]),
+    ("posts_update", "posts", "UPDATE OF content, thread_id",
+     ["'thread:' || NEW.thread_id", "'thread:' || OLD.thread_id", "'threads'"]),
+    ("posts_delete", "posts", "DELETE", ["'thread:' || OLD.thread_id", "'threads'"]),
+    ("post_users_insert", "post_users", "INSERT",
+     ["'thread:' || (SELECT thread_id FROM posts WHERE id = NEW.post_id)"]),
+    ("post_users_delete", "post_users", "DELETE",
+     ["'thread:' || (SELECT thread_id FROM posts WHERE id = OLD.post_id)"]),
+    ("thread_users_insert", "thread_users", "INSERT", ["'thread:' || NEW.thread_id", "'threads'"]),
+    ("thread_users_delete", "thread_users", "DELETE", ["'thread:' || OLD.thread_id", "'threads'"]),
+    ("threads_insert", "threads", "INSERT", ["'thread:' || NEW.id", "'threads'"]),
+    ("threads_update", "threads", "UPDATE OF title, group_id, category_id, is_wiki, wiki_page_id",
+     ["'thread:' || NEW.id", "'threads'"]),
+    ("threads_delete", "threads", "DELETE", ["'thread:' || OLD.id", "'threads'"]),
+    # Per-user pages and permission claims (moderator controls, thread list
+    # filters), see backend/permissions.py
+    ("moderators_insert", "moderators", "INSERT", ["'user:' || NEW.user_id"]),
+    ("moderators_delete", "moderators", "DELETE", ["'user:' || OLD.user_id"]),
+    # Role entries of thread and post ACLs (e.g. report threads)
+    ("thread_roles_insert", "thread_roles", "INSERT", ["'thread:' || NEW.thread_id", "'threads'"]),
+    ("thread_roles_delete", "thread_roles", "DELETE", ["'thread:' || OLD.thread_id", "'threads'"]),
+    ("post_roles_insert", "post_roles", "INSERT",
+     ["'thread:' || (SELECT thread_id FROM posts WHERE id = NEW.post_id)"]),
+    ("post_roles_delete", "post_roles", "DELETE",
+     ["'thread:' || (SELECT thread_id FROM posts WHERE id = OLD.post_id)"]),
+]
+
+# Tables that no longer have CACHE_TAG_TRIGGERS entries; their cache_tags_*
+# triggers are dropped on existing databases
+RETIRED_CACHE_TAG_TABLES = ["wiki_pages", "user_bans"]
+
+def create_cache_tags(cursor):
+    """Page cache tag versions (no dependencies) and the triggers bumping them."""
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS cache_tags (
+        tag TEXT PRIMARY KEY,
+        version INTEGER NOT NULL DEFAULT 1,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    """)
+    create_cache_tag_triggers(cursor)
+
+def create_cache_tag_triggers(cursor):
+    """
+    Create the page cache invalidation triggers, dropping any other
+    cache_tags_* trigger on their tables (earlier, position-numbered names
+    and retired entries).
+    """
+    names = {f"cache_tags_{name}" for name, _, _, _ in CACHE_TAG_TRIGGERS}
+    tables = {table for _, table, _, _ in CACHE_TAG_TRIGGERS} | set(RETIRED_CACHE_TAG_TABLES)
+    cursor.execute(f"""
+        SELECT name FROM sqlite_master
+        WHERE type = 'trigger' AND name LIKE 'cache^_tags^_%' ESCAPE '^'
+          AND tbl_name IN ({",".join("?" * len(tables))})
+    """, sorted(tables))
+    for (stale,) in cursor.fetchall():
+        if stale not in names:
+            cursor.execute(f"DROP TRIGGER {stale}")
+
+    for name, table, event, tags in CACHE_TAG_TRIGGERS:
+        # WHERE also disambiguates the upsert after INSERT ... SELECT
+        bumps = "\n".join(f"""
+            INSERT INTO cache_tags (tag)
+            SELECT tag FROM (SELECT {tag} AS tag) WHERE tag IS NOT NULL
+            ON CONFLICT (tag) DO UPDATE SET
+                version = version + 1, updated_at = CURRENT_TIMESTAMP;""" for tag in tags)
+        cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS cache_tags_{name}
+        AFTER {event} ON {table}
+        BEGIN {bumps}
+        END;
+        """)
+
+def create_images_table(cursor, table="images"):
+    """
+    Images, with post_id NULL for uploads that have not been attached to a
+    post yet. maintenance image-uploads builds the table under another name
+    and swaps it in on databases from before uploads.
+    """
+    cursor.execute(f"""
+    CREATE TABLE IF NOT EXISTS {table} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        post_id INTEGER,
+        created_by INTEGER,
+        filename TEXT NOT NULL,
+        content_type TEXT NOT NULL,
+        data BLOB NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        last_seen_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (post_id) REFERENCES posts(id) ON DELETE CASCADE,
+        FOREIGN KEY (created_by) REFERENCES users(id)
+    );
+    """)
+
+# Stored renders removed with their source: (table, event, source_type,
+# id expression, dependent source_type, query of dependent ids)
+RENDER_CLEANUP_TRIGGERS = [
+    ("posts", "UPDATE OF content", "post", "NEW.id", None, None),
+    ("posts", "DELETE", "post", "OLD.id",
+     "post_edit", "SELECT id FROM post_edits WHERE post_id = OLD.id"),
+    ("post_edits", "DELETE", "post_edit", "OLD.id", None, None),
+    ("wiki_pages", "UPDATE OF content", "wiki_page", "NEW.id", None, None),
+    ("wiki_pages", "DELETE", "wiki_page", "OLD.id",
+     "wiki_revision", "SELECT id FROM wiki_revisions WHERE wiki_page_id = OLD.id"),
+    ("wiki_revisions", "DELETE", "wiki_revision", "OLD.id", None, None),
+]
+
+def create_content_renders(cursor):
+    """
+    Rendered HTML of stored Markdown (see ContentProcessor.save_renders).
+    Rows are checked against content_hash and render_version on read;
+    triggers drop them when their source is edited or deleted.
+    """
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS content_renders (
+        source_type TEXT NOT NULL,
+        source_id INTEGER NOT NULL,
+        content_hash TEXT NOT NULL,
+        render_version TEXT NOT NULL,
+        html TEXT NOT NULL,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (source_type, source_id)
+    );
+    """)
+    for table, event, source_type, source_id, dependent_type, dependents in RENDER_CLEANUP_TRIGGERS:
+        # Dependent rows go too, since foreign keys are not enforced to cascade
+        dependent = f"""
+            DELETE FROM content_renders
+            WHERE source_type = '{dependent_type}' AND source_id IN ({dependents});""" if dependents else ""
+        cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS content_renders_{table}_{event.split()[0].lower()}
+        AFTER {event} ON {table}
+        BEGIN
+            DELETE FROM content_renders
+            WHERE source_type = '{source_type}' AND source_id = {source_id};{dependent}
+        END;
+        """)
+
+def create_post_events(cursor):
+    """
+    Change table feeding live thread updates in every worker (no
+    dependencies; pruned after EVENT_RETENTION), see backend/events.py.
+    """
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS post_events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        thread_id INTEGER NOT NULL,
+        post_id INTEGER NOT NULL,
+        kind TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    """)
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_post_events_thread ON post_events(thread_id, id);
+    """)
+
+def create_user_tokens(cursor):
+    """
+    Tokens of each user in one row (depends on users): 16-byte truncated
+    hashes packed end to end, and bit i of used set once one-time token i
+    has been spent, see backend/auth.py.
+    """
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS user_tokens (
+        user_id INTEGER PRIMARY KEY,
+        permanent BLOB NOT NULL,
+        one_time BLOB NOT NULL,
+        used INTEGER NOT NULL DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+    );
+    """)
+
+def create_legacy_token_index(cursor):
+    """Legacy token logins: covers the whole lookup, one probe per attempt."""
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_tokens_user_hash ON tokens(user_id, token_hash, one_time);
+    """)
+
+def create_thread_post_indexes(cursor):
+    """Posts of a thread in id order (thread pages, "posts since" fragments) and their edits."""
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_posts_thread ON posts(thread_id, id);
+    """)
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_post_edits_post ON post_edits(post_id);
+    """)
+
+def create_role_tables(cursor):
+    """
+    ACL entries naming a role instead of a user: one row opens a thread or
+    post to every holder of the role (see permissions.MODERATORS_ROLE).
+    """
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS thread_roles (
+        thread_id INTEGER NOT NULL,
+        role TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (thread_id, role),
+        FOREIGN KEY (thread_id) REFERENCES threads(id) ON DELETE CASCADE
+    ) WITHOUT ROWID;
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS post_roles (
+        post_id INTEGER NOT NULL,
+        role TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (post_id, role),
+        FOREIGN KEY (post_id) REFERENCES posts(id) ON DELETE CASCADE
+    ) WITHOUT ROWID;
+    """)
+
+def create_private_thread_index(cursor):
+    """
+    Keep threads.is_private in step with thread_users and thread_roles, so
+    listings can tell public threads apart with the column and reach a
+    user's private threads through idx_thread_users_user instead of probing
+    thread_users per thread.
+    """
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_thread_users_user ON thread_users(user_id, thread_id);
+    """)
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_threads_private ON threads(is_private, created_by);
+    """)
+    for table in ("thread_users", "thread_roles"):
+        cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS threads_private_{table}_insert
+        AFTER INSERT ON {table}
+        BEGIN
+            UPDATE threads SET is_private = 1 WHERE id = NEW.thread_id AND is_private = 0;
+        END;
+        """)
+        cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS threads_private_{table}_delete
+        AFTER DELETE ON {table}
+        BEGIN
+            UPDATE threads SET is_private = 0
+            WHERE id = OLD.thread_id
+              AND NOT EXISTS (SELECT 1 FROM thread_users WHERE thread_id = OLD.thread_id)
+              AND NOT EXISTS (SELECT 1 FROM thread_roles WHERE thread_id = OLD.thread_id);
+        END;
+        """)
 
 def reset_database():
     """Initialize fresh database, dropping existing tables."""
@@ -20,7 +271,15 @@ def reset_database():
     # Enable foreign keys
     cursor.execute("PRAGMA foreign_keys = ON")
 
+    # Let maintenance reclaim space from deleted images with incremental
+    # vacuum (only takes effect on a fresh database file)
+    cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+
     # Drop existing tables
+    cursor.execute("DROP TABLE IF EXISTS moderation_jobs;")
+    cursor.execute("DROP TABLE IF EXISTS post_events;")
+    cursor.execute("DROP TABLE IF EXISTS cache_tags;")
+    cursor.execute("DROP TABLE IF EXISTS content_renders;")
     cursor.execute("DROP TABLE IF EXISTS user_bans;")
     cursor.execute("DROP TABLE IF EXISTS wiki_revisions;")
     cursor.execute("DROP TABLE IF EXISTS post_users;")
@@ -28,11 +287,15 @@ def reset_database():
     cursor.execute("DROP TABLE IF EXISTS images;")
     cursor.execute("DROP TABLE IF EXISTS post_edits;")
     cursor.execute("DROP TABLE IF EXISTS posts;")
+    cursor.execute("DROP TABLE IF EXISTS post_roles;")
+    cursor.execute("DROP TABLE IF EXISTS thread_roles;")
     cursor.execute("DROP TABLE IF EXISTS thread_users;")
     cursor.execute("DROP TABLE IF EXISTS moderators;")
     cursor.execute("DROP TABLE IF EXISTS threads;")
     cursor.execute("DROP TABLE IF EXISTS wiki_pages;")
+    cursor.execute("DROP TABLE IF EXISTS user_tokens;")
     cursor.execute("DROP TABLE IF EXISTS tokens;")
+    cursor.execute("DROP TABLE IF EXISTS username_pool;")
     cursor.execute("DROP TABLE IF EXISTS users;")
 
     # Create users table first (no dependencies)
@@ -44,11 +307,19 @@ def reset_database():
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
         updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
         last_seen_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        filter_groups INTEGER NOT NULL DEFAULT 0,  -- Bit per filtered group id < 64, maintained by user_groups triggers
+        filter_group_count INTEGER NOT NULL DEFAULT 0,  -- Groups filtered on, maintained by user_groups triggers
         CHECK (language IN ('en', 'fr', 'es'))
     );
     """)
 
-    # Create tokens table (depends on users)
+    # Free usernames (depends on users), see backend/usernames.py
+    create_username_pool(cursor)
+
+    # Tokens of each user in one row (depends on users)
+    create_user_tokens(cursor)
+
+    # Legacy one-row-per-token table, emptied by `maintenance migrate-tokens`
     cursor.execute("""
     CREATE TABLE tokens (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -101,6 +372,7 @@ def reset_database():
         category_id INTEGER,
         is_wiki BOOLEAN DEFAULT 0,
         wiki_page_id INTEGER,
+        is_private INTEGER NOT NULL DEFAULT 0,  -- Has thread_users, maintained by triggers
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
         updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
         last_seen_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
@@ -154,6 +426,8 @@ def reset_database():
     );
     """)
 
+    create_role_tables(cursor)
+
     # Post edits table (depends on posts and users)
     cursor.execute("""
     CREATE TABLE post_edits (
@@ -168,20 +442,8 @@ def reset_database():
     );
     """)
 
-    # Images table (depends on posts)
-    cursor.execute("""
-    CREATE TABLE images (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        post_id INTEGER NOT NULL,
-        filename TEXT NOT NULL,
-        content_type TEXT NOT NULL,
-        data BLOB NOT NULL,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        last_seen_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (post_id) REFERENCES posts(id) ON DELETE CASCADE
-    );
-    """)
+    # Images table (depends on posts and users)
+    create_images_table(cursor)
 
     # Translations table (depends on users)
     cursor.execute("""
@@ -228,6 +490,24 @@ def reset_database():
     );
     """)
 
+    # Rendered HTML of posts, edits and wiki content (depends on posts,
+    # post_edits, wiki_pages and wiki_revisions for its cleanup triggers)
+    create_content_renders(cursor)
+
+    # Page cache tag versions
+    create_cache_tags(cursor)
+    create_private_thread_index(cursor)
+
+    # Bulk moderation jobs (depends on users), see backend/moderation_jobs.py
+    create_jobs_table(cursor)
+
+    # Change table feeding live thread updates in every worker
+    create_post_events(cursor)
+
+    create_legacy_token_index(cursor)
+
+    create_thread_post_indexes(cursor)
+
     # Create indexes for wiki tables
     cursor.execute("""
     CREATE INDEX idx_wiki_page_title ON wiki_pages(title);
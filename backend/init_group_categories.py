@@ -11,6 +11,85 @@ Usage:
 import sqlite3
 from backend.config import Config
 
+def create_filter_group_triggers(cursor):
+    """
+    Mirror filter_on into users.filter_groups, a bitmask with bit n for
+    group id n (ids of 64 and above are left out, see
+    permissions._load_claims), and into the users.filter_group_count
+    counter. Each change adjusts one bit and the count, so bulk updates
+    stay O(rows).
+    (&, | and << share one precedence level in SQLite; keep the brackets.)
+    """
+    bit = "(1 << {row}.group_id)"
+    clear = f"""
+        UPDATE users SET filter_groups = filter_groups & ~{bit}
+        WHERE id = {{row}}.user_id AND {{row}}.group_id BETWEEN 0 AND 63;"""
+    assign = f"""
+        UPDATE users SET filter_groups = (filter_groups & ~{bit}) | (({{row}}.filter_on <> 0) << {{row}}.group_id)
+        WHERE id = {{row}}.user_id AND {{row}}.group_id BETWEEN 0 AND 63;"""
+    bodies = {
+        "INSERT": assign.format(row="NEW"),
+        "UPDATE": clear.format(row="OLD") + assign.format(row="NEW"),
+        "DELETE": clear.format(row="OLD"),
+    }
+    for event, body in bodies.items():
+        cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS user_groups_filter_{event.lower()}
+        AFTER {event} ON user_groups
+        BEGIN {body}
+        END;
+        """)
+
+    # Number of groups filtered on, for the admin user directory
+    count = """
+        UPDATE users SET filter_group_count = filter_group_count {sign} ({row}.filter_on <> 0)
+        WHERE id = {row}.user_id;"""
+    bodies = {
+        "INSERT": count.format(sign="+", row="NEW"),
+        "UPDATE": count.format(sign="-", row="OLD") + count.format(sign="+", row="NEW"),
+        "DELETE": count.format(sign="-", row="OLD"),
+    }
+    for event, body in bodies.items():
+        cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS user_groups_count_{event.lower()}
+        AFTER {event} ON user_groups
+        BEGIN {body}
+        END;
+        """)
+
+def create_user_group_tag_triggers(cursor):
+    """
+    Thread list filters are per user: invalidate the user's cached pages
+    and permission claims (same as CACHE_TAG_TRIGGERS in init_db.py).
+    """
+    for event, row in (("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD")):
+        cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS cache_tags_user_groups_{event.lower()}
+        AFTER {event} ON user_groups
+        BEGIN
+            INSERT INTO cache_tags (tag) VALUES ('user:' || {row}.user_id)
+            ON CONFLICT (tag) DO UPDATE SET
+                version = version + 1, updated_at = CURRENT_TIMESTAMP;
+        END;
+        """)
+
+def create_taxonomy_triggers(cursor):
+    """
+    Groups and categories are cached per worker: bump the 'taxonomy' tag
+    on every change (see backend/taxonomy.py).
+    """
+    for table in ("groups", "group_categories"):
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS cache_tags_{table}_{event.lower()}
+            AFTER {event} ON {table}
+            BEGIN
+                INSERT INTO cache_tags (tag) VALUES ('taxonomy')
+                ON CONFLICT (tag) DO UPDATE SET
+                    version = version + 1, updated_at = CURRENT_TIMESTAMP;
+            END;
+            """)
+
 def reset_gc():
     """Initialize fresh database, dropping existing tables."""
     conn = sqlite3.connect(Config.SQLITE_DB_PATH)
@@ -47,6 +126,8 @@ def reset_gc():
     );
     """)
 
+    create_filter_group_triggers(cursor)
+    create_user_group_tag_triggers(cursor)
 
     cursor.execute("""
     CREATE TABLE IF NOT EXISTS group_categories (
@@ -60,6 +141,8 @@ def reset_gc():
     );
     """)
 
+    create_taxonomy_triggers(cursor)
+
     # Predefined data for groups and categories
     groups_data = [
         ("Moderation",),
@@ -0,0 +1,981 @@
+"""
+Maintenance Commands
+====================
+
+Housekeeping tasks that run outside the request cycle, typically from cron.
+Every command works in small batches with short transactions, so it is safe
+to run against the live database.
+
+Usage (from the repository root):
+    python -m backend.maintenance image-uploads [--batch-size N]
+    python -m backend.maintenance gc-images [--dry-run]
+    python -m backend.maintenance cache-tags
+    python -m backend.maintenance thread-posts
+    python -m backend.maintenance post-events
+    python -m backend.maintenance compare-renderers [--show N]
+    python -m backend.maintenance check-sanitizers [--show N]
+    python -m backend.maintenance rerender [--workers N] [--force] [--restart]
+    python -m backend.maintenance username-pool [--build]
+    python -m backend.maintenance migrate-tokens [--batch-size N]
+    python -m backend.maintenance private-threads [--batch-size N]
+    python -m backend.maintenance thread-roles [--batch-size N]
+    python -m backend.maintenance taxonomy-triggers
+    python -m backend.maintenance group-filters [--batch-size N]
+    python -m backend.maintenance run-jobs
+"""
+
+import argparse
+import collections
+import difflib
+import multiprocessing
+import os
+import re
+import sys
+import time
+from html.parser import HTMLParser
+from typing import Iterator, List, Set, Tuple
+from backend.auth import MAX_ONE_TIME_TOKENS, pack_digests
+from backend.config import Config
+from backend.content import (
+    IMAGE_URL_PATTERN, WIKI_SOURCE_TYPES, content_hash, process_wiki_links, render_source
+)
+from backend.database import get_db
+from backend.events import prune_events
+from backend.init_db import (
+    create_cache_tag_triggers, create_cache_tags, create_content_renders, create_images_table,
+    create_legacy_token_index, create_post_events, create_private_thread_index, create_role_tables,
+    create_thread_post_indexes, create_user_tokens
+)
+from backend.init_group_categories import (
+    create_filter_group_triggers, create_taxonomy_triggers, create_user_group_tag_triggers
+)
+from backend.moderation_jobs import create_jobs_table, run_pending
+from backend.permissions import MODERATORS_ROLE
+from backend.usernames import USERNAME_SYLLABLES, create_username_pool, pool_status
+from backend.rendering import (
+    ALLOWED_ATTRS, ALLOWED_PROTOCOLS, ALLOWED_TAGS,
+    BleachSanitizer, MarkdownItRenderer, Nh3Sanitizer, PythonMarkdownRenderer,
+    get_renderer, get_sanitizer, render_version
+)
+
+# Every column that may contain Markdown referencing /forum/api/image/<id>
+IMAGE_REFERENCE_SOURCES = [
+    # (table, content columns, timestamp column or None)
+    ("posts", ("content",), "updated_at"),
+    ("post_edits", ("old_content", "new_content"), None),
+    ("wiki_pages", ("content",), "updated_at"),
+    ("wiki_revisions", ("content",), None),
+]
+
+def _chunks(items: list, size: int) -> Iterator[list]:
+    """Yield successive slices of items."""
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def _existing_tables(conn) -> Set[str]:
+    """Names of the tables present in the database."""
+    cursor = conn.cursor()
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+    return {row['name'] for row in cursor.fetchall()}
+
+def scan_image_references(after: dict = None, since: str = None,
+                          batch_size: int = 500) -> Tuple[Set[int], dict]:
+    """
+    Collect image IDs referenced by post content, retained edit history and
+    wiki content. Tables are read in id-ordered chunks, one short read each.
+
+    With after/since, only rows with a higher id or a newer timestamp are
+    scanned; this is used to pick up references written during a sweep.
+    Returns the referenced IDs and the highest id seen per table.
+    """
+    referenced = set()
+    high_water = {}
+
+    with get_db() as conn:
+        tables = _existing_tables(conn)
+
+    for table, columns, timestamp in IMAGE_REFERENCE_SOURCES:
+        if table not in tables:
+            continue
+
+        last_id = (after or {}).get(table, 0)
+        high_water[table] = last_id
+        select = ", ".join(columns)
+
+        # Rows updated in place since the previous scan
+        if since and timestamp:
+            with get_db() as conn:
+                cursor = conn.cursor()
+                cursor.execute(f"""
+                    SELECT {select} FROM {table}
+                    WHERE id <= ? AND {timestamp} >= ?
+                """, (last_id, since))
+                for row in cursor.fetchall():
+                    for value in row:
+                        referenced.update(int(i) for i in IMAGE_URL_PATTERN.findall(value or ''))
+
+        while True:
+            with get_db() as conn:
+                cursor = conn.cursor()
+                cursor.execute(f"""
+                    SELECT id, {select} FROM {table}
+                    WHERE id > ?
+                    ORDER BY id
+                    LIMIT ?
+                """, (last_id, batch_size))
+                rows = cursor.fetchall()
+
+            if not rows:
+                break
+
+            for row in rows:
+                for value in tuple(row)[1:]:
+                    referenced.update(int(i) for i in IMAGE_URL_PATTERN.findall(value or ''))
+            last_id = rows[-1]['id']
+            high_water[table] = last_id
+
+    return referenced, high_water
+
+def find_orphaned_images(referenced: Set[int]) -> list:
+    """
+    IDs of images no content refers to. Uploads that were never attached
+    are only considered once they are older than the grace period, since
+    their author may still be writing the post.
+    """
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT id FROM images
+            WHERE post_id IS NOT NULL
+               OR created_at < datetime('now', ?)
+            ORDER BY id
+        """, (f"-{Config.IMAGE_UPLOAD_GRACE_PERIOD} seconds",))
+        return [row['id'] for row in cursor.fetchall() if row['id'] not in referenced]
+
+def delete_images(image_ids: list, batch_size: int) -> Tuple[int, int]:
+    """
+    Delete images in small batches, one transaction each.
+    Returns (images deleted, BLOB bytes deleted).
+    """
+    deleted = 0
+    freed = 0
+
+    for batch in _chunks(image_ids, batch_size):
+        placeholders = ",".join("?" for _ in batch)
+        with get_db() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"""
+                DELETE FROM images
+                WHERE id IN ({placeholders})
+                RETURNING length(data)
+            """, batch)
+            sizes = [row[0] for row in cursor.fetchall()]
+        deleted += len(sizes)
+        freed += sum(sizes)
+
+    return deleted, freed
+
+def reclaim_space() -> Tuple[int, bool]:
+    """
+    Return free pages to the filesystem with an incremental vacuum.
+    Returns (bytes reclaimed, whether incremental vacuum is available).
+    """
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("PRAGMA auto_vacuum")
+        if cursor.fetchone()[0] != 2:  # 2 = INCREMENTAL
+            return 0, False
+
+        cursor.execute("PRAGMA page_size")
+        page_size = cursor.fetchone()[0]
+        cursor.execute("PRAGMA page_count")
+        before = cursor.fetchone()[0]
+
+        # Each step is a short write; stop when no free pages remain
+        while True:
+            cursor.execute("PRAGMA freelist_count")
+            if cursor.fetchone()[0] == 0:
+                break
+            cursor.execute(f"PRAGMA incremental_vacuum({Config.IMAGE_GC_VACUUM_PAGES})")
+            cursor.fetchall()
+            conn.commit()
+
+        cursor.execute("PRAGMA page_count")
+        after = cursor.fetchone()[0]
+
+    return (before - after) * page_size, True
+
+# Columns of images copied by image-uploads; created_by comes from the post
+IMAGE_COLUMNS = "filename, content_type, data, created_at, updated_at, last_seen_at"
+
+def _copy_images(cursor, condition: str, params: tuple) -> int:
+    """Copy the images matching condition (on alias i) into images_new."""
+    cursor.execute(f"""
+        INSERT INTO images_new (id, post_id, created_by, {IMAGE_COLUMNS})
+        SELECT i.id, i.post_id, p.created_by, {", ".join("i." + c for c in IMAGE_COLUMNS.split(", "))}
+        FROM images i
+        LEFT JOIN posts p ON p.id = i.post_id
+        WHERE {condition}
+        ON CONFLICT (id) DO NOTHING
+    """, params)
+    return cursor.rowcount
+
+def image_uploads(args):
+    """Rebuild images with a nullable post_id and a created_by backfilled from the posts."""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT name FROM pragma_table_info('images')")
+        if 'created_by' in {row['name'] for row in cursor.fetchall()}:
+            print("images already accepts uploads")
+            return
+        # post_id loses NOT NULL, which SQLite can only do by rebuilding the table
+        create_images_table(cursor, "images_new")
+        # Rows updated in place after they were copied are copied again at the swap
+        cursor.execute("CREATE TABLE IF NOT EXISTS images_changed (id INTEGER PRIMARY KEY)")
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS images_changed_update AFTER UPDATE ON images
+            BEGIN
+                INSERT OR IGNORE INTO images_changed (id) VALUES (OLD.id);
+                INSERT OR IGNORE INTO images_changed (id) VALUES (NEW.id);
+            END
+        """)
+        cursor.execute("SELECT COALESCE(MAX(id), 0) FROM images_new")
+        last_id = cursor.fetchone()[0]
+
+    # Copy in id ranges, resuming after the rows of an interrupted run
+    copied = 0
+    while True:
+        with get_db() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT MAX(id) FROM (SELECT id FROM images WHERE id > ? ORDER BY id LIMIT ?)
+            """, (last_id, args.batch_size))
+            batch_end = cursor.fetchone()[0]
+            if batch_end is None:
+                break
+            copied += _copy_images(cursor, "i.id > ? AND i.id <= ?", (last_id, batch_end))
+            last_id = batch_end
+        print(f"\rCopied {copied} images", end="", flush=True)
+    print()
+
+    # Swap under the write lock, with the rows added, deleted or updated
+    # meanwhile; get_db commits on exit, so roll back explicitly on error
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            cursor.execute("""
+                DELETE FROM images_new
+                WHERE id NOT IN (SELECT id FROM images)
+                   OR id IN (SELECT id FROM images_changed)
+            """)
+            copied += _copy_images(
+                cursor, "i.id > ? OR i.id IN (SELECT id FROM images_changed)", (last_id,)
+            )
+            cursor.execute("DROP TABLE images")
+            cursor.execute("DROP TABLE images_changed")
+            cursor.execute("ALTER TABLE images_new RENAME TO images")
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+    print(f"Done: {copied} images copied, uploads enabled")
+
+def gc_images(args):
+    """Delete images no longer referenced by any post, edit or wiki page."""
+    started = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
+    referenced, high_water = scan_image_references()
+    orphaned = find_orphaned_images(referenced)
+
+    # Pick up references written while the first scan was running
+    if orphaned:
+        late, _ = scan_image_references(after=high_water, since=started)
+        orphaned = [image_id for image_id in orphaned if image_id not in late]
+
+    print(f"{len(referenced)} referenced images, {len(orphaned)} orphaned")
+    if args.dry_run or not orphaned:
+        return
+
+    deleted, freed = delete_images(orphaned, Config.IMAGE_GC_BATCH_SIZE)
+    print(f"Deleted {deleted} images ({freed} bytes of image data)")
+
+    reclaimed, incremental = reclaim_space()
+    if incremental:
+        print(f"Reclaimed {reclaimed} bytes from the database file")
+    else:
+        print("auto_vacuum is not INCREMENTAL; freed pages will be reused "
+              "but the file will not shrink until a full VACUUM")
+
+def cache_tags(args):
+    """Create the cache_tags table and every trigger that bumps its tag versions."""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        # Some triggers are on the role tables
+        create_role_tables(cursor)
+        create_cache_tags(cursor)
+        create_user_group_tag_triggers(cursor)
+        create_taxonomy_triggers(cursor)
+    print("Cache tags and their triggers installed")
+
+def thread_posts(args):
+    """Create the indexes behind thread pages and the thread posts endpoint."""
+    with get_db() as conn:
+        create_thread_post_indexes(conn.cursor())
+    print("Done")
+
+def post_events(args):
+    """Create the post_events table if needed and drop events past their retention."""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        create_post_events(cursor)
+        pruned = prune_events(cursor)
+    print(f"Done: {pruned} expired events pruned")
+
+# Stored Markdown, as (content_renders source_type, table, column)
+CONTENT_SOURCES = [
+    ("post", "posts", "content"),
+    ("post_edit", "post_edits", "new_content"),
+    ("wiki_page", "wiki_pages", "content"),
+    ("wiki_revision", "wiki_revisions", "content"),
+]
+
+def iter_corpus(batch_size: int = 500, start: dict = None) -> Iterator[Tuple[str, int, str]]:
+    """
+    Yield (source, id, markdown) for all stored content in id order, one
+    short read per chunk. Wiki content has its [[links]] expanded.
+    start maps a source to the id to resume after.
+    """
+    with get_db() as conn:
+        tables = _existing_tables(conn)
+
+    for source, table, column in CONTENT_SOURCES:
+        if table not in tables:
+            continue
+        last_id = (start or {}).get(source, 0)
+        while True:
+            with get_db() as conn:
+                cursor = conn.cursor()
+                cursor.execute(f"""
+                    SELECT id, {column} FROM {table}
+                    WHERE id > ?
+                    ORDER BY id
+                    LIMIT ?
+                """, (last_id, batch_size))
+                rows = cursor.fetchall()
+            if not rows:
+                break
+            for row in rows:
+                content = row[1] or ''
+                if source in WIKI_SOURCE_TYPES:
+                    content = process_wiki_links(content)
+                yield source, row[0], content
+            last_id = rows[-1][0]
+
+class _StructureParser(HTMLParser):
+    """Tags, attributes (as a sorted set) and text of a fragment, in order."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.tokens = []
+
+    def handle_starttag(self, tag, attrs):
+        self.tokens.append(("start", tag, tuple(sorted(set(attrs), key=str))))
+
+    handle_startendtag = handle_starttag
+
+    def handle_endtag(self, tag):
+        self.tokens.append(("end", tag))
+
+    def handle_data(self, data):
+        if self.tokens and self.tokens[-1][0] == "text":
+            data = self.tokens.pop()[1] + data
+        self.tokens.append(("text", data))
+
+def _html_structure(html: str) -> list:
+    """
+    Comparable form of a fragment: attribute order, self-closing slashes
+    and whitespace-only text between tags do not count as differences.
+    """
+    parser = _StructureParser()
+    parser.feed(html)
+    parser.close()
+    return [token for token in parser.tokens if token[0] != "text" or token[1].strip()]
+
+def compare_renderers(args):
+    """Render the stored corpus through two backends and report differences."""
+    baseline = get_renderer(args.baseline)
+    candidate = get_renderer(args.candidate)
+    sanitizer = get_sanitizer()
+
+    total = 0
+    differing = []
+    timings = {baseline.name: 0.0, candidate.name: 0.0}
+
+    for source, item_id, content in iter_corpus():
+        rendered = []
+        for renderer in (baseline, candidate):
+            start = time.perf_counter()
+            html = sanitizer.clean(renderer.render(content))
+            timings[renderer.name] += time.perf_counter() - start
+            rendered.append(html)
+        total += 1
+        if _html_structure(rendered[0]) != _html_structure(rendered[1]):
+            differing.append((source, item_id, *rendered))
+
+    for source, item_id, expected, actual in differing[:args.show]:
+        print(f"--- {source} {item_id}")
+        print("\n".join(difflib.unified_diff(
+            expected.splitlines(), actual.splitlines(),
+            baseline.name, candidate.name, lineterm=""
+        )))
+
+    print(f"{total} documents, {total - len(differing)} identical, "
+          f"{len(differing)} differ")
+    for name, seconds in timings.items():
+        print(f"{name}: {seconds:.2f}s including sanitizing")
+
+# Known XSS vectors; every sanitizer must reduce these to the same safe markup
+XSS_CORPUS = [
+    '<script>alert(1)</script>',
+    '<SCRIPT SRC=//evil.example/x.js></SCRIPT>',
+    '<img src=x onerror=alert(1)>',
+    '<img src="javascript:alert(1)">',
+    '<img src="data:image/svg+xml;base64,PHN2Zz48L3N2Zz4=">',
+    '<a href="javascript:alert(1)">x</a>',
+    '<a href="JaVaScRiPt:alert(1)">x</a>',
+    '<a href="jav&#x09;ascript:alert(1)">x</a>',
+    '<a href="&#106;&#97;&#118;&#97;&#115;&#99;&#114;&#105;&#112;&#116;:alert(1)">x</a>',
+    '<a href=" javascript:alert(1)">x</a>',
+    '<a href="vbscript:msgbox(1)">x</a>',
+    '<a href="data:text/html,<script>alert(1)</script>">x</a>',
+    '<a href="/wiki/page/Home" onclick="alert(1)">x</a>',
+    '<a href="https://example.org" style="color:red" target="_blank">x</a>',
+    '<svg onload=alert(1)><circle r=1></svg>',
+    '<math><mi xlink:href="javascript:alert(1)">x</mi></math>',
+    '<iframe src="https://evil.example"></iframe>',
+    '<object data="x.swf"></object><embed src="x.swf">',
+    '<form action="https://evil.example"><input name=x></form>',
+    '<style>body{background:url(javascript:alert(1))}</style>',
+    '<div style="background:url(javascript:alert(1))">x</div>',
+    '<p onmouseover="alert(1)">hover</p>',
+    '<code class="language-python" onclick="alert(1)">x</code>',
+    '<table background="javascript:alert(1)"><tr><td>x</td></tr></table>',
+    '<!-- <script>alert(1)</script> -->',
+    '<scr<script>ipt>alert(1)</scr</script>ipt>',
+    '<<script>alert(1)//<</script>',
+    '<img """><script>alert(1)</script>">',
+    '<a href="http://example.org/?q=<script>">x</a>',
+    '<base href="javascript:alert(1)//">',
+    '<meta http-equiv="refresh" content="0;url=javascript:alert(1)">',
+    '<link rel=stylesheet href="https://evil.example/x.css">',
+    '<img src="/forum/api/image/1" alt="ok" title="ok" width=9999>',
+    '<a href="mailto:someone@example.org" title="mail">mail</a>',
+    '<abbr title="x" onclick="alert(1)">x</abbr>',
+    '<noscript><p title="</noscript><img src=x onerror=alert(1)>">',
+    '<textarea><script>alert(1)</script></textarea>',
+]
+
+class _MarkupParser(HTMLParser):
+    """Collects the elements and attributes a sanitized fragment contains."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.elements = []
+
+    def handle_starttag(self, tag, attrs):
+        self.elements.append((tag, tuple(sorted(attrs))))
+
+    handle_startendtag = handle_starttag
+
+def _elements(html: str) -> list:
+    parser = _MarkupParser()
+    parser.feed(html)
+    parser.close()
+    return parser.elements
+
+def _policy_violations(elements: list) -> List[str]:
+    """Elements, attributes or URLs in sanitized output the policy forbids."""
+    violations = []
+    for tag, attrs in elements:
+        if tag not in ALLOWED_TAGS:
+            violations.append(f"tag <{tag}>")
+            continue
+        for name, value in attrs:
+            if name not in ALLOWED_ATTRS.get(tag, ()):
+                violations.append(f"attribute {name} on <{tag}>")
+            elif name in ('href', 'src') and value:
+                # Browsers ignore whitespace and control characters in schemes
+                url = re.sub(r'[\x00-\x20]', '', value).lower()
+                scheme = re.match(r'([a-z][a-z0-9+.-]*):', url)
+                if scheme and scheme.group(1) not in ALLOWED_PROTOCOLS:
+                    violations.append(f"{scheme.group(1)}: URL in <{tag} {name}>")
+    return violations
+
+def check_sanitizers(args):
+    """Check two sanitizer backends against the XSS corpus and stored content."""
+    baseline = get_sanitizer(args.baseline)
+    candidate = get_sanitizer(args.candidate)
+    renderer = get_renderer()
+
+    documents = [("xss", i, payload) for i, payload in enumerate(XSS_CORPUS)]
+    documents += [
+        (source, item_id, renderer.render(content))
+        for source, item_id, content in iter_corpus()
+    ]
+
+    timings = {baseline.name: 0.0, candidate.name: 0.0}
+    violations = []
+    mismatches = []
+    for source, item_id, html in documents:
+        elements = []
+        for sanitizer in (baseline, candidate):
+            start = time.perf_counter()
+            cleaned = sanitizer.clean(html)
+            timings[sanitizer.name] += time.perf_counter() - start
+            elements.append(_elements(cleaned))
+            for problem in _policy_violations(elements[-1]):
+                violations.append((source, item_id, sanitizer.name, problem))
+        # Disallowed tags may be escaped by one backend and dropped by the
+        # other; the markup that survives must be identical
+        if elements[0] != elements[1]:
+            mismatches.append((source, item_id, html))
+
+    for source, item_id, backend, problem in violations:
+        print(f"UNSAFE {source} {item_id} ({backend}): {problem}")
+    for source, item_id, html in mismatches[:args.show]:
+        print(f"--- {source} {item_id}")
+        print(f"input:  {html[:200]!r}")
+        print(f"{baseline.name}: {baseline.clean(html)[:200]!r}")
+        print(f"{candidate.name}: {candidate.clean(html)[:200]!r}")
+
+    print(f"{len(documents)} documents ({len(XSS_CORPUS)} XSS vectors), "
+          f"{len(mismatches)} with different markup, {len(violations)} policy violations")
+    for name, seconds in timings.items():
+        print(f"{name}: {seconds * 1000:.1f} ms")
+
+    # Differences are for review; unsafe output fails the check
+    if violations:
+        sys.exit(1)
+
+def _render_chunk(chunk: Tuple[str, list]) -> Tuple[str, list]:
+    """Pool worker: render (id, markdown) rows of one source type."""
+    source, rows = chunk
+    return source, [
+        (source_id, content_hash(content), render_source(source, content))
+        for source_id, content in rows
+    ]
+
+def _stale_chunks(source: str, table: str, column: str, after: int,
+                  batch_size: int, force: bool) -> Iterator[Tuple[str, list, int]]:
+    """
+    Yield (source, [(id, markdown)], last id) for rows whose stored render
+    is missing or outdated, reading id-ordered chunks in short reads.
+    """
+    version = render_version()
+    while True:
+        with get_db() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"""
+                SELECT t.id, t.{column} AS content, r.content_hash, r.render_version
+                FROM {table} t
+                LEFT JOIN content_renders r
+                    ON r.source_type = ? AND r.source_id = t.id
+                WHERE t.id > ?
+                ORDER BY t.id
+                LIMIT ?
+            """, (source, after, batch_size))
+            rows = cursor.fetchall()
+        if not rows:
+            return
+        after = rows[-1]['id']
+        stale = [
+            (row['id'], row['content'] or '') for row in rows
+            if force or row['render_version'] != version
+            or row['content_hash'] != content_hash(row['content'] or '')
+        ]
+        yield source, stale, after
+
+def _save_renders(source: str, results: list, task: str, last_id: int):
+    """Write one chunk of renders and advance the checkpoint in one short transaction."""
+    version = render_version()
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.executemany("""
+            INSERT INTO content_renders
+                (source_type, source_id, content_hash, render_version, html)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (source_type, source_id) DO UPDATE SET
+                content_hash = excluded.content_hash,
+                render_version = excluded.render_version,
+                html = excluded.html,
+                updated_at = CURRENT_TIMESTAMP
+        """, [(source, source_id, digest, version, html)
+              for source_id, digest, html in results])
+        cursor.execute("""
+            INSERT INTO maintenance_checkpoints (task, source, last_id)
+            VALUES (?, ?, ?)
+            ON CONFLICT (task, source) DO UPDATE SET last_id = excluded.last_id
+        """, (task, source, last_id))
+
+def rerender(args):
+    """Create and rebuild stored renders of posts, edits and wiki content in parallel."""
+    # The checkpoint belongs to one render version; a new version starts over
+    task = f"rerender:{render_version()}"
+    with get_db() as conn:
+        cursor = conn.cursor()
+        create_content_renders(cursor)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS maintenance_checkpoints (
+                task TEXT NOT NULL,
+                source TEXT NOT NULL,
+                last_id INTEGER NOT NULL,
+                PRIMARY KEY (task, source)
+            )
+        """)
+        if args.restart:
+            cursor.execute("DELETE FROM maintenance_checkpoints WHERE task = ?", (task,))
+        cursor.execute("SELECT source, last_id FROM maintenance_checkpoints WHERE task = ?", (task,))
+        checkpoint = {row['source']: row['last_id'] for row in cursor.fetchall()}
+        tables = _existing_tables(conn)
+
+    workers = args.workers or os.cpu_count() or 1
+    rendered = 0
+    started = time.perf_counter()
+
+    with multiprocessing.Pool(workers) as pool:
+        for source, table, column in CONTENT_SOURCES:
+            if table not in tables:
+                continue
+            after = checkpoint.get(source, 0)
+            with get_db() as conn:
+                cursor = conn.cursor()
+                cursor.execute(f"SELECT COUNT(*), COALESCE(MAX(id), 0) FROM {table} WHERE id > ?", (after,))
+                remaining, last = cursor.fetchone()
+            if after:
+                print(f"{source}: resuming after id {after}")
+
+            # Keep a bounded number of chunks in flight and write results
+            # back in id order, so the checkpoint never skips a chunk
+            pending = collections.deque()
+            chunks = _stale_chunks(source, table, column, after, args.batch_size, args.force)
+            done = False
+            while pending or not done:
+                while not done and len(pending) < workers * 2:
+                    chunk = next(chunks, None)
+                    if chunk is None:
+                        done = True
+                        break
+                    _, rows, last_id = chunk
+                    pending.append((pool.apply_async(_render_chunk, ((source, rows),)), last_id))
+                if not pending:
+                    break
+
+                result, last_id = pending.popleft()
+                _, results = result.get()
+                _save_renders(source, results, task, last_id)
+                rendered += len(results)
+
+                elapsed = time.perf_counter() - started
+                print(f"\r{source}: up to id {last_id}/{last} "
+                      f"({rendered} rendered, {rendered / elapsed:.0f}/s)", end="", flush=True)
+            if remaining:
+                print()
+
+    # Finished: the next run scans everything again, skipping current renders
+    with get_db() as conn:
+        conn.execute("DELETE FROM maintenance_checkpoints WHERE task = ?", (task,))
+
+    print(f"Rendered {rendered} documents in {time.perf_counter() - started:.1f}s")
+
+def username_pool(args):
+    """Report free usernames; exit 1 when the namespace is running out."""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        if args.build:
+            started = time.perf_counter()
+            create_username_pool(cursor)
+            print(f"Built username pool in {time.perf_counter() - started:.1f}s")
+        free, total = pool_status(cursor)
+
+    print(f"{free} of {total} usernames free ({free / total:.1%}), {total - free} taken")
+    if free < total * Config.USERNAME_POOL_RESERVE:
+        print(f"Fewer than {Config.USERNAME_POOL_RESERVE:.0%} of names are left; plan the "
+              f"move to {USERNAME_SYLLABLES + 1}-syllable usernames")
+        sys.exit(1)
+
+def migrate_tokens(args):
+    """Move users from one tokens row per token to a packed user_tokens row."""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        create_user_tokens(cursor)
+        # Logins of users not yet moved, and the deletes below, probe it
+        create_legacy_token_index(cursor)
+
+    migrated = 0
+    truncated = []
+    while True:
+        with get_db() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT DISTINCT user_id FROM tokens
+                ORDER BY user_id
+                LIMIT ?
+            """, (args.batch_size,))
+            user_ids = [row['user_id'] for row in cursor.fetchall()]
+            if not user_ids:
+                break
+
+            placeholders = ",".join("?" * len(user_ids))
+            cursor.execute(f"""
+                SELECT user_id, token_hash, one_time FROM tokens
+                WHERE user_id IN ({placeholders})
+                ORDER BY id
+            """, user_ids)
+            hashes = {user_id: ([], []) for user_id in user_ids}
+            for row in cursor.fetchall():
+                hashes[row['user_id']][1 if row['one_time'] else 0].append(row['token_hash'])
+
+            # Spent one-time tokens were deleted, so every remaining one is unused.
+            # A row holds MAX_ONE_TIME_TOKENS; any beyond that are dropped
+            truncated += [user_id for user_id, (_, one_time) in hashes.items()
+                          if len(one_time) > MAX_ONE_TIME_TOKENS]
+            cursor.executemany("""
+                INSERT INTO user_tokens (user_id, permanent, one_time)
+                VALUES (?, ?, ?)
+                ON CONFLICT (user_id) DO NOTHING
+            """, [(user_id, pack_digests(permanent), pack_digests(one_time[:MAX_ONE_TIME_TOKENS]))
+                  for user_id, (permanent, one_time) in hashes.items()])
+            cursor.execute(f"DELETE FROM tokens WHERE user_id IN ({placeholders})", user_ids)
+            migrated += len(user_ids)
+        print(f"Migrated {migrated} users")
+
+    if truncated:
+        print(f"Warning: {len(truncated)} users had more than {MAX_ONE_TIME_TOKENS} one-time "
+              f"tokens; the extra ones no longer log in. User ids: "
+              + ", ".join(map(str, truncated)))
+    reclaimed, vacuumed = reclaim_space()
+    print(f"Done: {migrated} users migrated, {reclaimed // 1024} KiB reclaimed"
+          + ("" if vacuumed else " (needs a full VACUUM to shrink the file)"))
+
+def private_threads(args):
+    """Add threads.is_private and its triggers to an existing database, then backfill it."""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT name FROM pragma_table_info('threads')")
+        if 'is_private' not in {row['name'] for row in cursor.fetchall()}:
+            cursor.execute("ALTER TABLE threads ADD COLUMN is_private INTEGER NOT NULL DEFAULT 0")
+        create_role_tables(cursor)
+        create_private_thread_index(cursor)
+
+    # The triggers keep new changes in step; earlier ones are set by id range
+    marked, last_id = 0, 0
+    while True:
+        with get_db() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT MAX(id) FROM (SELECT id FROM threads WHERE id > ? ORDER BY id LIMIT ?)
+            """, (last_id, args.batch_size))
+            batch_end = cursor.fetchone()[0]
+            if batch_end is None:
+                break
+            cursor.execute("""
+                UPDATE threads
+                SET is_private = EXISTS (SELECT 1 FROM thread_users WHERE thread_id = threads.id)
+                              OR EXISTS (SELECT 1 FROM thread_roles WHERE thread_id = threads.id)
+                WHERE id > ? AND id <= ?
+            """, (last_id, batch_end))
+            cursor.execute("""
+                SELECT COUNT(*) FROM threads WHERE id > ? AND id <= ? AND is_private = 1
+            """, (last_id, batch_end))
+            marked += cursor.fetchone()[0]
+            last_id = batch_end
+
+    print(f"Done: {marked} private threads marked")
+
+def thread_roles(args):
+    """Replace per-moderator rows of report threads and restricted posts by a moderators role entry."""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        create_role_tables(cursor)
+        create_cache_tag_triggers(cursor)
+        # Superseded by the per-table triggers, which also count thread_roles
+        cursor.execute("DROP TRIGGER IF EXISTS threads_private_insert")
+        cursor.execute("DROP TRIGGER IF EXISTS threads_private_delete")
+        create_private_thread_index(cursor)
+
+    # Report threads were opened to every moderator of the time; restricted
+    # posts always listed every moderator next to the report's users
+    sources = [
+        ("thread_users", "thread_roles", "thread_id", """
+            SELECT t.id FROM threads t
+            JOIN groups g ON g.id = t.group_id AND g.grouptext = 'Moderation'
+            JOIN group_categories gc ON gc.id = t.category_id AND gc.category = 'Reported Post'
+            WHERE t.id > ? ORDER BY t.id LIMIT ?
+        """),
+        ("post_users", "post_roles", "post_id", """
+            SELECT DISTINCT post_id FROM post_users
+            WHERE post_id > ? ORDER BY post_id LIMIT ?
+        """),
+    ]
+    for users_table, roles_table, key, select in sources:
+        converted, removed, last_id = 0, 0, 0
+        while True:
+            with get_db() as conn:
+                cursor = conn.cursor()
+                cursor.execute(select, (last_id, args.batch_size))
+                ids = [row[0] for row in cursor.fetchall()]
+                if not ids:
+                    break
+                placeholders = ",".join("?" * len(ids))
+                cursor.executemany(f"""
+                    INSERT INTO {roles_table} ({key}, role) VALUES (?, ?)
+                    ON CONFLICT ({key}, role) DO NOTHING
+                """, [(row_id, MODERATORS_ROLE) for row_id in ids])
+                cursor.execute(f"""
+                    DELETE FROM {users_table}
+                    WHERE {key} IN ({placeholders})
+                      AND user_id IN (SELECT user_id FROM moderators)
+                """, ids)
+                removed += cursor.rowcount
+                converted += len(ids)
+                last_id = ids[-1]
+        print(f"{roles_table}: {converted} entries added, {removed} {users_table} rows removed")
+
+def taxonomy_triggers(args):
+    """Install the triggers that invalidate the cached groups and categories."""
+    with get_db() as conn:
+        create_taxonomy_triggers(conn.cursor())
+    print("Taxonomy triggers installed")
+
+def group_filters(args):
+    """Add the users.filter_groups bitmask and count with their triggers, then backfill them."""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT name FROM pragma_table_info('users')")
+        columns = {row['name'] for row in cursor.fetchall()}
+        for column in ("filter_groups", "filter_group_count"):
+            if column not in columns:
+                cursor.execute(f"ALTER TABLE users ADD COLUMN {column} INTEGER NOT NULL DEFAULT 0")
+        create_filter_group_triggers(cursor)
+
+    # Bits are distinct, so their sum is their union
+    updated, last_id = 0, 0
+    while True:
+        with get_db() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT MAX(id) FROM (SELECT id FROM users WHERE id > ? ORDER BY id LIMIT ?)
+            """, (last_id, args.batch_size))
+            batch_end = cursor.fetchone()[0]
+            if batch_end is None:
+                break
+            cursor.execute("""
+                UPDATE users SET
+                    filter_groups = (
+                        SELECT COALESCE(SUM(1 << group_id), 0) FROM user_groups
+                        WHERE user_id = users.id AND filter_on = 1 AND group_id BETWEEN 0 AND 63
+                    ),
+                    filter_group_count = (
+                        SELECT COUNT(*) FROM user_groups
+                        WHERE user_id = users.id AND filter_on = 1
+                    )
+                WHERE id > ? AND id <= ?
+            """, (last_id, batch_end))
+            updated += cursor.rowcount
+            last_id = batch_end
+
+    print(f"Done: group filters of {updated} users backfilled")
+
+def run_jobs(args):
+    """Create the moderation_jobs table if needed and run every queued bulk moderation job."""
+    with get_db() as conn:
+        create_jobs_table(conn.cursor())
+    count = run_pending()
+    print(f"Done: {count} moderation jobs run")
+
+COMMANDS = {
+    "image-uploads": image_uploads,
+    "gc-images": gc_images,
+    "cache-tags": cache_tags,
+    "thread-posts": thread_posts,
+    "post-events": post_events,
+    "compare-renderers": compare_renderers,
+    "check-sanitizers": check_sanitizers,
+    "rerender": rerender,
+    "username-pool": username_pool,
+    "migrate-tokens": migrate_tokens,
+    "private-threads": private_threads,
+    "thread-roles": thread_roles,
+    "taxonomy-triggers": taxonomy_triggers,
+    "group-filters": group_filters,
+    "run-jobs": run_jobs,
+}
+
+def main():
+    parser = argparse.ArgumentParser(description="Website V3 maintenance")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    uploads = subparsers.add_parser("image-uploads", help=image_uploads.__doc__)
+    uploads.add_argument("--batch-size", type=int, default=200,
+                         help="Images copied per transaction")
+
+    gc = subparsers.add_parser("gc-images", help=gc_images.__doc__)
+    gc.add_argument("--dry-run", action="store_true",
+                    help="Report orphaned images without deleting them")
+
+    subparsers.add_parser("cache-tags", help=cache_tags.__doc__)
+    subparsers.add_parser("thread-posts", help=thread_posts.__doc__)
+    subparsers.add_parser("post-events", help=post_events.__doc__)
+
+    compare = subparsers.add_parser("compare-renderers", help=compare_renderers.__doc__)
+    compare.add_argument("--baseline", default=PythonMarkdownRenderer.name)
+    compare.add_argument("--candidate", default=MarkdownItRenderer.name)
+    compare.add_argument("--show", type=int, default=10,
+                         help="Number of differing documents to print")
+
+    check = subparsers.add_parser("check-sanitizers", help=check_sanitizers.__doc__)
+    check.add_argument("--baseline", default=BleachSanitizer.name)
+    check.add_argument("--candidate", default=Nh3Sanitizer.name)
+    check.add_argument("--show", type=int, default=10,
+                       help="Number of mismatching documents to print")
+
+    render = subparsers.add_parser("rerender", help=rerender.__doc__)
+    render.add_argument("--workers", type=int, default=None,
+                        help="Render processes (default: one per CPU)")
+    render.add_argument("--batch-size", type=int, default=200,
+                        help="Rows per chunk and per write transaction")
+    render.add_argument("--force", action="store_true",
+                        help="Re-render rows whose stored render is current")
+    render.add_argument("--restart", action="store_true",
+                        help="Ignore the checkpoint of an interrupted run")
+
+    pool = subparsers.add_parser("username-pool", help=username_pool.__doc__)
+    pool.add_argument("--build", action="store_true",
+                      help="(Re)build the pool from the names not taken by existing users")
+
+    tokens = subparsers.add_parser("migrate-tokens", help=migrate_tokens.__doc__)
+    tokens.add_argument("--batch-size", type=int, default=500,
+                        help="Users moved per transaction")
+
+    private = subparsers.add_parser("private-threads", help=private_threads.__doc__)
+    private.add_argument("--batch-size", type=int, default=1000,
+                         help="Threads updated per transaction")
+
+    roles = subparsers.add_parser("thread-roles", help=thread_roles.__doc__)
+    roles.add_argument("--batch-size", type=int, default=500,
+                       help="Threads or posts converted per transaction")
+
+    subparsers.add_parser("taxonomy-triggers", help=taxonomy_triggers.__doc__)
+
+    filters = subparsers.add_parser("group-filters", help=group_filters.__doc__)
+    filters.add_argument("--batch-size", type=int, default=1000,
+                         help="Users updated per transaction")
+
+    subparsers.add_parser("run-jobs", help=run_jobs.__doc__)
+
+    args = parser.parse_args()
+    COMMANDS[args.command](args)
+
+if __name__ == "__main__":
+    main()
@@ -61,7 +61,8 @@ class PostEdit:
 @dataclass
 class Image:
     id: int
-    post_id: int
+    post_id: Optional[int]  # None until the upload is attached to a post
+    created_by: Optional[int]
     filename: str
     content_type: str
     data: bytes
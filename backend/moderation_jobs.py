@@ -0,0 +1,199 @@
+"""
+Moderation Jobs Module
+======================
+
+Bulk moderation (blocking or restoring many users, restricting every post
+of a user in a thread) run as background jobs.
+
+A job is a row in moderation_jobs holding its kind, parameters and the
+list of user or post IDs to process. Workers run one runner thread that
+claims queued jobs and processes them Config.MODERATION_JOB_CHUNK items per
+transaction, pausing between chunks, so a bulk action never holds the
+write lock for long and requests keep writing while it runs. Each chunk
+records the job's position, so progress is visible on the admin pages and
+a job whose worker died is resumed by another one once its heartbeat is
+older than Config.MODERATION_JOB_LEASE.
+
+Without a web worker running, `python -m backend.maintenance run-jobs`
+processes the queue (and creates the table on databases that predate it).
+
+Usage:
+    job_id = submit_job('block', user_ids, created_by)
+"""
+
+import json
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+from backend.config import Config
+from backend.database import get_db
+from backend.permissions import ADMIN_USER_ID, MODERATORS_ROLE, set_group_filters_for
+
+def create_jobs_table(cursor):
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS moderation_jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL,
+        params TEXT NOT NULL DEFAULT '{}',
+        items TEXT NOT NULL,                  -- JSON array of user or post ids
+        total INTEGER NOT NULL,
+        position INTEGER NOT NULL DEFAULT 0,  -- Items processed so far
+        status TEXT NOT NULL DEFAULT 'queued'
+            CHECK (status IN ('queued', 'running', 'done', 'failed')),
+        error TEXT,
+        created_by INTEGER NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        heartbeat TIMESTAMP,
+        finished_at TIMESTAMP,
+        FOREIGN KEY (created_by) REFERENCES users(id)
+    );
+    """)
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_moderation_jobs_status ON moderation_jobs(status, id);
+    """)
+
+def _regular_users(cursor, user_ids: List[int]) -> List[int]:
+    """The users among user_ids that may be blocked: not the admin, not moderators."""
+    cursor.execute("""
+        SELECT id FROM users
+        WHERE id IN (SELECT value FROM json_each(?)) AND id != ?
+          AND id NOT IN (SELECT user_id FROM moderators)
+    """, (json.dumps(user_ids), ADMIN_USER_ID))
+    return [row[0] for row in cursor.fetchall()]
+
+def _block(cursor, params: dict, user_ids: List[int]):
+    set_group_filters_for(cursor, _regular_users(cursor, user_ids), [params['group_id']])
+
+def _restore(cursor, params: dict, user_ids: List[int]):
+    set_group_filters_for(cursor, user_ids, None)
+
+def _restrict_posts(cursor, params: dict, post_ids: List[int]):
+    """Restrict posts to moderators and, with a report thread, its users."""
+    posts = json.dumps(post_ids)
+    cursor.execute("""
+        INSERT INTO post_roles (post_id, role)
+        SELECT value, ? FROM json_each(?) WHERE true
+        ON CONFLICT (post_id, role) DO NOTHING
+    """, (MODERATORS_ROLE, posts))
+    if params.get('report_thread_id'):
+        cursor.execute("""
+            INSERT INTO post_users (post_id, user_id)
+            SELECT p.value, tu.user_id
+            FROM json_each(?) p CROSS JOIN thread_users tu
+            WHERE tu.thread_id = ?
+            ON CONFLICT (post_id, user_id) DO NOTHING
+        """, (posts, params['report_thread_id']))
+
+JOB_KINDS: Dict[str, Callable[[object, dict, List[int]], None]] = {
+    'block': _block,
+    'restore': _restore,
+    'restrict_posts': _restrict_posts,
+}
+
+def submit_job(kind: str, items: List[int], created_by: int,
+               params: Optional[dict] = None) -> int:
+    """Queue (and commit) a job over items, then wake this worker's runner."""
+    if kind not in JOB_KINDS:
+        raise ValueError(f"Unknown job kind: {kind}")
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            INSERT INTO moderation_jobs (kind, params, items, total, created_by)
+            VALUES (?, ?, ?, ?, ?)
+        """, (kind, json.dumps(params or {}), json.dumps(items), len(items), created_by))
+        job_id = cursor.lastrowid
+    ensure_runner()
+    return job_id
+
+def recent_jobs(cursor, limit: int = 10) -> List[dict]:
+    """The latest jobs with their progress, newest first."""
+    cursor.execute("""
+        SELECT j.id, j.kind, j.status, j.position, j.total, j.error,
+               j.created_at, j.finished_at, u.username as created_by
+        FROM moderation_jobs j
+        JOIN users u ON u.id = j.created_by
+        ORDER BY j.id DESC
+        LIMIT ?
+    """, (limit,))
+    return [dict(row) for row in cursor.fetchall()]
+
+def claim_job() -> Optional[dict]:
+    """Take the oldest queued job, or a running one whose worker went silent."""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            UPDATE moderation_jobs
+            SET status = 'running', heartbeat = CURRENT_TIMESTAMP
+            WHERE id = (
+                SELECT id FROM moderation_jobs
+                WHERE status = 'queued'
+                   OR (status = 'running' AND heartbeat < datetime('now', ?))
+                ORDER BY id
+                LIMIT 1
+            )
+            RETURNING id, kind, params, items, position
+        """, (f"-{Config.MODERATION_JOB_LEASE} seconds",))
+        row = cursor.fetchone()
+    return dict(row) if row else None
+
+def run_job(job: dict):
+    """Process a claimed job from its position onwards, one chunk per transaction."""
+    handler = JOB_KINDS[job['kind']]
+    params = json.loads(job['params'])
+    items = json.loads(job['items'])
+    position = job['position']
+    try:
+        while position < len(items):
+            chunk = items[position:position + Config.MODERATION_JOB_CHUNK]
+            with get_db() as conn:
+                with conn:  # A failing chunk is rolled back as a whole
+                    cursor = conn.cursor()
+                    handler(cursor, params, chunk)
+                    position += len(chunk)
+                    cursor.execute("""
+                        UPDATE moderation_jobs
+                        SET position = ?, heartbeat = CURRENT_TIMESTAMP
+                        WHERE id = ?
+                    """, (position, job['id']))
+            time.sleep(Config.MODERATION_JOB_PAUSE)
+        status, error = 'done', None
+    except Exception as e:
+        status, error = 'failed', str(e)
+    with get_db() as conn:
+        conn.execute("""
+            UPDATE moderation_jobs
+            SET status = ?, error = ?, finished_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        """, (status, error, job['id']))
+
+def run_pending() -> int:
+    """Run jobs until the queue is empty; returns how many ran."""
+    count = 0
+    while True:
+        job = claim_job()
+        if job is None:
+            return count
+        run_job(job)
+        count += 1
+
+_runner: Optional[threading.Thread] = None
+_runner_lock = threading.Lock()
+_wake = threading.Event()
+
+def _run_forever():
+    while True:
+        try:
+            run_pending()
+        except Exception:
+            pass  # Keep the runner alive through transient database errors
+        _wake.wait(Config.MODERATION_JOB_POLL)
+        _wake.clear()
+
+def ensure_runner():
+    """Start this worker's runner thread if needed and wake it."""
+    global _runner
+    with _runner_lock:
+        if _runner is None:
+            _runner = threading.Thread(target=_run_forever, name="moderation-jobs", daemon=True)
+            _runner.start()
+    _wake.set()
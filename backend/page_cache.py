@@ -0,0 +1,436 @@
+"""
+Page Cache Module
+=================
+
+Full-response cache for anonymous GET requests.
+
+Anonymous readers only see public content, so a page looks the same for all
+of them and can be served from memory without running queries, rendering or
+templates. Each cached page records the versions of the cache tags it was
+built from (e.g. 'thread:12', 'threads'). Tag versions live in the
+cache_tags table and are bumped by triggers whenever posts, threads or
+thread/post ACLs change, so every worker sees an invalidation immediately
+and a hit costs one indexed lookup.
+
+Memory use is bounded by Config.PAGE_CACHE_BYTES with LRU eviction. With
+Config.PAGE_CACHE_PATH set, pages are also written to a SQLite file so a
+warm cache survives restarts; entries from disk are validated the same way.
+
+Concurrent misses for the same page are coalesced: one request renders
+while the others wait and then serve its result, within a worker and,
+with a disk store, across workers.
+
+Usage:
+    @forum_blueprint.route("/thread/<int:thread_id>")
+    @cached_page(lambda thread_id: [thread_tag(thread_id)])
+    def view_thread(thread_id): ...
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from functools import wraps
+from typing import Callable, Dict, List, Optional, Tuple
+from flask import Response, abort, current_app, g, make_response, request, session
+from backend.config import Config
+from backend.database import get_db
+
+# Lock files shared by all cache keys for cross-worker coalescing
+LOCK_STRIPES = 256
+
+THREADS_TAG = 'threads'
+TAXONOMY_TAG = 'taxonomy'
+
+def thread_tag(thread_id: int) -> str:
+    return f'thread:{thread_id}'
+
+def user_tag(user_id: int) -> str:
+    return f'user:{user_id}'
+
+def get_tag_state(tags: List[str]) -> Tuple[Dict[str, int], Optional[datetime]]:
+    """
+    Current version of each tag (0 if never bumped) and the time of the
+    latest bump. Read once per request; later calls reuse the result.
+    """
+    key = tuple(tags)
+    memo = g.setdefault('cache_tag_state', {})
+    if key not in memo:
+        with get_db() as conn:
+            cursor = conn.cursor()
+            placeholders = ",".join("?" for _ in tags)
+            cursor.execute(f"""
+                SELECT tag, version, updated_at FROM cache_tags
+                WHERE tag IN ({placeholders})
+            """, tags)
+            rows = cursor.fetchall()
+        versions = {row['tag']: row['version'] for row in rows}
+        modified = max((row['updated_at'] for row in rows), default=None)
+        memo[key] = (
+            {tag: versions.get(tag, 0) for tag in tags},
+            datetime.strptime(modified, '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc)
+            if modified else None
+        )
+    return memo[key]
+
+def get_tag_versions(tags: List[str]) -> Dict[str, int]:
+    """Current version of each tag; tags never bumped are version 0."""
+    return get_tag_state(tags)[0]
+
+# (body, mimetype, tag versions)
+Entry = Tuple[bytes, str, Dict[str, int]]
+
+class DiskStore:
+    """Pages persisted in a separate SQLite file, oldest evicted first."""
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.writes = 0
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS pages (
+                    key TEXT PRIMARY KEY,
+                    body BLOB NOT NULL,
+                    mimetype TEXT NOT NULL,
+                    tags TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    stored_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_pages_stored ON pages(stored_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=1)
+
+    def get(self, key: str) -> Optional[Entry]:
+        try:
+            with self._connect() as conn:
+                row = conn.execute(
+                    "SELECT body, mimetype, tags FROM pages WHERE key = ?", (key,)
+                ).fetchone()
+        except sqlite3.Error:
+            return None
+        if not row:
+            return None
+        return row[0], row[1], json.loads(row[2])
+
+    def put(self, key: str, entry: Entry):
+        body, mimetype, tags = entry
+        try:
+            with self._connect() as conn:
+                conn.execute("""
+                    INSERT OR REPLACE INTO pages (key, body, mimetype, tags, size)
+                    VALUES (?, ?, ?, ?, ?)
+                """, (key, body, mimetype, json.dumps(tags), len(body)))
+                self.writes += 1
+                if self.writes % 100 == 0:
+                    self._evict(conn)
+        except sqlite3.Error:
+            pass  # The disk copy is best effort; memory still has the page
+
+    def _evict(self, conn: sqlite3.Connection):
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Delete the oldest pages until a tenth of the budget is free
+        excess = total - self.max_bytes * 9 // 10
+        conn.execute("""
+            DELETE FROM pages WHERE key IN (
+                SELECT key FROM (
+                    SELECT key, size, SUM(size) OVER (ORDER BY stored_at, key) AS running
+                    FROM pages
+                ) WHERE running - size < ?
+            )
+        """, (excess,))
+
+class PageCache:
+    """LRU of rendered pages bounded by total body size."""
+
+    def __init__(self, max_bytes: int, disk: Optional[DiskStore] = None):
+        self.max_bytes = max_bytes
+        self.disk = disk
+        self.entries: 'OrderedDict[str, Entry]' = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, key: str, versions: Dict[str, int]) -> Optional[Entry]:
+        """Return the page for key if it was built from these tag versions."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry:
+                self.entries.move_to_end(key)
+        if entry is None and self.disk:
+            entry = self.disk.get(key)
+            if entry and entry[2] == versions:
+                self._store(key, entry)
+        if entry is None or entry[2] != versions:
+            return None
+        return entry
+
+    def put(self, key: str, entry: Entry):
+        if len(entry[0]) > self.max_bytes // 10:
+            return  # Keep one huge page from flushing everything else
+        self._store(key, entry)
+        if self.disk:
+            self.disk.put(key, entry)
+
+    def _store(self, key: str, entry: Entry):
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old:
+                self.size -= len(old[0])
+            self.entries[key] = entry
+            self.size += len(entry[0])
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted[0])
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+_cache: Optional[PageCache] = None
+_cache_lock = threading.Lock()
+
+def get_page_cache() -> PageCache:
+    """The process-wide page cache, created on first use."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            disk = None
+            if Config.PAGE_CACHE_PATH:
+                disk = DiskStore(Config.PAGE_CACHE_PATH, Config.PAGE_CACHE_DISK_BYTES)
+            _cache = PageCache(Config.PAGE_CACHE_BYTES, disk)
+        return _cache
+
+# Renders in progress in this worker: cache key -> set when done
+_flights: Dict[str, threading.Event] = {}
+_flights_lock = threading.Lock()
+
+def _try_flock(lock_file) -> bool:
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except BlockingIOError:
+        return False
+
+def _lock_owner(lock_file) -> bytes:
+    """The cache key the holder of a stripe lock is rendering."""
+    lock_file.seek(0)
+    return lock_file.read()
+
+@contextmanager
+def _worker_lock(key: str):
+    """
+    Cross-worker exclusion for one cache key, via flock on one of a fixed
+    set of lock files next to the disk store. Without a disk store other
+    workers could not see the result, so there is nothing to coalesce.
+
+    The holder writes its key into the lock file. A request finding the
+    stripe locked waits (up to PAGE_CACHE_WAIT) only while that key is its
+    own; an unrelated key sharing the stripe renders straight away.
+    """
+    if not Config.PAGE_CACHE_PATH:
+        yield
+        return
+
+    lock_dir = Config.PAGE_CACHE_PATH + '.locks'
+    os.makedirs(lock_dir, exist_ok=True)
+    stripe = int(hashlib.sha1(key.encode()).hexdigest(), 16) % LOCK_STRIPES
+    owner = key.encode()
+    # Opened without truncating: the file names the current holder's key
+    fd = os.open(os.path.join(lock_dir, f'{stripe}.lock'), os.O_RDWR | os.O_CREAT, 0o644)
+    with os.fdopen(fd, 'rb+') as lock_file:
+        locked = _try_flock(lock_file)
+        deadline = time.monotonic() + Config.PAGE_CACHE_WAIT
+        while not locked and time.monotonic() < deadline and _lock_owner(lock_file) == owner:
+            time.sleep(0.01)
+            locked = _try_flock(lock_file)
+        if locked:
+            lock_file.seek(0)
+            lock_file.truncate()
+            lock_file.write(owner)
+            lock_file.flush()
+        try:
+            # Unlocked (other key, or timeout): render anyway rather than wait
+            yield
+        finally:
+            if locked:
+                lock_file.truncate(0)
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+@contextmanager
+def single_flight(key: str):
+    """
+    Let one request per key render while the others wait, within this
+    worker (threads) and across workers (flock). Callers re-check the
+    cache after entering; a waiter whose leader failed renders itself.
+    """
+    with _flights_lock:
+        event = _flights.get(key)
+        leader = event is None
+        if leader:
+            event = _flights[key] = threading.Event()
+
+    if not leader:
+        event.wait(Config.PAGE_CACHE_WAIT)
+        yield
+        return
+
+    try:
+        with _worker_lock(key):
+            yield
+    finally:
+        with _flights_lock:
+            _flights.pop(key, None)
+        event.set()
+
+def _cached_response(entry: Entry, status: str) -> Response:
+    response = Response(entry[0], mimetype=entry[1])
+    response.headers['X-Page-Cache'] = status
+    return response
+
+def is_cacheable_request() -> bool:
+    """Anonymous GETs without pending flash messages."""
+    return (
+        Config.PAGE_CACHE_BYTES > 0
+        and request.method == 'GET'
+        and not session.get('user_id')
+        and '_flashes' not in session
+    )
+
+def cached_page(tags: Callable[..., List[str]],
+                vary: Optional[Callable[[], tuple]] = None,
+                cacheable: Optional[Callable[[], bool]] = None):
+    """
+    Cache decorator for anonymous page views.
+
+    tags: given the view's arguments, the cache tags the page depends on
+    vary: extra request state (besides path and query) the page depends on
+    cacheable: return False to bypass the cache for this request
+    """
+    def decorator(f):
+        @wraps(f)
+        def wrapped(*args, **kwargs):
+            if not is_cacheable_request() or (cacheable and not cacheable()):
+                return f(*args, **kwargs)
+
+            key = request.full_path
+            if vary:
+                key += '|' + repr(vary())
+
+            # Versions are read before rendering, so a change made while
+            # the page is built invalidates it on the next request
+            versions = get_tag_versions(tags(**kwargs))
+            cache = get_page_cache()
+            entry = cache.get(key, versions)
+            if entry:
+                return _cached_response(entry, 'hit')
+
+            # Concurrent misses for the same page wait for one render
+            with single_flight(key):
+                entry = cache.get(key, versions)
+                if entry:
+                    return _cached_response(entry, 'coalesced')
+
+                response = make_response(f(*args, **kwargs))
+                # A view that touched the session or rendered a CSRF token
+                # produced per-visitor output
+                if (response.status_code == 200 and not session.modified
+                        and 'csrf_token' not in g):
+                    cache.put(key, (response.get_data(), response.mimetype, versions))
+                    response.headers['X-Page-Cache'] = 'miss'
+                return response
+        return wrapped
+    return decorator
+
+def _csrf_period() -> Optional[datetime]:
+    """
+    Start of the current CSRF period. Pages embed Flask-WTF tokens that
+    expire WTF_CSRF_TIME_LIMIT seconds after rendering, so a page may only
+    be revalidated within the half of that limit it was rendered in; the
+    remaining half is left for submitting its forms. None when tokens do
+    not expire.
+    """
+    limit = current_app.config.get('WTF_CSRF_TIME_LIMIT', 3600)
+    if not current_app.config.get('WTF_CSRF_ENABLED', True) or not limit:
+        return None
+    period = max(1, limit // 2)
+    return datetime.fromtimestamp(int(time.time()) // period * period, timezone.utc)
+
+def conditional_get(tags: Callable[..., List[str]],
+                    vary: Optional[Callable[[], tuple]] = None,
+                    cacheable: Optional[Callable[[], bool]] = None,
+                    authorize: Optional[Callable[..., bool]] = None):
+    """
+    ETag / Last-Modified decorator for page views.
+
+    The weak ETag combines the versions of the page's cache tags with the
+    viewer: anonymous, or a user whose own tag is bumped when their
+    moderator status or group filters change. A matching If-None-Match
+    (or, without one, If-Modified-Since) is answered with 304 before the
+    view runs, at the cost of one cache_tags lookup. Both also change with
+    each CSRF period (see _csrf_period), so a revalidated page never
+    carries an expired CSRF token. tags, vary and cacheable work as in
+    cached_page.
+
+    authorize: given the view's arguments, whether the viewer may see the
+    page. Checked (403 otherwise) before a conditional request is answered,
+    so a 304 cannot reveal whether a page the viewer may not see changed;
+    unconditional requests leave the check to the view.
+    """
+    def decorator(f):
+        @wraps(f)
+        def wrapped(*args, **kwargs):
+            if (request.method != 'GET' or '_flashes' in session
+                    or (cacheable and not cacheable())):
+                return f(*args, **kwargs)
+
+            conditional = request.if_none_match or request.if_modified_since
+            if conditional and authorize and not authorize(**kwargs):
+                abort(403)
+
+            user_id = session.get('user_id')
+            page_tags = tags(**kwargs)
+            if user_id:
+                page_tags = page_tags + [user_tag(user_id)]
+            versions, modified = get_tag_state(page_tags)
+            csrf_period = _csrf_period()
+            if csrf_period and (modified is None or modified < csrf_period):
+                modified = csrf_period
+
+            fingerprint = repr((sorted(versions.items()), user_id, csrf_period,
+                                vary() if vary else None))
+            etag = hashlib.sha1(fingerprint.encode()).hexdigest()[:20]
+
+            if request.if_none_match:
+                not_modified = request.if_none_match.contains_weak(etag)
+            else:
+                not_modified = bool(
+                    modified and request.if_modified_since
+                    and modified <= request.if_modified_since
+                )
+
+            if not_modified:
+                response = Response(status=304)
+            else:
+                response = make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+
+            response.set_etag(etag, weak=True)
+            if modified:
+                response.last_modified = modified
+            # Always revalidate; personalised pages stay out of shared caches
+            response.headers['Cache-Control'] = 'private, no-cache' if user_id else 'no-cache'
+            return response
+        return wrapped
+    return decorator
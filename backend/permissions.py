@@ -0,0 +1,240 @@
+"""
+Permissions Module
+==================
+
+Per-user permission claims kept in the (signed) session cookie.
+
+Moderator status and the groups a user filters on used to be read from
+SQLite by every request that needed them. They are now summarised once
+into session['perms'], stamped with the version of the user's 'user:<id>'
+cache tag. Triggers bump that tag whenever moderators or user_groups change
+for the user (see init_db.CACHE_TAG_TRIGGERS), so a stale summary is
+detected by comparing one version number.
+
+Within Config.PERMISSION_CLAIMS_TTL seconds of the last check, read routes
+trust the claims without any query; after that a single cache_tags lookup
+either confirms them or triggers a rebuild, so a revoked permission stops
+showing within the TTL. Write routes pass fresh=True and always confirm the
+version first, which still replaces several queries by one primary key probe.
+
+PermissionService answers visibility for many threads or posts at once and
+supplies the same rules as SQL conditions for listings.
+
+Usage:
+    from backend.permissions import PermissionService, is_moderator
+
+    if is_moderator():
+        ...
+    visible = PermissionService(cursor).visible_posts(post_ids)
+"""
+
+import json
+import time
+from typing import Iterable, List, Optional, Set, Tuple
+from flask import g, session
+from backend.config import Config
+from backend.database import get_db
+from backend.page_cache import get_tag_versions, user_tag
+from backend.taxonomy import get_taxonomy
+
+ADMIN_USER_ID = 1
+
+# ACL role held by every moderator (thread_roles, post_roles). Checked against
+# the moderator claim rather than expanded into per-moderator rows, so new
+# moderators see existing report threads and the tables stay one row per entry
+MODERATORS_ROLE = 'moderators'
+
+# users.filter_groups holds one bit per group id below this
+FILTER_MASK_BITS = 64
+
+def mask_groups(mask: int) -> List[int]:
+    """Group ids set in a filter_groups bitmask."""
+    return [group_id for group_id in range(FILTER_MASK_BITS) if mask >> group_id & 1]
+
+def set_group_filters(cursor, user_id: int, group_ids: Optional[Iterable[int]]) -> int:
+    """
+    Make user_id filter on exactly group_ids (every group when None), in
+    one statement that only writes rows whose filter_on differs. Returns
+    the number of rows written.
+    """
+    return set_group_filters_for(cursor, [user_id], group_ids)
+
+def set_group_filters_for(cursor, user_ids: Iterable[int], group_ids: Optional[Iterable[int]]) -> int:
+    """set_group_filters for many users at once, still one statement."""
+    cursor.execute("""
+        INSERT INTO user_groups (user_id, group_id, filter_on)
+        SELECT u.value, g.id, ? IS NULL OR g.id IN (SELECT value FROM json_each(?))
+        FROM json_each(?) u CROSS JOIN groups g WHERE true
+        ON CONFLICT (user_id, group_id) DO UPDATE SET
+            filter_on = excluded.filter_on, updated_at = CURRENT_TIMESTAMP
+        WHERE filter_on <> excluded.filter_on
+    """, (None if group_ids is None else 1, json.dumps(list(group_ids or [])),
+          json.dumps(list(user_ids))))
+    return cursor.rowcount
+
+def _load_claims(user_id: int, version: int) -> dict:
+    """Build the claims of a user from the database."""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT EXISTS (SELECT 1 FROM moderators WHERE user_id = ?)
+        """, (user_id,))
+        moderator = bool(cursor.fetchone()[0])
+
+        if all(group.id < FILTER_MASK_BITS for group in get_taxonomy().groups):
+            cursor.execute("SELECT filter_groups FROM users WHERE id = ?", (user_id,))
+            row = cursor.fetchone()
+            groups = mask_groups(row['filter_groups']) if row else []
+        else:
+            # Group ids beyond the bitmask: read the rows themselves
+            cursor.execute("""
+                SELECT group_id FROM user_groups
+                WHERE user_id = ? AND filter_on = 1
+                ORDER BY group_id
+            """, (user_id,))
+            groups = [row['group_id'] for row in cursor.fetchall()]
+
+    return {
+        'user_id': user_id,
+        'version': version,
+        'checked': int(time.time()),
+        'moderator': moderator,
+        'groups': groups,
+    }
+
+def get_claims(fresh: bool = False) -> Optional[dict]:
+    """
+    The logged-in user's claims; None when anonymous. Claims checked less
+    than PERMISSION_CLAIMS_TTL seconds ago are used as they are unless
+    fresh is set, which write routes use to confirm the version first.
+    """
+    user_id = session.get('user_id')
+    if not user_id:
+        return None
+    if 'perms' in g and (g.perms_verified or not fresh):
+        return g.perms
+
+    claims = session.get('perms')
+    if claims and claims.get('user_id') != user_id:
+        claims = None
+    now = int(time.time())
+    verified = False
+
+    if claims and (fresh or now - claims['checked'] >= Config.PERMISSION_CLAIMS_TTL):
+        version = get_tag_versions([user_tag(user_id)])[user_tag(user_id)]
+        if version == claims['version']:
+            claims = dict(claims, checked=now)
+            session['perms'] = claims
+            verified = True
+        else:
+            claims = None
+
+    if claims is None:
+        version = get_tag_versions([user_tag(user_id)])[user_tag(user_id)]
+        claims = _load_claims(user_id, version)
+        session['perms'] = claims
+        verified = True
+
+    g.perms, g.perms_verified = claims, verified
+    return claims
+
+def is_admin() -> bool:
+    return session.get('user_id') == ADMIN_USER_ID
+
+def is_moderator(fresh: bool = False) -> bool:
+    """True for moderators; the administrator is checked separately."""
+    claims = get_claims(fresh)
+    return bool(claims and claims['moderator'])
+
+def filtered_groups(fresh: bool = False) -> List[int]:
+    """Group ids the user filters on (empty when anonymous)."""
+    claims = get_claims(fresh)
+    return claims['groups'] if claims else []
+
+class PermissionService:
+    """
+    Visibility of threads and posts for one viewer, decided for many ids
+    at once. Each check is a single set-based query (ids are passed as one
+    JSON array), and the *_condition methods return the same rules as SQL
+    for queries that list or search content.
+
+    A thread is visible to moderators, its creator, its thread_users, and
+    everyone when it has no ACL entries (threads.is_private = 0). A post
+    additionally needs to be unrestricted (no post_users or post_roles),
+    written by the viewer or restricted to them. The only role is
+    MODERATORS_ROLE, and moderators see everything, so role entries grant
+    nothing further here.
+    """
+
+    def __init__(self, cursor, user_id: Optional[int] = None, moderator: Optional[bool] = None):
+        self.cursor = cursor
+        self.user_id = user_id if user_id is not None else session.get('user_id')
+        if moderator is None:
+            moderator = bool(self.user_id) and self._is_moderator()
+        self.moderator = moderator
+
+    def _is_moderator(self) -> bool:
+        """From the session's claims for the logged-in viewer, else the database."""
+        if self.user_id == session.get('user_id'):
+            return is_moderator()
+        self.cursor.execute("""
+            SELECT EXISTS (SELECT 1 FROM moderators WHERE user_id = ?)
+        """, (self.user_id,))
+        return bool(self.cursor.fetchone()[0])
+
+    def thread_condition(self, alias: str = 't') -> Tuple[str, list]:
+        """SQL condition (and parameters) true for visible threads."""
+        if self.moderator:
+            return "1", []
+        if not self.user_id:
+            return f"{alias}.is_private = 0", []
+        return f"""({alias}.is_private = 0 OR {alias}.created_by = ?
+            OR {alias}.id IN (SELECT thread_id FROM thread_users WHERE user_id = ?))""", \
+            [self.user_id, self.user_id]
+
+    def visible_thread_ids(self) -> Tuple[str, list]:
+        """
+        SQL query of every visible thread id, for listings: public threads
+        plus the viewer's private ones, each branch an index seek
+        (idx_threads_private, idx_thread_users_user).
+        """
+        if self.moderator:
+            return "SELECT id FROM threads", []
+        if not self.user_id:
+            return "SELECT id FROM threads WHERE is_private = 0", []
+        return """
+            SELECT id FROM threads WHERE is_private = 0
+            UNION
+            SELECT thread_id FROM thread_users WHERE user_id = ?
+            UNION
+            SELECT id FROM threads WHERE is_private = 1 AND created_by = ?
+        """, [self.user_id, self.user_id]
+
+    def post_condition(self, alias: str = 'p') -> Tuple[str, list]:
+        """SQL condition true for visible posts of visible threads."""
+        if self.moderator:
+            return "1", []
+        thread, params = self.thread_condition('pt')
+        condition = f"""EXISTS (SELECT 1 FROM threads pt WHERE pt.id = {alias}.thread_id AND {thread})
+            AND ({alias}.created_by IS ?
+                 OR EXISTS (SELECT 1 FROM post_users WHERE post_id = {alias}.id AND user_id = ?)
+                 OR NOT (EXISTS (SELECT 1 FROM post_users WHERE post_id = {alias}.id)
+                         OR EXISTS (SELECT 1 FROM post_roles WHERE post_id = {alias}.id)))"""
+        return condition, params + [self.user_id, self.user_id]
+
+    def _visible(self, table: str, alias: str, condition: Tuple[str, list], ids: Iterable[int]) -> Set[int]:
+        ids = list(ids)
+        if not ids:
+            return set()
+        sql, params = condition
+        self.cursor.execute(f"""
+            SELECT {alias}.id FROM {table} {alias}
+            WHERE {alias}.id IN (SELECT value FROM json_each(?)) AND {sql}
+        """, [json.dumps(ids)] + params)
+        return {row[0] for row in self.cursor.fetchall()}
+
+    def visible_threads(self, thread_ids: Iterable[int]) -> Set[int]:
+        return self._visible('threads', 't', self.thread_condition('t'), thread_ids)
+
+    def visible_posts(self, post_ids: Iterable[int]) -> Set[int]:
+        return self._visible('posts', 'p', self.post_condition('p'), post_ids)
@@ -0,0 +1,115 @@
+"""
+Rate Limits Module
+==================
+
+Token buckets shared by all workers, backing auth.rate_limit.
+
+Each client key (the remote address) has a bucket of max_requests tokens
+that refills continuously over the window. A request spends its cost in
+tokens and is refused when the bucket holds less than that. Buckets are rows
+in a small SQLite file next to the main database, so every worker process
+enforces the same limit, and one UPSERT ... RETURNING both refills and
+charges the bucket, making each check O(1) and atomic.
+
+Memory is bounded: a bucket idle for a whole window is full again and is
+dropped, and beyond Config.RATE_LIMIT_MAX_KEYS the least recently used
+buckets are evicted.
+
+Usage:
+    allowed = get_limiter().consume(key, cost, capacity, window)
+"""
+
+import re
+import sqlite3
+import threading
+import time
+from typing import Optional
+from flask import request
+from backend.config import Config
+
+# Pasted images still inlined by older clients, decoded and resized on post
+INLINE_IMAGE_PATTERN = re.compile(r'data:image/[^;]+;base64,')
+
+class RateLimiter:
+    """Token buckets in a SQLite file, one row per key."""
+
+    def __init__(self, path: str, max_keys: int):
+        self.path = path
+        self.max_keys = max_keys
+        self.writes = 0
+        self.local = threading.local()
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS buckets (
+                    key TEXT PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    denied INTEGER NOT NULL DEFAULT 0
+                ) WITHOUT ROWID
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_buckets_updated ON buckets(updated_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        # One connection per thread; opening one costs more than the check
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=1)
+            conn.execute("PRAGMA synchronous = NORMAL")
+            self.local.conn = conn
+        return conn
+
+    def consume(self, key: str, cost: float, capacity: float, window: float) -> bool:
+        """Spend cost tokens from key's bucket; False if it holds too few."""
+        now = time.time()
+        rate = capacity / window
+        try:
+            with self._connect() as conn:
+                # Refill for the elapsed time, then charge only if affordable;
+                # every SET expression reads the old row
+                refilled = "MIN(:capacity, tokens + (:now - updated_at) * :rate)"
+                denied, = conn.execute(f"""
+                    INSERT INTO buckets (key, tokens, updated_at, denied)
+                    VALUES (:key, CASE WHEN :capacity >= :cost
+                                       THEN :capacity - :cost ELSE :capacity END,
+                            :now, :capacity < :cost)
+                    ON CONFLICT (key) DO UPDATE SET
+                        tokens = CASE WHEN {refilled} >= :cost
+                                      THEN {refilled} - :cost ELSE {refilled} END,
+                        updated_at = :now,
+                        denied = {refilled} < :cost
+                    RETURNING denied
+                """, {"key": key, "cost": cost, "capacity": capacity,
+                      "now": now, "rate": rate}).fetchone()
+                self.writes += 1
+                if self.writes % 1000 == 0:
+                    self._evict(conn, now - window)
+        except sqlite3.Error:
+            return True  # Fail open: a locked or broken store must not block the site
+        return not denied
+
+    def _evict(self, conn: sqlite3.Connection, idle_before: float):
+        # A bucket untouched for a window has refilled; dropping it is lossless
+        conn.execute("DELETE FROM buckets WHERE updated_at < ?", (idle_before,))
+        conn.execute("""
+            DELETE FROM buckets WHERE key IN (
+                SELECT key FROM buckets ORDER BY updated_at DESC
+                LIMIT -1 OFFSET ?
+            )
+        """, (self.max_keys,))
+
+_limiter: Optional[RateLimiter] = None
+
+def get_limiter() -> RateLimiter:
+    """The worker's rate limiter, opened on first use."""
+    global _limiter
+    if _limiter is None:
+        _limiter = RateLimiter(Config.RATE_LIMIT_PATH, Config.RATE_LIMIT_MAX_KEYS)
+    return _limiter
+
+def inline_image_cost(field: str = 'content'):
+    """Route cost: one token plus RATE_LIMIT_IMAGE_COST per inlined image."""
+    def cost() -> float:
+        images = len(INLINE_IMAGE_PATTERN.findall(request.form.get(field, '')))
+        return 1 + images * Config.RATE_LIMIT_IMAGE_COST
+    return cost
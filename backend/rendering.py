@@ -0,0 +1,200 @@
+"""
+Rendering Backends
+==================
+
+Markdown renderers and HTML sanitizers behind common interfaces, selected
+with Config.MARKDOWN_BACKEND and Config.SANITIZER_BACKEND. Every sanitizer
+enforces the same ALLOWED_TAGS / ALLOWED_ATTRS / ALLOWED_PROTOCOLS policy.
+
+Markdown backends:
+- python-markdown: Python-Markdown with extra, nl2br, fenced_code and tables
+- markdown-it: CommonMark via markdown-it-py with tables, footnotes,
+  definition lists and hard line breaks (optional dependency)
+
+Sanitizer backends:
+- bleach: html5lib based; disallowed tags are escaped and shown as text
+- nh3: Rust (ammonia) based; disallowed tags are removed (optional dependency)
+
+Use `python -m backend.maintenance compare-renderers` and
+`python -m backend.maintenance check-sanitizers` to check a backend
+against the stored corpus before switching.
+"""
+
+import functools
+import hashlib
+import threading
+from abc import ABC, abstractmethod
+from typing import Dict, Optional, Type
+import bleach
+import markdown
+from bleach.sanitizer import Cleaner
+from backend.config import Config
+
+# Markdown extensions used for all post and wiki content
+MARKDOWN_EXTENSIONS = ['extra', 'nl2br', 'fenced_code', 'tables']
+
+class MarkdownRenderer(ABC):
+    """Converts Markdown to (unsanitized) HTML."""
+
+    name: str = None
+
+    @abstractmethod
+    def render(self, content: str) -> str:
+        """HTML for content."""
+
+class PythonMarkdownRenderer(MarkdownRenderer):
+    """Python-Markdown, the original renderer."""
+
+    name = 'python-markdown'
+
+    def __init__(self):
+        self.md = markdown.Markdown(extensions=MARKDOWN_EXTENSIONS)
+
+    def render(self, content: str) -> str:
+        self.md.reset()
+        return self.md.convert(content)
+
+class MarkdownItRenderer(MarkdownRenderer):
+    """CommonMark renderer with the closest equivalents of our extensions."""
+
+    name = 'markdown-it'
+
+    def __init__(self):
+        try:
+            from markdown_it import MarkdownIt
+            from mdit_py_plugins.deflist import deflist_plugin
+            from mdit_py_plugins.footnote import footnote_plugin
+        except ImportError:
+            raise ImportError(
+                "The markdown-it backend needs markdown-it-py and mdit-py-plugins"
+            )
+
+        # breaks=True matches nl2br; html=True matches Python-Markdown,
+        # the sanitizer decides what survives
+        self.md = (
+            MarkdownIt('commonmark', {'breaks': True, 'html': True})
+            .enable('table')
+            .use(footnote_plugin)
+            .use(deflist_plugin)
+        )
+
+    def render(self, content: str) -> str:
+        return self.md.render(content)
+
+RENDERERS: Dict[str, Type[MarkdownRenderer]] = {
+    PythonMarkdownRenderer.name: PythonMarkdownRenderer,
+    MarkdownItRenderer.name: MarkdownItRenderer,
+}
+
+# Bump when rendering changes in a way the settings below do not capture,
+# e.g. the wiki link syntax; stored renders are rebuilt on next view or by
+# `python -m backend.maintenance rerender`
+RENDER_VERSION = 1
+
+# --- Sanitizers ---
+
+# HTML allowed through the sanitizer
+ALLOWED_TAGS = frozenset(bleach.ALLOWED_TAGS) | {
+    'img', 'p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
+    'table', 'thead', 'tbody', 'tr', 'th', 'td',
+    'hr', 'br', 'pre', 'code'
+}
+ALLOWED_ATTRS = {
+    **bleach.ALLOWED_ATTRIBUTES,
+    'img': ['src', 'alt', 'title'],
+    'a': ['href', 'title'],
+    'code': ['class']
+}
+# URL schemes allowed in href/src; relative URLs are always allowed
+ALLOWED_PROTOCOLS = frozenset(bleach.ALLOWED_PROTOCOLS)
+
+class Sanitizer(ABC):
+    """Reduces HTML to the allowed tags, attributes and URL schemes."""
+
+    name: str = None
+
+    @abstractmethod
+    def clean(self, html: str) -> str:
+        """html reduced to the allowed policy."""
+
+class BleachSanitizer(Sanitizer):
+    """bleach, the original sanitizer."""
+
+    name = 'bleach'
+
+    def __init__(self):
+        self.cleaner = Cleaner(
+            tags=ALLOWED_TAGS,
+            attributes=ALLOWED_ATTRS,
+            protocols=ALLOWED_PROTOCOLS,
+            strip=False
+        )
+
+    def clean(self, html: str) -> str:
+        return self.cleaner.clean(html)
+
+class Nh3Sanitizer(Sanitizer):
+    """ammonia via nh3, several times faster than html5lib."""
+
+    name = 'nh3'
+
+    def __init__(self):
+        try:
+            import nh3
+        except ImportError:
+            raise ImportError("The nh3 sanitizer backend needs nh3")
+        if not hasattr(nh3, 'Cleaner'):
+            raise ImportError("The nh3 sanitizer backend needs nh3 0.3.0 or later")
+
+        # link_rel=None: bleach does not add rel to links either
+        self.cleaner = nh3.Cleaner(
+            tags=set(ALLOWED_TAGS),
+            attributes={tag: set(attrs) for tag, attrs in ALLOWED_ATTRS.items()},
+            url_schemes=set(ALLOWED_PROTOCOLS),
+            link_rel=None
+        )
+
+    def clean(self, html: str) -> str:
+        return self.cleaner.clean(html)
+
+SANITIZERS: Dict[str, Type[Sanitizer]] = {
+    BleachSanitizer.name: BleachSanitizer,
+    Nh3Sanitizer.name: Nh3Sanitizer,
+}
+
+# Renderers and sanitizers keep parser state, so each thread builds its own once
+_renderers = threading.local()
+_sanitizers = threading.local()
+
+def get_renderer(name: Optional[str] = None) -> MarkdownRenderer:
+    """Return this thread's renderer for name (default: Config.MARKDOWN_BACKEND)."""
+    name = name or Config.MARKDOWN_BACKEND
+    cache = _renderers.__dict__
+    if name not in cache:
+        if name not in RENDERERS:
+            raise ValueError(f"Unknown Markdown backend: {name}")
+        cache[name] = RENDERERS[name]()
+    return cache[name]
+
+def get_sanitizer(name: Optional[str] = None) -> Sanitizer:
+    """Return this thread's sanitizer for name (default: Config.SANITIZER_BACKEND)."""
+    name = name or Config.SANITIZER_BACKEND
+    cache = _sanitizers.__dict__
+    if name not in cache:
+        if name not in SANITIZERS:
+            raise ValueError(f"Unknown sanitizer backend: {name}")
+        cache[name] = SANITIZERS[name]()
+    return cache[name]
+
+@functools.lru_cache(maxsize=None)
+def _render_version(markdown_backend: str, sanitizer_backend: str) -> str:
+    policy = (
+        RENDER_VERSION, markdown_backend, MARKDOWN_EXTENSIONS, sanitizer_backend,
+        sorted(ALLOWED_TAGS), sorted((tag, sorted(attrs)) for tag, attrs in ALLOWED_ATTRS.items()),
+        sorted(ALLOWED_PROTOCOLS),
+    )
+    return hashlib.sha1(repr(policy).encode()).hexdigest()[:16]
+
+def render_version() -> str:
+    """Fingerprint of everything that affects rendered HTML."""
+    return _render_version(Config.MARKDOWN_BACKEND, Config.SANITIZER_BACKEND)
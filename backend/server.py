@@ -26,6 +26,7 @@ from backend.auth import auth_blueprint
 from backend.forum import forum_blueprint
 from backend.wiki import wiki_blueprint
 from backend.admin import admin_blueprint
+from backend import permissions
 from backend.config import Config
 from datetime import datetime
 from backend.database import get_db
@@ -57,17 +58,11 @@ app.register_blueprint(forum_blueprint, url_prefix="/forum")
 app.register_blueprint(wiki_blueprint, url_prefix="/wiki")
 app.register_blueprint(admin_blueprint, url_prefix="/admin")
 
-# Get moderators for navbar
+# Moderator status for the navbar, from the session's permission claims
 @app.context_processor
-def inject_moderators():
-    """Add moderators to template context for navbar."""
-    moderators = []
-    if session.get('user_id'):
-        with get_db() as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT user_id FROM moderators")
-            moderators = cursor.fetchall()
-    return {'moderators': moderators}
+def inject_permissions():
+    """Add the current user's moderator status to the template context."""
+    return {'user_is_moderator': permissions.is_moderator()}
 
 @app.route("/")
 def home():
@@ -0,0 +1,95 @@
+"""
+Taxonomy Module
+===============
+
+Groups and their categories, cached per worker.
+
+The taxonomy is seeded by init_group_categories and hardly ever changes,
+yet the thread list, the new thread form and reports all read it. It is
+loaded once into an immutable Taxonomy stamped with the version of the
+'taxonomy' cache tag, which triggers on groups and group_categories bump
+(see init_group_categories.py). Each request compares that version, one
+primary key lookup, and reloads only when a group or category has changed.
+
+The version also keys HTTP caching: the categories API is fetched with
+?v=<version> and may then be cached by browsers for
+Config.TAXONOMY_MAX_AGE, since a change produces a different URL.
+
+Usage:
+    taxonomy = get_taxonomy()
+    for category in taxonomy.categories_of(group_id):
+        ...
+"""
+
+import threading
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Mapping, NamedTuple, Optional, Tuple
+from backend.database import get_db
+from backend.page_cache import TAXONOMY_TAG, get_tag_versions
+
+MODERATION_GROUP = 'Moderation'
+REPORT_CATEGORY = 'Reported Post'
+
+class Group(NamedTuple):
+    id: int
+    grouptext: str
+
+class Category(NamedTuple):
+    id: int
+    group_id: int
+    category: str
+
+@dataclass(frozen=True)
+class Taxonomy:
+    version: int
+    groups: Tuple[Group, ...]  # Ordered by name
+    categories: Mapping[int, Tuple[Category, ...]]  # group id -> categories by name
+
+    def group_named(self, name: str) -> Optional[Group]:
+        return next((group for group in self.groups if group.grouptext == name), None)
+
+    def categories_of(self, group_id: Optional[int]) -> Tuple[Category, ...]:
+        return self.categories.get(group_id, ())
+
+    def category_named(self, group_id: int, name: str) -> Optional[Category]:
+        return next((category for category in self.categories_of(group_id)
+                     if category.category == name), None)
+
+_taxonomy: Optional[Taxonomy] = None
+_lock = threading.Lock()
+
+def _load(version: int) -> Taxonomy:
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, grouptext FROM groups ORDER BY grouptext")
+        groups = tuple(Group(row['id'], row['grouptext']) for row in cursor.fetchall())
+        cursor.execute("""
+            SELECT id, group_id, category FROM group_categories
+            ORDER BY group_id, category
+        """)
+        categories = {}
+        for row in cursor.fetchall():
+            categories.setdefault(row['group_id'], []).append(
+                Category(row['id'], row['group_id'], row['category'])
+            )
+    return Taxonomy(
+        version=version,
+        groups=groups,
+        categories=MappingProxyType({
+            group_id: tuple(group_categories)
+            for group_id, group_categories in categories.items()
+        }),
+    )
+
+def get_taxonomy() -> Taxonomy:
+    """The current taxonomy, reloaded when its cache tag has been bumped."""
+    global _taxonomy
+    version = get_tag_versions([TAXONOMY_TAG])[TAXONOMY_TAG]
+    taxonomy = _taxonomy
+    if taxonomy is None or taxonomy.version != version:
+        with _lock:
+            if _taxonomy is None or _taxonomy.version != version:
+                _taxonomy = _load(version)
+            taxonomy = _taxonomy
+    return taxonomy
@@ -0,0 +1,134 @@
+"""
+Usernames Module
+================
+
+Allocation of random usernames from the syllable namespace.
+
+A username is three consonant-vowel syllables, so the namespace holds
+65^3 = 274,625 names, each identified by its index. The username_pool table
+is a single row: a random key, a counter and a bitmap of the names users
+already held when the pool was built. The key selects a pseudorandom
+permutation of the namespace (a Feistel network), and allocation hands out
+the name at the counter's position and advances it. Each name is reached
+once, so nothing is retried as the namespace fills; only names set in the
+bitmap are stepped over, at most once each over the life of the pool.
+
+The pool is built by reset_database for new databases and by
+`python -m backend.maintenance username-pool --build` for existing ones,
+which also reports how much of the namespace is left.
+
+Usage:
+    with get_db() as conn:
+        username = allocate_username(conn.cursor())
+"""
+
+import hashlib
+import secrets
+from typing import Optional, Tuple
+
+# 65 consonant-vowel pairs; three make a name or token
+SYLLABLES = [c + v for c in "bfgkhlnrstvwy" for v in "aeiou"]
+USERNAME_SYLLABLES = 3
+NAMESPACE_SIZE = len(SYLLABLES) ** USERNAME_SYLLABLES
+
+# Feistel network over the smallest even bit width covering the namespace;
+# indexes past NAMESPACE_SIZE are permuted again (cycle walking)
+_HALF_BITS = ((NAMESPACE_SIZE - 1).bit_length() + 1) // 2
+_HALF_MASK = (1 << _HALF_BITS) - 1
+_ROUNDS = 4
+
+class UsernamesExhausted(Exception):
+    """Every name in the namespace has been handed out."""
+
+def username_at(index: int) -> str:
+    """The username with the given index in the namespace."""
+    syllables = []
+    for _ in range(USERNAME_SYLLABLES):
+        index, syllable = divmod(index, len(SYLLABLES))
+        syllables.append(SYLLABLES[syllable])
+    return "".join(reversed(syllables))
+
+def username_index(username: str) -> Optional[int]:
+    """Inverse of username_at; None for names outside the namespace."""
+    if len(username) != 2 * USERNAME_SYLLABLES:
+        return None
+    index = 0
+    for i in range(0, len(username), 2):
+        try:
+            index = index * len(SYLLABLES) + SYLLABLES.index(username[i:i + 2])
+        except ValueError:
+            return None
+    return index
+
+def permute(key: bytes, position: int) -> int:
+    """The name index at a position of the permutation selected by key."""
+    index = position
+    while True:
+        left, right = index >> _HALF_BITS, index & _HALF_MASK
+        for i in range(_ROUNDS):
+            digest = hashlib.blake2b(bytes([i]) + right.to_bytes(4, "big"),
+                                     key=key, digest_size=4).digest()
+            left, right = right, left ^ (int.from_bytes(digest, "big") & _HALF_MASK)
+        index = (left << _HALF_BITS) | right
+        if index < NAMESPACE_SIZE:
+            return index
+
+def create_username_pool(cursor):
+    """(Re)build the pool from every name not taken by an existing user."""
+    cursor.execute("DROP TABLE IF EXISTS username_pool")
+    cursor.execute("""
+        CREATE TABLE username_pool (
+            id INTEGER PRIMARY KEY CHECK (id = 0),
+            key BLOB NOT NULL,
+            next INTEGER NOT NULL,
+            free INTEGER NOT NULL,
+            taken BLOB NOT NULL
+        )
+    """)
+    cursor.execute("SELECT username FROM users")
+    taken = bytearray((NAMESPACE_SIZE + 7) // 8)
+    free = NAMESPACE_SIZE
+    for row in cursor.fetchall():
+        index = username_index(row[0])
+        if index is not None and not taken[index // 8] >> (index % 8) & 1:
+            taken[index // 8] |= 1 << (index % 8)
+            free -= 1
+    cursor.execute("""
+        INSERT INTO username_pool (id, key, next, free, taken)
+        VALUES (0, ?, 0, ?, ?)
+    """, (secrets.token_bytes(16), free, bytes(taken)))
+
+def allocate_username(cursor) -> str:
+    """
+    Take the next free username of the pool's permutation, which is
+    uniformly random to anyone without the key.
+    Raises UsernamesExhausted when none is left and sqlite3.OperationalError
+    when the pool has not been built.
+    """
+    # Claiming a name first takes the write lock, so concurrent
+    # registrations cannot read the same position
+    cursor.execute("""
+        UPDATE username_pool SET free = free - 1
+        WHERE id = 0 AND free > 0
+        RETURNING key, next
+    """)
+    row = cursor.fetchone()
+    if row is None:
+        raise UsernamesExhausted()
+    key, position = row[0], row[1]
+
+    # free > 0 guarantees an untaken name at or after position
+    while True:
+        name = permute(key, position)
+        position += 1
+        cursor.execute("SELECT substr(taken, ?, 1) FROM username_pool WHERE id = 0",
+                       (name // 8 + 1,))
+        if not cursor.fetchone()[0][0] >> (name % 8) & 1:
+            break
+    cursor.execute("UPDATE username_pool SET next = ? WHERE id = 0", (position,))
+    return username_at(name)
+
+def pool_status(cursor) -> Tuple[int, int]:
+    """(free, total) names in the namespace."""
+    cursor.execute("SELECT COALESCE(MAX(free), 0) FROM username_pool")
+    return cursor.fetchone()[0], NAMESPACE_SIZE
@@ -0,0 +1,92 @@
+// Image paste handling for post editors.
+//
+// Pasted images are downscaled in the browser to the server's maximum
+// dimension, uploaded as multipart form data and embedded as a Markdown
+// image pointing at the returned URL.
+//
+// Usage: <textarea data-upload-url="..." data-max-dimension="1200">
+//        attachImageUpload(textarea);
+
+async function downscaleImage(blob, maxDimension) {
+    const bitmap = await createImageBitmap(blob);
+    const ratio = Math.min(maxDimension / bitmap.width, maxDimension / bitmap.height);
+
+    // Small enough already - send the original bytes
+    if (ratio >= 1) {
+        bitmap.close();
+        return blob;
+    }
+
+    const canvas = document.createElement('canvas');
+    canvas.width = Math.round(bitmap.width * ratio);
+    canvas.height = Math.round(bitmap.height * ratio);
+    canvas.getContext('2d').drawImage(bitmap, 0, 0, canvas.width, canvas.height);
+    bitmap.close();
+
+    // Keep PNG for screenshots, everything else becomes JPEG
+    const type = blob.type === 'image/png' ? 'image/png' : 'image/jpeg';
+    return new Promise(resolve => canvas.toBlob(resolve, type, 0.85));
+}
+
+async function uploadImage(textarea, blob) {
+    const maxDimension = parseInt(textarea.dataset.maxDimension, 10) || 1200;
+    const form = textarea.closest('form');
+    const csrfInput = form ? form.querySelector('input[name="csrf_token"]') : null;
+
+    const image = await downscaleImage(blob, maxDimension);
+    const body = new FormData();
+    body.append('image', image, 'pasted-image');
+
+    const response = await fetch(textarea.dataset.uploadUrl, {
+        method: 'POST',
+        headers: csrfInput ? {'X-CSRFToken': csrfInput.value} : {},
+        body: body
+    });
+    const result = await response.json();
+    if (!response.ok) {
+        throw new Error(result.error || 'Upload failed');
+    }
+    return result.url;
+}
+
+function attachImageUpload(textarea) {
+    if (!textarea) {
+        return;
+    }
+
+    textarea.addEventListener('paste', async function(e) {
+        const items = (e.clipboardData || e.originalEvent.clipboardData).items;
+
+        // Clipboard items can only be read while the event is dispatched
+        const files = [];
+        for (let item of items) {
+            if (item.type.indexOf('image') === 0) {
+                files.push(item.getAsFile());
+            }
+        }
+        if (!files.length) {
+            return;
+        }
+        e.preventDefault();
+
+        const cursor = this.selectionStart;
+        const links = [];
+        for (let file of files) {
+            try {
+                const url = await uploadImage(this, file);
+                links.push(`![Pasted image](${url})`);
+            } catch (error) {
+                console.error('Error uploading image:', error);
+                alert('Image upload failed: ' + error.message);
+            }
+        }
+
+        // Insert once all uploads are done, so every link lands at the paste position
+        if (links.length) {
+            const text = this.value;
+            this.value = text.substring(0, cursor) +
+                links.join('\n') +
+                text.substring(cursor);
+        }
+    });
+}
@@ -0,0 +1,77 @@
+// Live updates for thread pages.
+//
+// New replies are fetched as pre-rendered HTML from the thread's
+// posts endpoint and appended to the post list, instead of reloading
+// the whole page. When the thread has an events URL the server pushes
+// new_post / edit_post notifications over Server-Sent Events; polling
+// is the fallback for browsers without EventSource.
+//
+// Usage: <div class="post-list" data-posts-url="..." data-events-url="...">
+//        watchThread(postList);
+
+const THREAD_POLL_INTERVAL = 30000;
+
+function lastPostId(postList) {
+    const posts = postList.querySelectorAll('[data-post-id]');
+    return posts.length ? posts[posts.length - 1].dataset.postId : 0;
+}
+
+async function loadNewPosts(postList) {
+    const url = `${postList.dataset.postsUrl}?after=${lastPostId(postList)}`;
+    const response = await fetch(url, {credentials: 'same-origin'});
+
+    // 204: nothing new
+    if (response.status !== 200) {
+        return 0;
+    }
+    const template = document.createElement('template');
+    template.innerHTML = await response.text();
+    const count = template.content.querySelectorAll('[data-post-id]').length;
+    postList.appendChild(template.content);
+    return count;
+}
+
+async function reloadPost(postList, postId) {
+    const current = postList.querySelector(`[data-post-id="${postId}"]`);
+    if (!current) {
+        return;
+    }
+    const url = `${postList.dataset.postsUrl}?id=${postId}`;
+    const response = await fetch(url, {credentials: 'same-origin'});
+    if (response.status !== 200) {
+        return;
+    }
+    const template = document.createElement('template');
+    template.innerHTML = await response.text();
+    const updated = template.content.querySelector(`[data-post-id="${postId}"]`);
+    if (updated) {
+        current.replaceWith(updated);
+    }
+}
+
+function watchThread(postList) {
+    if (!postList || !postList.dataset.postsUrl) {
+        return;
+    }
+
+    if (window.EventSource && postList.dataset.eventsUrl) {
+        // The browser reconnects on its own, resuming from Last-Event-ID
+        const source = new EventSource(postList.dataset.eventsUrl);
+        const logError = error => console.error('Error loading posts:', error);
+        source.addEventListener('new_post', function() {
+            loadNewPosts(postList).catch(logError);
+        });
+        source.addEventListener('edit_post', function(event) {
+            reloadPost(postList, parseInt(event.data, 10)).catch(logError);
+        });
+        return;
+    }
+
+    setInterval(function() {
+        if (document.visibilityState === 'visible') {
+            loadNewPosts(postList).catch(error => {
+                console.error('Error loading new posts:', error);
+            });
+        }
+    }, THREAD_POLL_INTERVAL);
+}